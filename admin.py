@@ -0,0 +1,285 @@
+"""Headless maintenance commands for the inventory database.
+
+    python admin.py check-plans [--db inventory.db]
+    python admin.py migrate [--dry-run] [--to VERSION] [--chunk-size ROWS]
+    python admin.py rebuild-summaries [--from DAY] [--to DAY]
+    python admin.py snapshot-stock
+    python admin.py check-stock [--full]
+    python admin.py stock-at CODE MOMENT
+    python admin.py adjust-stock CODE QUANTITY [--return] [--reference ID] [--note TEXT]
+    python admin.py export {products,sales,goods_receiving} PATH [--from DAY] [--to DAY] [--product CODE]
+    python admin.py archive YEAR [--chunk-size ROWS] [--vacuum]
+    python admin.py valuation
+    python admin.py rebuild-valuation
+    python admin.py backup DIRECTORY [--keep N] [--gzip] [--full-check] [--every HOURS]
+"""
+
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+
+from archive import ARCHIVE_CHUNK_SIZE, archive_year
+from backup import BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE, BackupError, backup
+from database import EXPORTS, DatabaseManager, InventoryError
+from exporter import FORMATS, export_table
+from migrations import MIGRATION_CHUNK_SIZE, SCHEMA_VERSION
+from pricing import format_money, format_quantity, to_milli
+from valuation import rebuild_valuation
+
+
+def check_plans(db_manager, args):
+    failures = 0
+    for name, details, scans, allow_scan in db_manager.explain_query_plans(use_statistics=args.with_stats):
+        if not scans:
+            status = "ok"
+        elif allow_scan:
+            status = "scan ok"
+        else:
+            status = "FULL SCAN"
+            failures += 1
+        print(f"[{status:>9}] {name}")
+        for detail in details:
+            print(f"              {detail}")
+    print(f"{failures} quer{'y' if failures == 1 else 'ies'} fall back to a full table scan")
+    return 1 if failures else 0
+
+
+def migrate(db_manager, args):
+    print(f"schema version {db_manager.schema_version()}, latest {SCHEMA_VERSION}")
+    if args.dry_run:
+        plan = db_manager.migration_plan(args.to)
+        print("\n".join(plan) if plan else "nothing to do")
+        return 0
+    started = time.perf_counter()
+    applied = db_manager.migrate(args.to, args.chunk_size, progress=print)
+    print(f"applied {len(applied)} migration(s) in {time.perf_counter() - started:.1f}s; "
+          f"schema version {db_manager.schema_version()}")
+    return 0
+
+
+def rebuild_summaries(db_manager, args):
+    started = time.perf_counter()
+    months = db_manager.rebuild_summaries(args.first_day, args.last_day, progress=print)
+    print(f"rebuilt {months} month(s) of summaries in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def find_product(db_manager, code):
+    product = db_manager.find_product_by_code(code)
+    if product is None:
+        raise SystemExit(f"no product with barcode or SKU {code!r}")
+    return product
+
+
+def snapshot_stock(db_manager, args):
+    started = time.perf_counter()
+    products = db_manager.take_stock_snapshot()
+    print(f"snapshot of {products} product(s) taken in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def check_stock(db_manager, args):
+    started = time.perf_counter()
+    discrepancies = 0
+    for product_id, sku_id, stock, ledger in db_manager.stock_discrepancies(full=args.full):
+        print(f"{sku_id} (id {product_id}): stock {format_quantity(stock)}, ledger {format_quantity(ledger)}")
+        discrepancies += 1
+    print(f"{discrepancies} product(s) disagree with the stock ledger "
+          f"({time.perf_counter() - started:.1f}s)")
+    return 1 if discrepancies else 0
+
+
+def stock_at(db_manager, args):
+    product = find_product(db_manager, args.code)
+    print(f"{product.sku_id} {product.product_name}: {format_quantity(db_manager.stock_at(product.id, args.moment))} "
+          f"{product.unit_of_measurement} before {args.moment}")
+    return 0
+
+
+def adjust_stock(db_manager, args):
+    product = find_product(db_manager, args.code)
+    kind = "return" if args.is_return else "adjustment"
+    try:
+        movement_id = db_manager.post_stock_movement(kind, product.id, to_milli(args.quantity), args.user,
+                                                     reference_id=args.reference, note=args.note)
+    except InventoryError as e:
+        print(e)
+        return 1
+    print(f"stock {kind} #{movement_id} recorded for {product.sku_id}")
+    return 0
+
+
+def export(db_manager, args):
+    product_id = find_product(db_manager, args.product).id if args.product else None
+    started = time.perf_counter()
+    rows = export_table(db_manager, args.table, args.path, fmt=args.format, compress=args.gzip or None,
+                        first_day=args.first_day, last_day=args.last_day, product_id=product_id)
+    print(f"exported {rows} {args.table} row(s) to {args.path} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def archive(db_manager, args):
+    started = time.perf_counter()
+    try:
+        moved = archive_year(db_manager, args.year, args.chunk_size, progress=print)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"archived {sum(moved.values())} row(s) of {args.year} in {time.perf_counter() - started:.1f}s")
+    if args.vacuum:
+        # Hands the freed pages back to the file system; deleted rows
+        # otherwise leave free pages that later postings reuse
+        started = time.perf_counter()
+        db_manager.connection.execute("VACUUM")
+        print(f"vacuumed in {time.perf_counter() - started:.1f}s")
+    print(f"{db_manager.db_name}: {os.path.getsize(db_manager.db_name) / 1048576:.1f} MiB")
+    return 0
+
+
+def valuation(db_manager, args):
+    quantity, average_value, fifo_value = db_manager.valuation_totals()
+    print(f"stock on hand: {format_quantity(quantity)} units")
+    print(f"value at weighted-average cost: {format_money(average_value)}")
+    print(f"value at FIFO cost: {format_money(fifo_value)}")
+    return 0
+
+
+def rebuild_valuation_command(db_manager, args):
+    started = time.perf_counter()
+    rebuild_valuation(db_manager, progress=print)
+    print(f"valuation rebuilt in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def backup_command(db_manager, args):
+    while True:
+        started = time.perf_counter()
+        try:
+            path, files = backup(db_manager.db_name, args.directory, args.keep, args.gzip, args.full_check,
+                                 args.pages, args.pause, progress=print)
+        except BackupError as e:
+            print(e)
+            return 1
+        seconds = time.perf_counter() - started
+        size = sum(database_size for _name, database_size, _stored, _seconds in files) / 1048576
+        stored = sum(stored for _name, _database_size, stored, _seconds in files) / 1048576
+        print(f"backed up {len(files)} file(s), {size:.1f} MiB stored as {stored:.1f} MiB, to {path} "
+              f"in {seconds:.1f}s ({size / max(seconds, 1e-6):.1f} MiB/s)")
+        if not args.every:
+            return 0
+        # Scheduled from the start of each run, so runs do not drift
+        time.sleep(max(args.every * 3600 - seconds, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="inventory.db", help="database file (default: inventory.db)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plans_parser = subparsers.add_parser("check-plans",
+                                         help="EXPLAIN QUERY PLAN the query catalog and fail on full scans")
+    plans_parser.add_argument("--with-stats", action="store_true",
+                              help="plan against the live database including its ANALYZE statistics")
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply pending schema migrations")
+    migrate_parser.add_argument("--dry-run", action="store_true",
+                                help="list the pending migrations and their steps without applying them")
+    migrate_parser.add_argument("--to", type=int, default=SCHEMA_VERSION, metavar="VERSION",
+                                help="stop after this schema version (default: latest)")
+    migrate_parser.add_argument("--chunk-size", type=int, default=MIGRATION_CHUNK_SIZE, metavar="ROWS",
+                                help=f"rows copied per transaction by table rebuilds (default: {MIGRATION_CHUNK_SIZE})")
+
+    summaries_parser = subparsers.add_parser("rebuild-summaries",
+                                             help="recompute the daily sales and receiving summaries")
+    summaries_parser.add_argument("--from", dest="first_day", metavar="DAY",
+                                  help="first day to rebuild, YYYY-MM-DD (default: earliest activity)")
+    summaries_parser.add_argument("--to", dest="last_day", metavar="DAY",
+                                  help="last day to rebuild, YYYY-MM-DD (default: latest activity)")
+
+    subparsers.add_parser("snapshot-stock",
+                          help="checkpoint the stock of every product that moved since the last snapshot")
+
+    check_stock_parser = subparsers.add_parser("check-stock",
+                                               help="verify every product's stock against the stock ledger")
+    check_stock_parser.add_argument("--full", action="store_true",
+                                    help="replay the whole ledger instead of starting from the snapshots")
+
+    stock_at_parser = subparsers.add_parser("stock-at", help="stock of a product at a point in time")
+    stock_at_parser.add_argument("code", help="barcode or SKU")
+    stock_at_parser.add_argument("moment", help="UTC 'YYYY-MM-DD HH:MM:SS', or YYYY-MM-DD for the start of the day")
+
+    adjust_parser = subparsers.add_parser("adjust-stock", help="record a stock adjustment or customer return")
+    adjust_parser.add_argument("code", help="barcode or SKU")
+    adjust_parser.add_argument("quantity", type=Decimal, help="quantity added (negative to remove stock)")
+    adjust_parser.add_argument("--return", dest="is_return", action="store_true",
+                               help="record a customer return instead of an adjustment")
+    adjust_parser.add_argument("--reference", type=int, metavar="ID", help="sales invoice of a return")
+    adjust_parser.add_argument("--note", help="reason for the movement")
+    adjust_parser.add_argument("--user", default="admin", help="recorded as the movement's author")
+
+    export_parser = subparsers.add_parser("export", help="stream a table to a CSV or JSON Lines file")
+    export_parser.add_argument("table", choices=list(EXPORTS))
+    export_parser.add_argument("path", help="output file; .csv or .jsonl, with .gz appended to compress")
+    export_parser.add_argument("--format", choices=FORMATS, help="output format (default: from the file name)")
+    export_parser.add_argument("--gzip", action="store_true", help="compress whatever the file name says")
+    export_parser.add_argument("--from", dest="first_day", metavar="DAY",
+                               help="first day of transactions to export, YYYY-MM-DD")
+    export_parser.add_argument("--to", dest="last_day", metavar="DAY",
+                               help="last day of transactions to export, YYYY-MM-DD")
+    export_parser.add_argument("--product", metavar="CODE", help="only this product (barcode or SKU)")
+
+    archive_parser = subparsers.add_parser("archive",
+                                           help="move a closed year's sales and receipts into an archive file")
+    archive_parser.add_argument("year", type=int)
+    archive_parser.add_argument("--chunk-size", type=int, default=ARCHIVE_CHUNK_SIZE, metavar="ROWS",
+                                help=f"rows moved per transaction (default: {ARCHIVE_CHUNK_SIZE})")
+    archive_parser.add_argument("--vacuum", action="store_true",
+                                help="shrink the database file afterwards (blocks other terminals while it runs)")
+
+    subparsers.add_parser("valuation", help="value the stock on hand at weighted-average and FIFO cost")
+    subparsers.add_parser("rebuild-valuation",
+                          help="recompute cost layers, product costs and margins from the whole history")
+
+    backup_parser = subparsers.add_parser("backup",
+                                          help="copy the database and its archives while terminals keep posting")
+    backup_parser.add_argument("directory", help="where backup sets are written")
+    backup_parser.add_argument("--keep", type=int, default=BACKUP_KEEP, metavar="N",
+                               help=f"backup sets kept, oldest removed first (default: {BACKUP_KEEP})")
+    backup_parser.add_argument("--gzip", action="store_true", help="compress the copies")
+    backup_parser.add_argument("--full-check", action="store_true",
+                               help="run integrity_check instead of quick_check on the copies (slower)")
+    backup_parser.add_argument("--every", type=float, metavar="HOURS",
+                               help="keep running, starting a backup every HOURS hours")
+    backup_parser.add_argument("--pages", type=int, default=BACKUP_PAGES_PER_STEP,
+                               help=f"pages copied per step (default: {BACKUP_PAGES_PER_STEP})")
+    backup_parser.add_argument("--pause", type=float, default=BACKUP_STEP_PAUSE, metavar="SECONDS",
+                               help=f"pause between steps (default: {BACKUP_STEP_PAUSE})")
+
+    args = parser.parse_args()
+    commands = {
+        "check-plans": check_plans,
+        "migrate": migrate,
+        "rebuild-summaries": rebuild_summaries,
+        "snapshot-stock": snapshot_stock,
+        "check-stock": check_stock,
+        "stock-at": stock_at,
+        "adjust-stock": adjust_stock,
+        "export": export,
+        "archive": archive,
+        "valuation": valuation,
+        "rebuild-valuation": rebuild_valuation_command,
+        "backup": backup_command,
+    }
+
+    # migrate runs the migrations itself, with progress output
+    db_manager = DatabaseManager(args.db, auto_migrate=args.command != "migrate")
+    try:
+        return commands[args.command](db_manager, args)
+    finally:
+        db_manager.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
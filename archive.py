@@ -0,0 +1,117 @@
+import glob
+import os
+import re
+import sqlite3
+
+# Tables whose rows move out of the live database once their year is
+# closed, headers before their lines: (table, date column, condition a row
+# must also meet, or None). The stock ledger goes up to the latest stock
+# snapshot, which the stock check and stock_at start from, and cost layers
+# once used up, as FIFO only reads open ones. Products, parties, snapshots,
+# product costs and the report summaries (margins included) stay in the
+# live file: the reports read them for every year, at one row per day or
+# product rather than per posting.
+ARCHIVE_TABLES = (
+    ("sales_invoices", "date_sold", None),
+    ("sales", "date_sold", None),
+    ("goods_receipts", "date_received", None),
+    ("goods_receiving", "date_received", None),
+    ("stock_movements", "moved_at", "id <= (SELECT COALESCE(MAX(movement_id), 0) FROM main.stock_snapshots)"),
+    ("cost_layers", "created_at", "remaining = 0"),
+)
+
+# Rows moved per transaction; each batch holds the write lock only for the
+# delete from the live table
+ARCHIVE_CHUNK_SIZE = 10000
+
+
+def archive_path(db_name, year):
+    # inventory.db -> inventory-archive-2024.db, next to the live database
+    return f"{os.path.splitext(db_name)[0]}-archive-{year}.db"
+
+
+def archive_files(db_name):
+    # {year: path} of the archives that exist for db_name
+    prefix = f"{os.path.splitext(db_name)[0]}-archive-"
+    files = {}
+    for path in glob.glob(glob.escape(prefix) + "*.db"):
+        match = re.fullmatch(r"(\d{4})\.db", path[len(prefix):])
+        if match:
+            files[int(match.group(1))] = path
+    return dict(sorted(files.items()))
+
+
+def create_archive(db_manager, path):
+    # Gives an archive file the live schema of the archived tables and their
+    # indexes (no triggers: nothing is posted into an archive). Safe to
+    # call on an existing archive.
+    schema = db_manager.fetchall(f"""SELECT type, name, sql FROM sqlite_master
+                                     WHERE tbl_name IN ({", ".join("?" * len(ARCHIVE_TABLES))})
+                                       AND type IN ('table', 'index') AND sql IS NOT NULL
+                                     ORDER BY type = 'index', rowid""",
+                                 [table for table, _date_column, _condition in ARCHIVE_TABLES])
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        conn.execute("BEGIN")
+        for _type, name, sql in schema:
+            if name not in existing:
+                conn.execute(sql)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def archive_year(db_manager, year, chunk_size=ARCHIVE_CHUNK_SIZE, progress=None, cancelled=None):
+    # Moves the sales, receipts, stock movements and used-up cost layers of
+    # a closed calendar year (UTC, like the stored timestamps) into that
+    # year's archive file, chunk by chunk, so terminals keep posting while
+    # it runs. Returns {table: rows moved}, or None if cancelled() turned
+    # true; running it again resumes, and after a later stock snapshot also
+    # moves the movements it covers.
+    report = progress or (lambda message: None)
+    current_year = int(db_manager.fetchone("SELECT strftime('%Y', 'now')")[0])
+    if year >= current_year:
+        raise ValueError(f"{year} is not closed yet; only years before {current_year} can be archived")
+
+    path = archive_path(db_manager.db_name, year)
+    create_archive(db_manager, path)
+    first_day, day_after = f"{year}-01-01", f"{year + 1}-01-01"
+    conn = db_manager.connection
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    moved = {}
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+        for table, date_column, condition in ARCHIVE_TABLES:
+            columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+            where = f"{date_column} >= ? AND {date_column} < ?" + (f" AND {condition}" if condition else "")
+            total = db_manager.fetchone(f"SELECT COUNT(*) FROM main.{table} WHERE {where}",
+                                        (first_day, day_after))[0]
+            moved[table] = 0
+            while True:
+                if cancelled and cancelled():
+                    return None
+                # A transaction over a WAL database and an attached one is
+                # only atomic per file, so rows are copied in one transaction
+                # and deleted in the next. An interruption in between leaves
+                # them in both files; the next run copies them again and
+                # deletes them.
+                with db_manager.transaction() as cursor:
+                    cursor.execute("DELETE FROM temp.archive_batch")
+                    cursor.execute(f"""INSERT INTO temp.archive_batch
+                                       SELECT id FROM main.{table} WHERE {where} LIMIT ?""",
+                                   (first_day, day_after, chunk_size))
+                    batch = cursor.rowcount
+                    cursor.execute(f"""INSERT OR REPLACE INTO archive.{table} ({columns})
+                                       SELECT {columns} FROM main.{table}
+                                       WHERE id IN (SELECT id FROM temp.archive_batch)""")
+                if not batch:
+                    break
+                with db_manager.transaction(immediate=True) as cursor:
+                    cursor.execute(f"DELETE FROM main.{table} WHERE id IN (SELECT id FROM temp.archive_batch)")
+                moved[table] += batch
+                report(f"archive {year} {table}: {moved[table]}/{total} rows")
+        return moved
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.archive_batch")
+        conn.execute("DETACH DATABASE archive")
@@ -0,0 +1,173 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from archive import archive_files
+from exporter import GZIP_LEVEL
+
+# Pages copied per backup step and the pause between steps: about 1 MiB at
+# a time with the default 4 KiB pages, so a backup never hogs the disk
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE = 0.005
+# Backup sets kept by rotation
+BACKUP_KEEP = 7
+COPY_BUFFER_SIZE = 1 << 20
+
+# Set names carry the start time to the microsecond, so runs in the same
+# second get sets of their own; older sets were named to the second
+STAMP_FORMAT = "%Y%m%dT%H%M%S.%fZ"
+STAMP_FORMATS = (STAMP_FORMAT, "%Y%m%dT%H%M%SZ")
+
+
+class BackupError(Exception):
+    pass
+
+
+def backup_sets(directory, db_name):
+    # {start time: path} of the complete backup sets of db_name, oldest first.
+    # A set is a directory such as inventory-20240601T020000.000000Z holding
+    # the database and its archives; unfinished sets end in .part.
+    prefix = os.path.splitext(os.path.basename(db_name))[0] + "-"
+    sets = {}
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if not name.startswith(prefix):
+                continue
+            for stamp_format in STAMP_FORMATS:
+                try:
+                    started = datetime.strptime(name[len(prefix):], stamp_format).replace(tzinfo=timezone.utc)
+                except ValueError:
+                    continue
+                sets[started] = os.path.join(directory, name)
+                break
+    return dict(sorted(sets.items()))
+
+
+def copy_database(source_path, target_path, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    # Online copy through SQLite's backup API, a few pages per step. The
+    # source stays in one read transaction throughout: in WAL mode that does
+    # not block writers, and the copy is the database as of its start.
+    # Without it every commit by another connection restarts the backup.
+    # Returns the number of pages copied.
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    copied = [0]
+
+    def step(_status, remaining, total):
+        copied[0] = total - remaining
+        if remaining:
+            time.sleep(pause)
+
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=step)
+        source.execute("COMMIT")
+        # A copy of a WAL database stays in WAL mode; make the file self-contained
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.close()
+    return copied[0]
+
+
+def check_database(path, full=False):
+    # Problems reported by PRAGMA quick_check (integrity_check with full=True,
+    # which also cross-checks every index against its table); [] if sound
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("PRAGMA integrity_check" if full else "PRAGMA quick_check").fetchall()
+    finally:
+        conn.close()
+    return [] if rows == [("ok",)] else [row[0] for row in rows]
+
+
+def compress_file(path):
+    # path -> path.gz, removing path; returns the new path
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb", compresslevel=GZIP_LEVEL) as target:
+        shutil.copyfileobj(source, target, COPY_BUFFER_SIZE)
+    os.remove(path)
+    return path + ".gz"
+
+
+def rotate_backups(directory, db_name, keep=BACKUP_KEEP):
+    # Removes all but the newest keep backup sets; returns the removed paths
+    sets = list(backup_sets(directory, db_name).values())
+    removed = sets[:max(len(sets) - keep, 0)]
+    for path in removed:
+        shutil.rmtree(path)
+    return removed
+
+
+def backup(db_name, directory, keep=BACKUP_KEEP, compress=False, full_check=False,
+           pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE, progress=None):
+    # Backs up db_name and its archive files into a new set in directory,
+    # checks every copy, optionally gzips it, then rotates the old sets.
+    # Archives unchanged since the previous set are hard-linked from it
+    # instead of copied again. Returns the set's path and, per file,
+    # (name, database bytes, backup bytes, seconds); raises BackupError, leaving the unfinished
+    # set for inspection, if a copy fails its check.
+    report = progress or (lambda message: None)
+    started = datetime.now(timezone.utc)
+    previous = list(backup_sets(directory, db_name).items())[-1:]
+    stem = os.path.splitext(os.path.basename(db_name))[0]
+    while True:
+        final_path = os.path.join(directory, f"{stem}-{started.strftime(STAMP_FORMAT)}")
+        partial = final_path + ".part"
+        if previous and started <= previous[0][0]:
+            # The clock went back; keep the sets in start order
+            started = previous[0][0]
+        elif not os.path.exists(final_path) and not os.path.exists(partial):
+            try:
+                os.makedirs(partial)
+                break
+            except FileExistsError:
+                # Another backup took this name meanwhile
+                pass
+        started += timedelta(microseconds=1)
+
+    check = "integrity_check" if full_check else "quick_check"
+    results = []
+    suffix = ".gz" if compress else ""
+    for source_path in [db_name] + list(archive_files(db_name).values()):
+        file_name = os.path.basename(source_path)
+        target_path = os.path.join(partial, file_name)
+        clock = time.perf_counter()
+        if source_path != db_name and previous:
+            previous_started, previous_path = previous[0]
+            previous_file = os.path.join(previous_path, file_name + suffix)
+            if (os.path.exists(previous_file)
+                    and os.path.getmtime(source_path) < previous_started.timestamp()):
+                os.link(previous_file, target_path + suffix)
+                results.append((file_name + suffix, os.path.getsize(source_path), os.path.getsize(previous_file),
+                                0.0))
+                report(f"{file_name}: unchanged, linked from {os.path.basename(previous_path)}")
+                continue
+
+        copied = copy_database(source_path, target_path, pages, pause)
+        size = os.path.getsize(target_path)
+        copy_seconds = time.perf_counter() - clock
+        report(f"{file_name}: {copied} pages, {size / 1048576:.1f} MiB copied in {copy_seconds:.1f}s "
+               f"({size / 1048576 / max(copy_seconds, 1e-6):.1f} MiB/s)")
+
+        check_clock = time.perf_counter()
+        problems = check_database(target_path, full_check)
+        if problems:
+            raise BackupError(f"{check} of the copy of {file_name} failed: {'; '.join(problems[:5])}")
+        report(f"{file_name}: {check} ok in {time.perf_counter() - check_clock:.1f}s")
+
+        if compress:
+            compress_clock = time.perf_counter()
+            target_path = compress_file(target_path)
+            report(f"{file_name}: compressed to {os.path.getsize(target_path) / 1048576:.1f} MiB "
+                   f"in {time.perf_counter() - compress_clock:.1f}s")
+        results.append((os.path.basename(target_path), size, os.path.getsize(target_path),
+                        time.perf_counter() - clock))
+
+    os.replace(partial, final_path)
+    for path in rotate_backups(directory, db_name, keep):
+        report(f"removed old backup {os.path.basename(path)}")
+    return final_path, results
@@ -0,0 +1,75 @@
+"""Compare per-call sqlite3.connect() against the shared DatabaseManager
+connection for the queries behind the form recalculation hot path.
+
+    python -m benchmarks.connection_latency [--db inventory.db] [--iterations 5000]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from benchmarks.suite import percentile
+from database import DatabaseManager
+
+HOT_QUERIES = [
+    ("SELECT tax_rate FROM products WHERE id = ?", (1,)),
+    ("SELECT price, tax_rate FROM products WHERE id = ?", (1,)),
+    ("SELECT unit_of_measurement, tax_rate, price, stock_quantity FROM products WHERE id = ?", (1,)),
+]
+
+
+def per_call_connection(db_name, query, params):
+    # The pattern previously used by every InventoryMainWindow method
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    cursor.fetchone()
+    conn.close()
+
+
+def shared_connection(db_manager, query, params):
+    db_manager.fetchone(query, params)
+
+
+def measure(func, iterations):
+    timings = []
+    for i in range(iterations):
+        query, params = HOT_QUERIES[i % len(HOT_QUERIES)]
+        start = time.perf_counter()
+        func(query, params)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return {
+        "mean_us": statistics.fmean(timings),
+        "p50_us": percentile(timings, 0.5),
+        "p99_us": percentile(timings, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database to benchmark (defaults to a fresh sample database)")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = args.db or os.path.join(tmp, "inventory.db")
+        db_manager = DatabaseManager(db_name)
+
+        results = {
+            "per_call_connect": measure(lambda q, p: per_call_connection(db_name, q, p), args.iterations),
+            "shared_connection": measure(lambda q, p: shared_connection(db_manager, q, p), args.iterations),
+        }
+        db_manager.close()
+
+    for name, stats in results.items():
+        print(f"{name:<18} mean {stats['mean_us']:8.1f} us   p50 {stats['p50_us']:8.1f} us   "
+              f"p99 {stats['p99_us']:8.1f} us")
+    speedup = results["per_call_connect"]["mean_us"] / results["shared_connection"]["mean_us"]
+    print(f"speedup: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
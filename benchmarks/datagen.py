@@ -0,0 +1,176 @@
+"""Generate a synthetic catalog and transaction history for benchmarking.
+
+    python -m benchmarks.datagen bench.db --products 100000 --sales 1000000 --receipts 100000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from database import DatabaseManager
+from migrations import (INDEXES, backfill_stock_movements, create_indexes, create_summary_triggers,
+                        drop_summary_triggers)
+from pricing import MILLI_PER_UNIT, line_totals
+from valuation import rebuild_valuation
+
+CATEGORIES = {
+    "Electronics": ["Laptops", "Accessories", "Monitors", "Storage", "Audio"],
+    "Grocery": ["Staples", "Snacks", "Beverages", "Dairy"],
+    "Home": ["Kitchen", "Cleaning", "Furniture", "Lighting"],
+    "Apparel": ["Men", "Women", "Kids", "Footwear"],
+}
+NOUNS = ["Cable", "Adapter", "Rice", "Tea", "Lamp", "Chair", "Shirt", "Shoe", "Speaker",
+         "Mouse", "Bottle", "Towel", "Pan", "Biscuit", "Charger", "Drive", "Jacket", "Soap"]
+ADJECTIVES = ["Premium", "Classic", "Compact", "Wireless", "Organic", "Deluxe", "Basic",
+              "Eco", "Pro", "Mini", "Family", "Travel"]
+UNITS = ["piece", "kg", "litre", "box", "pack"]
+TAX_RATES = [0.0, 5.0, 12.0, 18.0, 28.0]
+BATCH_SIZE = 50000
+LINES_PER_DOCUMENT = 4
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _timestamp(rng, start, days):
+    moment = start + timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def generate(db_name, products=1000, sales=10000, receipts=1000, days=365, seed=42, progress=print):
+    rng = random.Random(seed)
+    db_manager = DatabaseManager(db_name)
+    conn = db_manager.connection
+    start = datetime.now() - timedelta(days=days)
+    started = time.perf_counter()
+
+    # Bulk load settings: durability does not matter for throwaway data and
+    # secondary indexes and the daily summaries are cheaper to build once at
+    # the end
+    conn.execute("PRAGMA synchronous = OFF")
+    with db_manager.transaction() as cursor:
+        drop_summary_triggers(cursor)
+    transaction_tables = ("sales", "goods_receiving", "sales_invoices", "goods_receipts")
+    for name, table, _columns in INDEXES:
+        if table in transaction_tables:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+    first_id = (db_manager.fetchone("SELECT COALESCE(MAX(id), 0) FROM products")[0]) + 1
+    categories = list(CATEGORIES.items())
+
+    def product_rows():
+        for i in range(first_id, first_id + products):
+            category, subcategories = categories[i % len(categories)]
+            name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}"
+            yield (f"GB{i:09d}", f"GEN{i:08d}", category, rng.choice(subcategories), name,
+                   f"Synthetic product {i}", rng.choice(TAX_RATES), rng.randint(1000, 5000000),
+                   rng.choice(UNITS), rng.randint(1000, 100000) * MILLI_PER_UNIT)
+
+    for batch in _batches(product_rows()):
+        with db_manager.transaction() as cursor:
+            cursor.executemany("""INSERT INTO products
+                                  (barcode, sku_id, category, subcategory, product_name, description,
+                                   tax_rate, price, unit_of_measurement, stock_quantity)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", batch)
+    progress(f"products: {products} in {time.perf_counter() - started:.1f}s")
+
+    product_ids = range(first_id, first_id + products)
+    customer_ids = [row[0] for row in db_manager.fetchall("SELECT id FROM customers")]
+    supplier_ids = [row[0] for row in db_manager.fetchall("SELECT id FROM suppliers")]
+
+    def documents(count, party_ids, header_table, user):
+        # Yields (header row, line rows) groups of up to LINES_PER_DOCUMENT
+        # lines; header rows are (id, party, lines, subtotal, tax, total, date, user),
+        # amounts in paise and quantities in milli-units
+        next_header = (db_manager.fetchone(f"SELECT COALESCE(MAX(id), 0) FROM {header_table}")[0]) + 1
+        remaining = count
+        while remaining > 0:
+            lines = min(LINES_PER_DOCUMENT, remaining)
+            remaining -= lines
+            party = rng.choice(party_ids)
+            when = _timestamp(rng, start, days)
+            rows = []
+            subtotal_sum = tax_sum = 0
+            for _ in range(lines):
+                quantity = rng.randint(1, 10) * MILLI_PER_UNIT
+                rate = rng.randint(1000, 500000)
+                subtotal, tax, total = line_totals(quantity, rate, rng.choice(TAX_RATES))
+                subtotal_sum += subtotal
+                tax_sum += tax
+                rows.append((rng.choice(product_ids), party, quantity, rate, tax,
+                             total, when, user, next_header))
+            yield (next_header, party, lines, subtotal_sum, tax_sum, subtotal_sum + tax_sum, when, user), rows
+            next_header += 1
+
+    def load(count, party_ids, header_table, header_sql, line_sql, user):
+        headers, lines = [], []
+        for header, rows in documents(count, party_ids, header_table, user):
+            headers.append(header)
+            lines.extend(rows)
+            if len(lines) >= BATCH_SIZE:
+                with db_manager.transaction() as cursor:
+                    cursor.executemany(header_sql, headers)
+                    cursor.executemany(line_sql, lines)
+                headers, lines = [], []
+        if lines:
+            with db_manager.transaction() as cursor:
+                cursor.executemany(header_sql, headers)
+                cursor.executemany(line_sql, lines)
+
+    load(sales, customer_ids, "sales_invoices",
+         """INSERT INTO sales_invoices (id, customer_id, line_count, subtotal, tax_amount, total_amount,
+                                        date_sold, sold_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+         """INSERT INTO sales (product_id, customer_id, quantity, rate_per_unit, tax_amount, total_amount,
+                               date_sold, sold_by, invoice_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+         "sales_operator")
+    progress(f"sales: {sales} in {time.perf_counter() - started:.1f}s")
+
+    load(receipts, supplier_ids, "goods_receipts",
+         """INSERT INTO goods_receipts (id, supplier_id, line_count, total_amount, date_received, received_by)
+            VALUES (?1, ?2, ?3, ?6, ?7, ?8)""",
+         """INSERT INTO goods_receiving (product_id, supplier_id, quantity, rate_per_unit, tax_amount,
+                                         total_amount, date_received, received_by, receipt_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+         "goods_operator")
+    progress(f"receipts: {receipts} in {time.perf_counter() - started:.1f}s")
+
+    with db_manager.transaction() as cursor:
+        create_indexes(cursor)
+        create_summary_triggers(cursor)
+    progress(f"indexes rebuilt in {time.perf_counter() - started:.1f}s")
+    db_manager.rebuild_summaries()
+    progress(f"summaries rebuilt in {time.perf_counter() - started:.1f}s")
+    # The generated stock levels become opening balances before the history
+    backfill_stock_movements(db_manager, lambda message: None)
+    progress(f"stock ledger replayed in {time.perf_counter() - started:.1f}s")
+    rebuild_valuation(db_manager)
+    conn.execute("ANALYZE")
+    progress(f"valuation rebuilt in {time.perf_counter() - started:.1f}s")
+    db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", help="database file to create or extend")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--sales", type=int, default=10000, help="number of sales lines")
+    parser.add_argument("--receipts", type=int, default=1000, help="number of goods receiving lines")
+    parser.add_argument("--days", type=int, default=365, help="history length in days")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.db, args.products, args.sales, args.receipts, args.days, args.seed)
+
+
+if __name__ == "__main__":
+    main()
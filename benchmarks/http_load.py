@@ -0,0 +1,161 @@
+"""Post sales through the HTTP API from several client processes and report
+requests per second and latency percentiles.
+
+    python -m benchmarks.http_load [--clients 8] [--sales 500] [--lines 3] [--products 20]
+    python -m benchmarks.http_load --url http://127.0.0.1:8765 --search TEXT --clients 4
+
+Without --url a server is started on a scratch database, which is checked
+for overselling afterwards. Against a running server, the invoices use the
+products a search for --search finds; note that they are really posted.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.suite import percentile
+from client import ApiError, InventoryClient
+from database import DatabaseManager
+from pricing import MILLI_PER_UNIT, to_milli
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.py")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("server exited during startup")
+        client = InventoryClient(url, timeout=1)
+        try:
+            client.customers()
+        except ApiError:
+            # Any answer, "log in first" included, means it is up
+            return
+        except OSError:
+            time.sleep(0.1)
+        finally:
+            client.close()
+    raise SystemExit("server did not start")
+
+
+def client_process(url, client_id, sales, lines_per_sale, product_ids, customer_ids, ready, results):
+    client = InventoryClient(url)
+    client.login("sales_operator", "password123")
+    rng = random.Random(client_id)
+    latencies = []
+    rejected = 0
+
+    # Logins are bcrypt checks; the clock starts once every client is in
+    ready.wait()
+    for _ in range(sales):
+        lines = [(rng.choice(product_ids), rng.randint(1, 3) * MILLI_PER_UNIT) for _ in range(lines_per_sale)]
+        started = time.perf_counter()
+        try:
+            client.post_sale(rng.choice(customer_ids), lines)
+        except ApiError as e:
+            if e.status != 409:
+                raise
+            rejected += 1
+        latencies.append(time.perf_counter() - started)
+    client.close()
+    results.put((latencies, rejected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server to load (default: start one on a scratch database)")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--sales", type=int, default=500, help="invoices posted per client")
+    parser.add_argument("--lines", type=int, default=3, help="lines per invoice")
+    parser.add_argument("--products", type=int, default=20, help="products created on the scratch database")
+    parser.add_argument("--search", help="product search picking the products sold (required with --url)")
+    parser.add_argument("--stock", type=int, default=1000, help="starting stock per product")
+    parser.add_argument("--read-threads", type=int, help="passed on to the server started")
+    args = parser.parse_args()
+    if args.url and not args.search:
+        parser.error("--url needs --search")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = db_manager = None
+        url = args.url
+        if url is None:
+            db_name = os.path.join(tmp, "inventory.db")
+            db_manager = DatabaseManager(db_name)
+            with db_manager.transaction() as cursor:
+                cursor.executemany("""INSERT INTO products
+                                      (sku_id, category, subcategory, product_name, tax_rate, price,
+                                       unit_of_measurement, stock_quantity)
+                                      VALUES (?, 'Load', 'Load', ?, 18.0, 1000, 'piece', ?)""",
+                                   [(f"LOAD{i:05d}", f"Load product {i}", to_milli(args.stock))
+                                    for i in range(args.products)])
+            initial = dict(db_manager.fetchall("SELECT id, stock_quantity FROM products"))
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            command = [sys.executable, SERVER_SCRIPT, "--db", db_name, "--port", str(port)]
+            if args.read_threads:
+                command += ["--read-threads", str(args.read_threads)]
+            server = subprocess.Popen(command)
+            wait_for_server(url, server)
+
+        try:
+            setup = InventoryClient(url)
+            setup.login("sales_operator", "password123")
+            product_ids = [product["id"] for product in setup.search_products(args.search or "Load", 1000)]
+            if not product_ids:
+                raise SystemExit(f"no products match {args.search!r}")
+            customer_ids = [customer["id"] for customer in setup.customers()]
+            setup.close()
+
+            ready = multiprocessing.Barrier(args.clients + 1)
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=client_process,
+                                                 args=(url, i, args.sales, args.lines, product_ids, customer_ids,
+                                                       ready, results))
+                         for i in range(args.clients)]
+            for process in processes:
+                process.start()
+
+            ready.wait()
+            start = time.perf_counter()
+            outcomes = [results.get() for _ in processes]
+            elapsed = time.perf_counter() - start
+            for process in processes:
+                process.join()
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        latencies = sorted(latency for outcome in outcomes for latency in outcome[0])
+        rejected = sum(outcome[1] for outcome in outcomes)
+        print(f"clients: {args.clients}  requests: {len(latencies)}  rejected (insufficient stock): {rejected}")
+        print(f"elapsed: {elapsed:.2f} s  throughput: {len(latencies) / elapsed:.0f} requests/s")
+        print("latency ms: " + "  ".join(f"{label} {percentile(latencies, fraction) * 1000:.2f}"
+                                         for label, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99),
+                                                                 ("max", 1.0))))
+
+        if db_manager:
+            sold = dict(db_manager.fetchall("SELECT product_id, SUM(quantity) FROM sales GROUP BY product_id"))
+            oversold = sum(1 for product_id, stock in db_manager.fetchall("SELECT id, stock_quantity FROM products")
+                           if stock < 0 or initial[product_id] - sold.get(product_id, 0) != stock)
+            db_manager.close()
+            print(f"oversold products: {oversold}")
+            if oversold:
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Hammer one database with concurrent sale postings from several processes
+and verify that no product is ever oversold.
+
+    python -m benchmarks.sale_stress [--writers 8] [--sales 500] [--products 20] [--stock 50]
+
+The starting stock must run out for the check to mean anything, so the run
+fails if no sale was turned away for insufficient stock.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from database import DatabaseManager, InsufficientStockError
+from pricing import MILLI_PER_UNIT, to_milli
+
+
+def writer(db_name, writer_id, sales, product_ids, start_event, results):
+    db_manager = DatabaseManager(db_name)
+    rng = random.Random(writer_id)
+    posted = rejected = 0
+
+    start_event.wait()
+    for _ in range(sales):
+        lines = [(rng.choice(product_ids), rng.randint(1, 3) * MILLI_PER_UNIT) for _ in range(rng.randint(1, 3))]
+        try:
+            db_manager.post_sales_invoice(1, lines, f"stress_{writer_id}")
+            posted += 1
+        except InsufficientStockError:
+            rejected += 1
+    db_manager.close()
+    results.put((posted, rejected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--sales", type=int, default=500, help="invoices attempted per writer")
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--stock", type=int, default=50,
+                        help="starting stock per product; far below the demand, so products sell out")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "inventory.db")
+        db_manager = DatabaseManager(db_name)
+        with db_manager.transaction() as cursor:
+            cursor.executemany("""INSERT INTO products
+                                  (sku_id, category, subcategory, product_name, tax_rate, price,
+                                   unit_of_measurement, stock_quantity)
+                                  VALUES (?, 'Stress', 'Stress', ?, 18.0, 1000, 'piece', ?)""",
+                               [(f"STRESS{i:05d}", f"Stress product {i}", to_milli(args.stock))
+                                for i in range(args.products)])
+        product_ids = [row[0] for row in db_manager.fetchall(
+            "SELECT id FROM products WHERE sku_id LIKE 'STRESS%'")]
+        initial = dict(db_manager.fetchall("SELECT id, stock_quantity FROM products"))
+
+        start_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=writer,
+                                             args=(db_name, i, args.sales, product_ids, start_event, results))
+                     for i in range(args.writers)]
+        for process in processes:
+            process.start()
+
+        start = time.perf_counter()
+        start_event.set()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        posted = sum(outcome[0] for outcome in outcomes)
+        rejected = sum(outcome[1] for outcome in outcomes)
+
+        # Every unit sold must have existed: stock never negative and the
+        # sales ledger accounts exactly for the stock that went missing
+        sold = dict(db_manager.fetchall("SELECT product_id, SUM(quantity) FROM sales GROUP BY product_id"))
+        oversold = []
+        for product_id, stock in db_manager.fetchall("SELECT id, stock_quantity FROM products"):
+            if stock < 0 or initial[product_id] - sold.get(product_id, 0) != stock:
+                oversold.append(product_id)
+        unledgered = sum(1 for _row in db_manager.stock_discrepancies(full=True))
+        # The valuation must account for the same stock
+        unvalued = db_manager.fetchone("""SELECT COUNT(*) FROM products p
+                                          LEFT JOIN product_costs c ON c.product_id = p.id
+                                          WHERE p.stock_quantity != COALESCE(c.quantity, 0)""")[0]
+        db_manager.close()
+
+    print(f"writers: {args.writers}  attempted: {args.writers * args.sales}  "
+          f"posted: {posted}  rejected (insufficient stock): {rejected}")
+    print(f"elapsed: {elapsed:.2f} s  throughput: {(posted + rejected) / elapsed:.0f} invoices/s")
+    print(f"oversold products: {len(oversold)}  stock not matching the ledger: {unledgered}  "
+          f"stock not matching the valuation: {unvalued}")
+    if not rejected:
+        print("no sale was rejected: the stock never ran out, so overselling was not exercised; "
+              "lower --stock or raise --sales")
+    if oversold or unledgered or unvalued or not rejected:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
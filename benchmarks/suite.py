@@ -0,0 +1,216 @@
+"""Time the application's real database operations and write the results as JSON.
+
+    python -m benchmarks.suite --products 100000 --sales 1000000 --output results.json
+    python -m benchmarks.suite --db bench.db --output results.json --compare baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.datagen import generate
+from database import DatabaseManager
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of a sorted list: the smallest value with at
+    # least fraction of the values at or below it
+    return ordered[max(math.ceil(len(ordered) * fraction) - 1, 0)]
+
+
+def copy_database(source_name, target_name):
+    # The benchmark posts invoices and tops up stock outside the ledger, so
+    # it never runs against the database given with --db, only a copy
+    source = sqlite3.connect(source_name)
+    target = sqlite3.connect(target_name)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    def __init__(self, db_name, seed):
+        self.db_name = db_name
+        self.rng = random.Random(seed)
+        self.db = DatabaseManager(db_name)
+        self.max_product_id = self.db.fetchone("SELECT MAX(id) FROM products")[0]
+        self.customer_ids = [row[0] for row in self.db.fetchall("SELECT id FROM customers")]
+        self.supplier_ids = [row[0] for row in self.db.fetchall("SELECT id FROM suppliers")]
+        self.barcodes = [row[0] for row in self.db.fetchall(
+            "SELECT barcode FROM products WHERE barcode IS NOT NULL ORDER BY random() LIMIT 1000")]
+        self.names = [row for row in self.db.fetchall(
+            "SELECT product_name, id FROM products ORDER BY random() LIMIT 1000")]
+        # Make sure postings never run out of stock mid-benchmark
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE products SET stock_quantity = 1000000000000 WHERE stock_quantity < 1000000000")
+        self.db.invalidate_products()
+
+    def product_id(self):
+        return self.rng.randint(1, self.max_product_id)
+
+    # Each operation is one timed call
+    def startup(self):
+        DatabaseManager(self.db_name).close()
+
+    def login(self):
+        self.db.authenticate("sales_operator", "password123")
+
+    def product_list_first_page(self):
+        self.db.product_page(None, 500)
+
+    def product_list_random_page(self):
+        self.db.product_page(self.product_id(), 500)
+
+    def inventory_first_page(self):
+        self.db.inventory_page(None, 500)
+
+    def inventory_random_page(self):
+        self.db.inventory_page(self.rng.choice(self.names), 500)
+
+    def barcode_lookup(self):
+        self.db.find_product_by_code(self.rng.choice(self.barcodes))
+
+    def product_search(self):
+        # What an operator types: the start of two words of a product name
+        words = self.rng.choice(self.names)[0].split()
+        self.db.search_products(" ".join(word[:4] for word in words[:2]), 20)
+
+    def cached_product_lookup(self):
+        self.db.get_product(1)
+
+    def sale_post_1_line(self):
+        self.db.post_sales_invoice(self.rng.choice(self.customer_ids),
+                                   [(self.product_id(), 1000)], "benchmark")
+
+    def sale_post_30_lines(self):
+        self.db.post_sales_invoice(self.rng.choice(self.customer_ids),
+                                   [(self.product_id(), 1000) for _ in range(30)], "benchmark")
+
+    def receipt_post_100_lines(self):
+        self.db.post_goods_receipt(self.rng.choice(self.supplier_ids),
+                                   [(self.product_id(), 10000, 9950) for _ in range(100)], "benchmark")
+
+
+# (operation, iterations)
+OPERATIONS = (
+    ("startup", 5),
+    ("login", 3),
+    ("product_list_first_page", 50),
+    ("product_list_random_page", 50),
+    ("inventory_first_page", 50),
+    ("inventory_random_page", 50),
+    ("barcode_lookup", 1000),
+    ("product_search", 200),
+    ("cached_product_lookup", 10000),
+    ("sale_post_1_line", 200),
+    ("sale_post_30_lines", 50),
+    ("receipt_post_100_lines", 20),
+)
+
+
+def run(workload, operations=OPERATIONS, only=None):
+    results = {}
+    for name, iterations in operations:
+        if only and name not in only:
+            continue
+        operation = getattr(workload, name)
+        operation()  # warm-up
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            operation()
+            timings.append((time.perf_counter() - start) * 1000.0)
+        timings.sort()
+        results[name] = {
+            "iterations": iterations,
+            "mean_ms": statistics.fmean(timings),
+            "p50_ms": percentile(timings, 0.5),
+            "p95_ms": percentile(timings, 0.95),
+            "p99_ms": percentile(timings, 0.99),
+            "max_ms": timings[-1],
+        }
+        print(f"{name:<26} mean {results[name]['mean_ms']:10.3f} ms   p99 {results[name]['p99_ms']:10.3f} ms",
+              file=sys.stderr)
+    return results
+
+
+def compare(results, baseline):
+    print(f"{'operation':<26} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stderr)
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        change = (current["mean_ms"] / previous["mean_ms"] - 1.0) * 100.0 if previous["mean_ms"] else 0.0
+        print(f"{name:<26} {previous['mean_ms']:10.3f}ms {current['mean_ms']:10.3f}ms {change:+7.1f}%",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="benchmark a copy of this database (default: generate a temporary one)")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--sales", type=int, default=10000)
+    parser.add_argument("--receipts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="+", help="run only these operations")
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        if args.db:
+            copy_database(args.db, db_name)
+        else:
+            generate(db_name, args.products, args.sales, args.receipts, seed=args.seed,
+                     progress=lambda message: print(message, file=sys.stderr))
+
+        workload = Workload(db_name, args.seed)
+        meta = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "products": workload.db.fetchone("SELECT COUNT(*) FROM products")[0],
+            "sales": workload.db.fetchone("SELECT COUNT(*) FROM sales")[0],
+            "receipts": workload.db.fetchone("SELECT COUNT(*) FROM goods_receiving")[0],
+        }
+        results = run(workload, only=args.only)
+        workload.db.close()
+
+    report = {"meta": meta, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import http.client
+import json
+from urllib.parse import quote, urlencode, urlsplit
+
+# server.py's default address
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+class ApiError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body.get("error", f"HTTP {status}"))
+        self.status = status
+        # shortages for a sale the stock does not cover (status 409)
+        self.shortages = body.get("shortages", [])
+
+
+# Thin client for server.py: the InventoryService calls over one kept-alive
+# HTTP connection, with the same results. Postings are made as the user
+# logged in with login(). Not thread-safe; give each thread its own client,
+# passing the first one's token to share its login.
+class InventoryClient:
+    def __init__(self, url=DEFAULT_URL, timeout=30, token=None):
+        parts = urlsplit(url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+        self.token = token
+        self.username = self.role = None
+
+    def close(self):
+        self._connection.close()
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        try:
+            self._connection.request(method, path, body, headers)
+            response = self._connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            # The kept-alive connection is gone (a server restart). A read is
+            # sent again on a new one; a posting may have been made, so the
+            # error is the caller's to resolve.
+            self._connection.close()
+            if method != "GET":
+                raise
+            self._connection.request(method, path, body, headers)
+            response = self._connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise ApiError(response.status, result)
+        return result
+
+    def login(self, username, password):
+        # The user's role, or None; later calls act as this user
+        try:
+            result = self.request("POST", "/login", {"username": username, "password": password})
+        except ApiError as e:
+            if e.status == 401:
+                return None
+            raise
+        self.token = result["token"]
+        self.username, self.role = username, result["role"]
+        return self.role
+
+    def product(self, code):
+        try:
+            return self.request("GET", f"/products/{quote(code, safe='')}")
+        except ApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def search_products(self, text, limit=50):
+        return self.request("GET", f"/products?{urlencode({'q': text, 'limit': limit})}")
+
+    def customers(self):
+        return self.request("GET", "/customers")
+
+    def suppliers(self):
+        return self.request("GET", "/suppliers")
+
+    def quote_sale(self, lines):
+        return self.request("POST", "/sales/quote", {"lines": [list(line) for line in lines]})
+
+    def quote_receipt(self, lines):
+        return self.request("POST", "/receipts/quote", {"lines": [list(line) for line in lines]})
+
+    def post_sale(self, customer_id, lines):
+        return self.request("POST", "/sales", {"customer_id": customer_id, "lines": [list(line) for line in lines]})
+
+    def post_receipt(self, supplier_id, lines):
+        return self.request("POST", "/receipts",
+                            {"supplier_id": supplier_id, "lines": [list(line) for line in lines]})
+
+    def post_stock_movement(self, kind, product_id, quantity, reference_id=None, note=None):
+        return self.request("POST", "/stock-movements", {"kind": kind, "product_id": product_id, "quantity": quantity,
+                                                         "reference_id": reference_id, "note": note})
+
+    def product_page(self, after_id=None, limit=500):
+        query = {"limit": limit}
+        if after_id is not None:
+            query["after"] = after_id
+        return self.request("GET", f"/product-rows?{urlencode(query)}")
+
+    def product_rows(self, product_ids):
+        if not product_ids:
+            return []
+        return self.request("GET", f"/product-rows?{urlencode({'ids': ','.join(map(str, product_ids))})}")
+
+    def product_search_rows(self, text, limit=50):
+        return self.request("GET", f"/product-rows?{urlencode({'q': text, 'limit': limit})}")
+
+    def inventory_page(self, after=None, limit=500):
+        query = {"limit": limit}
+        if after is not None:
+            query["after_name"], query["after_id"] = after
+        return self.request("GET", f"/inventory-rows?{urlencode(query)}")
+
+    def inventory_rows(self, product_ids):
+        if not product_ids:
+            return []
+        return self.request("GET", f"/inventory-rows?{urlencode({'ids': ','.join(map(str, product_ids))})}")
+
+    def reports(self):
+        return self.request("GET", "/reports")
+
+    def report(self, name, first_day, last_day, limit=-1):
+        return self.request("GET", f"/reports/{quote(name, safe='')}?"
+                                   f"{urlencode({'from': first_day, 'to': last_day, 'limit': limit})}")
@@ -0,0 +1,955 @@
+import functools
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import date, timedelta
+
+import bcrypt
+
+from archive import ARCHIVE_TABLES, archive_files
+from instrumentation import InstrumentedConnection, QueryStats
+from migrations import (MIGRATION_CHUNK_SIZE, MIGRATIONS, SCHEMA_VERSION, SUMMARY_DATE_COLUMNS,
+                        SUMMARY_TABLES, history_days, insert_sample_data, month_ranges)
+from pricing import PAISE_PER_RUPEE, format_money, format_quantity, invoice_totals, line_totals
+from product_cache import ProductCache, ProductRecord
+from valuation import add_cost_layers, current_unit_cost, issue_stock, record_sales
+
+# Connection tuning applied to every connection handed out by DatabaseManager
+CONNECTION_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 268435456),
+    ("cache_size", -20000),
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", 5000),
+)
+STATEMENT_CACHE_SIZE = 256
+
+# Report columns: (header, formatter for the stored value)
+TOTALS_COLUMNS = (("Lines", str), ("Quantity", format_quantity), ("Subtotal (₹)", format_money),
+                  ("Tax (₹)", format_money), ("Total (₹)", format_money))
+TOP_COLUMNS = (("Lines", str), ("Quantity", format_quantity), ("Total (₹)", format_money))
+MARGIN_COLUMNS = (("Quantity", format_quantity), ("Revenue (₹)", format_money),
+                  ("FIFO cost (₹)", format_money), ("FIFO margin (₹)", format_money),
+                  ("Average cost (₹)", format_money), ("Average margin (₹)", format_money))
+
+# Reports read only the daily summary tables, so their cost depends on the
+# date range and not on the size of the history: (name, columns, sql). Every
+# query takes (first day, last day, row limit); a limit of -1 means all rows.
+REPORTS = (
+    ("Daily sales", (("Day", str),) + TOTALS_COLUMNS,
+     """SELECT day, line_count, quantity, subtotal, tax_amount, total_amount
+        FROM sales_by_day WHERE day BETWEEN ? AND ? ORDER BY day LIMIT ?"""),
+    ("Monthly sales", (("Month", str),) + TOTALS_COLUMNS,
+     """SELECT substr(day, 1, 7), SUM(line_count), SUM(quantity), SUM(subtotal), SUM(tax_amount),
+               SUM(total_amount)
+        FROM sales_by_day WHERE day BETWEEN ? AND ? GROUP BY 1 ORDER BY 1 LIMIT ?"""),
+    ("Top products by sales", (("Product", str), ("SKU ID", str)) + TOP_COLUMNS,
+     """SELECT p.product_name, p.sku_id, top.line_count, top.quantity, top.total_amount
+        FROM (SELECT product_id, SUM(line_count) AS line_count, SUM(quantity) AS quantity,
+                     SUM(total_amount) AS total_amount
+              FROM sales_by_day_product WHERE day BETWEEN ? AND ?
+              GROUP BY product_id ORDER BY total_amount DESC LIMIT ?) AS top
+        LEFT JOIN products p ON p.id = top.product_id
+        ORDER BY top.total_amount DESC"""),
+    ("Top customers", (("Customer", str),) + TOP_COLUMNS,
+     """SELECT COALESCE(c.name, 'Walk-in'), top.line_count, top.quantity, top.total_amount
+        FROM (SELECT customer_id, SUM(line_count) AS line_count, SUM(quantity) AS quantity,
+                     SUM(total_amount) AS total_amount
+              FROM sales_by_day_customer WHERE day BETWEEN ? AND ?
+              GROUP BY customer_id ORDER BY total_amount DESC LIMIT ?) AS top
+        LEFT JOIN customers c ON c.id = top.customer_id
+        ORDER BY top.total_amount DESC"""),
+    ("Daily receipts", (("Day", str),) + TOTALS_COLUMNS,
+     """SELECT day, line_count, quantity, subtotal, tax_amount, total_amount
+        FROM receipts_by_day WHERE day BETWEEN ? AND ? ORDER BY day LIMIT ?"""),
+    ("Monthly receipts", (("Month", str),) + TOTALS_COLUMNS,
+     """SELECT substr(day, 1, 7), SUM(line_count), SUM(quantity), SUM(subtotal), SUM(tax_amount),
+               SUM(total_amount)
+        FROM receipts_by_day WHERE day BETWEEN ? AND ? GROUP BY 1 ORDER BY 1 LIMIT ?"""),
+    ("Top products by receipts", (("Product", str), ("SKU ID", str)) + TOP_COLUMNS,
+     """SELECT p.product_name, p.sku_id, top.line_count, top.quantity, top.total_amount
+        FROM (SELECT product_id, SUM(line_count) AS line_count, SUM(quantity) AS quantity,
+                     SUM(total_amount) AS total_amount
+              FROM receipts_by_day_product WHERE day BETWEEN ? AND ?
+              GROUP BY product_id ORDER BY total_amount DESC LIMIT ?) AS top
+        LEFT JOIN products p ON p.id = top.product_id
+        ORDER BY top.total_amount DESC"""),
+    ("Top suppliers", (("Supplier", str),) + TOP_COLUMNS,
+     """SELECT COALESCE(s.name, 'Unknown'), top.line_count, top.quantity, top.total_amount
+        FROM (SELECT supplier_id, SUM(line_count) AS line_count, SUM(quantity) AS quantity,
+                     SUM(total_amount) AS total_amount
+              FROM receipts_by_day_supplier WHERE day BETWEEN ? AND ?
+              GROUP BY supplier_id ORDER BY total_amount DESC LIMIT ?) AS top
+        LEFT JOIN suppliers s ON s.id = top.supplier_id
+        ORDER BY top.total_amount DESC"""),
+    # Margins are revenue before tax against the cost of the stock sold
+    ("Monthly margin", (("Month", str),) + MARGIN_COLUMNS,
+     """SELECT substr(day, 1, 7), SUM(quantity), SUM(revenue), SUM(fifo_cost), SUM(revenue - fifo_cost),
+               SUM(average_cost), SUM(revenue - average_cost)
+        FROM margins_by_day WHERE day BETWEEN ? AND ? GROUP BY 1 ORDER BY 1 LIMIT ?"""),
+    ("Top products by margin", (("Product", str), ("SKU ID", str)) + MARGIN_COLUMNS,
+     """SELECT p.product_name, p.sku_id, top.quantity, top.revenue, top.fifo_cost, top.revenue - top.fifo_cost,
+               top.average_cost, top.revenue - top.average_cost
+        FROM (SELECT product_id, SUM(quantity) AS quantity, SUM(revenue) AS revenue,
+                     SUM(fifo_cost) AS fifo_cost, SUM(average_cost) AS average_cost
+              FROM margins_by_day_product WHERE day BETWEEN ? AND ?
+              GROUP BY product_id ORDER BY SUM(revenue - fifo_cost) DESC LIMIT ?) AS top
+        LEFT JOIN products p ON p.id = top.product_id
+        ORDER BY top.revenue - top.fifo_cost DESC"""),
+    # Stock on hand as it stands now; the dates do not apply
+    ("Top stock by value", (("Product", str), ("SKU ID", str), ("Quantity", format_quantity),
+                            ("Average cost/unit (₹)", format_money), ("Average value (₹)", format_money),
+                            ("FIFO value (₹)", format_money)),
+     """SELECT p.product_name, p.sku_id, c.quantity,
+               CASE WHEN c.quantity > 0 THEN (c.average_value * 1000 + c.quantity / 2) / c.quantity ELSE 0 END,
+               c.average_value, c.fifo_value
+        FROM product_costs c JOIN products p ON p.id = c.product_id
+        ORDER BY c.fifo_value DESC LIMIT ?3"""),
+)
+
+# Checkpoints every product that moved after ledger id ?2 as of ledger id ?1,
+# from its previous snapshot plus its movements since. A product's latest
+# snapshot always covers all of its movements up to the previous snapshot.
+STOCK_SNAPSHOT_SQL = """INSERT INTO stock_snapshots (product_id, movement_id, taken_at, quantity)
+                        SELECT m.product_id, ?1, CURRENT_TIMESTAMP,
+                               COALESCE((SELECT s.quantity FROM stock_snapshots s
+                                         WHERE s.product_id = m.product_id
+                                         ORDER BY s.movement_id DESC LIMIT 1), 0) + m.quantity
+                        FROM (SELECT product_id, SUM(quantity) AS quantity FROM stock_movements
+                              WHERE id > ?2 AND id <= ?1 GROUP BY product_id) AS m"""
+
+# Stock level against the ledger for every product, in product id order:
+# (id, sku_id, stock_quantity, ledger quantity). The first form starts from
+# each product's latest snapshot, the full form replays the whole ledger
+# from {movements}: stock_movements_history to include the archives.
+STOCK_CHECK_SQL = """SELECT p.id, p.sku_id, p.stock_quantity,
+                            COALESCE(s.quantity, 0)
+                            + COALESCE((SELECT SUM(m.quantity) FROM stock_movements m
+                                        WHERE m.product_id = p.id AND m.id > COALESCE(s.movement_id, 0)), 0)
+                     FROM products p
+                     LEFT JOIN stock_snapshots s
+                          ON s.product_id = p.id
+                         AND s.movement_id = (SELECT MAX(movement_id) FROM stock_snapshots
+                                              WHERE product_id = p.id)
+                     ORDER BY p.id"""
+FULL_STOCK_CHECK_SQL = """SELECT p.id, p.sku_id, p.stock_quantity, COALESCE(m.quantity, 0)
+                          FROM products p
+                          LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity FROM {movements}
+                                     GROUP BY product_id) AS m ON m.product_id = p.id
+                          ORDER BY p.id"""
+
+# Stock movements that can be recorded by hand; receipts and sales are
+# written by their posting paths and openings when a product is created
+MANUAL_MOVEMENTS = ("adjustment", "return")
+
+
+def _rupees_sql(column):
+    # Integer paise as exact decimal text ('1234.50')
+    return f"printf('%.2f', {column} / 100.0) AS {column.split('.')[-1]}"
+
+
+def _units_sql(column):
+    return f"printf('%.3f', {column} / 1000.0) AS {column.split('.')[-1]}"
+
+
+# Exportable tables: name -> (query, id column, date column, product column). Filters
+# are appended as a WHERE clause; the date filter is a range on an indexed
+# timestamp, so a date-limited export never reads the rest of the table.
+# Amounts are exported in rupees and quantities in units, as decimal text;
+# {schema} is "main" or an attached archive.
+EXPORTS = {
+    "products": (f"""SELECT p.id, p.barcode, p.sku_id, p.category, p.subcategory, p.product_name,
+                            p.description, p.tax_rate, {_rupees_sql("p.price")}, p.unit_of_measurement,
+                            {_units_sql("p.stock_quantity")}
+                     FROM {{schema}}.products p""", "p.id", None, "p.id"),
+    "sales": (f"""SELECT s.id, s.invoice_id, s.date_sold, s.product_id, p.sku_id, p.product_name,
+                         s.customer_id, {_units_sql("s.quantity")}, {_rupees_sql("s.rate_per_unit")},
+                         {_rupees_sql("s.tax_amount")}, {_rupees_sql("s.total_amount")}, s.sold_by
+                  FROM {{schema}}.sales s LEFT JOIN products p ON p.id = s.product_id""",
+              "s.id", "s.date_sold", "s.product_id"),
+    "goods_receiving": (f"""SELECT g.id, g.receipt_id, g.date_received, g.product_id, p.sku_id, p.product_name,
+                                   g.supplier_id, {_units_sql("g.quantity")}, {_rupees_sql("g.rate_per_unit")},
+                                   {_rupees_sql("g.tax_amount")}, {_rupees_sql("g.total_amount")}, g.received_by
+                            FROM {{schema}}.goods_receiving g LEFT JOIN products p ON p.id = g.product_id""",
+                        "g.id", "g.date_received", "g.product_id"),
+}
+
+# Rows fetched per round trip by streaming exports
+EXPORT_BATCH_SIZE = 5000
+
+
+def export_query(table, first_day=None, last_day=None, product_id=None, schema="main"):
+    # (sql, params) for an export; days are inclusive 'YYYY-MM-DD' strings.
+    # Rows come in id order, or in date order when filtered, which is the
+    # order of the index used either way, so nothing has to be sorted.
+    if table not in EXPORTS:
+        raise InventoryError(f"Unknown export: {table}")
+    query, id_column, date_column, product_column = EXPORTS[table]
+    query = query.format(schema=schema)
+    conditions, params = [], []
+    if date_column and first_day is not None:
+        conditions.append(f"{date_column} >= ?")
+        params.append(first_day)
+    if date_column and last_day is not None:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(last_day)
+    if product_id is not None:
+        conditions.append(f"{product_column} = ?")
+        params.append(product_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return f"{query} ORDER BY {date_column if date_column and conditions else id_column}", params
+
+
+# Queries the application issues, checked by `admin.py check-plans`:
+# (name, sql, full scan allowed). Scans are only allowed on tables that
+# stay small or where reading every row is the point of the query.
+QUERY_CATALOG = (
+    ("login", "SELECT password_hash, role FROM users WHERE username = ?", False),
+    ("rehash password", "UPDATE users SET password_hash = ? WHERE username = ?", False),
+    ("load suppliers", "SELECT id, name FROM suppliers", True),
+    ("load customers", "SELECT id, name FROM customers", True),
+    ("product by id", "SELECT id, tax_rate, price, stock_quantity FROM products WHERE id = ?", False),
+    ("products by ids", "SELECT id, price, tax_rate, stock_quantity FROM products WHERE id IN (?, ?)", False),
+    ("product by barcode", "SELECT id FROM products WHERE barcode = ?", False),
+    ("product by sku", "SELECT id FROM products WHERE sku_id = ?", False),
+    ("product search", """SELECT p.id, p.product_name
+                          FROM (SELECT rowid, rank FROM products_fts WHERE products_fts MATCH ? LIMIT ?) AS hits
+                          JOIN products p ON p.id = hits.rowid ORDER BY hits.rank LIMIT ?""", False),
+    ("product page", "SELECT id, barcode, product_name FROM products WHERE id > ? ORDER BY id LIMIT ?", False),
+    ("inventory first page", "SELECT id, sku_id, product_name FROM products ORDER BY product_name, id LIMIT ?", False),
+    ("inventory page", """SELECT id, sku_id, product_name FROM products
+                          WHERE (product_name, id) > (?, ?) ORDER BY product_name, id LIMIT ?""", False),
+    ("products by category", "SELECT id FROM products WHERE category = ? AND subcategory = ?", False),
+    ("stock increment", "UPDATE products SET stock_quantity = stock_quantity + ? WHERE id = ?", False),
+    ("stock decrement", """UPDATE products SET stock_quantity = stock_quantity - ?
+                           WHERE id = ? AND stock_quantity >= ?""", False),
+    ("sales by product", """SELECT date_sold, quantity, total_amount FROM sales
+                            WHERE product_id = ? AND date_sold BETWEEN ? AND ?""", False),
+    ("sales by customer", """SELECT date_sold, total_amount FROM sales
+                             WHERE customer_id = ? AND date_sold BETWEEN ? AND ?""", False),
+    ("sales by date", "SELECT product_id, quantity FROM sales WHERE date_sold BETWEEN ? AND ?", False),
+    ("sales by operator", "SELECT id FROM sales WHERE sold_by = ? AND date_sold BETWEEN ? AND ?", False),
+    ("invoice lines", "SELECT product_id, quantity FROM sales WHERE invoice_id = ?", False),
+    ("invoices by date", "SELECT id, total_amount FROM sales_invoices WHERE date_sold BETWEEN ? AND ?", False),
+    ("receipts by product", """SELECT date_received, quantity FROM goods_receiving
+                               WHERE product_id = ? AND date_received BETWEEN ? AND ?""", False),
+    ("receipts by supplier", """SELECT date_received, total_amount FROM goods_receiving
+                                WHERE supplier_id = ? AND date_received BETWEEN ? AND ?""", False),
+    ("receipts by date", "SELECT product_id FROM goods_receiving WHERE date_received BETWEEN ? AND ?", False),
+    ("receipts by operator", """SELECT id FROM goods_receiving
+                                WHERE received_by = ? AND date_received BETWEEN ? AND ?""", False),
+    ("receipt lines", "SELECT product_id, quantity FROM goods_receiving WHERE receipt_id = ?", False),
+    ("receipt headers by date", """SELECT id, total_amount FROM goods_receipts
+                                   WHERE date_received BETWEEN ? AND ?""", False),
+    ("stock snapshot before", """SELECT movement_id, quantity FROM stock_snapshots
+                                 WHERE product_id = ? AND taken_at < ? ORDER BY movement_id DESC LIMIT 1""", False),
+    ("stock movements since", """SELECT COALESCE(SUM(quantity), 0) FROM stock_movements
+                                 WHERE product_id = ? AND id > ? AND moved_at < ?""", False),
+    ("movements by date", "SELECT product_id, quantity FROM stock_movements WHERE moved_at BETWEEN ? AND ?", False),
+    ("open cost layers", """SELECT id, remaining, unit_cost FROM cost_layers
+                            WHERE product_id = ? AND remaining > 0 ORDER BY id""", False),
+    ("movement of a line", """SELECT MIN(id) FROM stock_movements
+                               WHERE product_id = ? AND kind = 'sale' AND reference_id = ?""", False),
+    ("product cost", "SELECT quantity, average_value FROM product_costs WHERE product_id = ?", False),
+    ("last stock snapshot", "SELECT COALESCE(MAX(movement_id), 0) FROM stock_snapshots", False),
+    ("take stock snapshot", STOCK_SNAPSHOT_SQL, False),
+    ("stock check", STOCK_CHECK_SQL, True),
+    ("full stock check", FULL_STOCK_CHECK_SQL.format(movements="stock_movements"), True),
+    ("export products", export_query("products")[0], True),
+    ("export sales", export_query("sales")[0], True),
+    ("export sales by date", export_query("sales", "", "")[0], False),
+    ("export sales by product", export_query("sales", product_id=0)[0], False),
+    ("export sales by product and date", export_query("sales", "", "", 0)[0], False),
+    ("export receipts", export_query("goods_receiving")[0], True),
+    ("export receipts by date", export_query("goods_receiving", "", "")[0], False),
+    ("export receipts by product", export_query("goods_receiving", product_id=0)[0], False),
+) + tuple((f"archive batch: {table}",
+           f"SELECT id FROM {table} WHERE {date_column} >= ? AND {date_column} < ?"
+           + (f" AND {condition}" if condition else "") + " LIMIT ?",
+           False) for table, date_column, condition in ARCHIVE_TABLES) + tuple((f"report: {name}", sql, False) for name, _columns, sql in REPORTS)
+
+# bcrypt work factor for stored passwords. Hashes made with another factor
+# are rehashed the next time their user logs in.
+PASSWORD_ROUNDS = 12
+
+# Product search ranks at most this many full-text matches; a prefix that
+# matches a large part of the catalog would otherwise rank every row
+SEARCH_CANDIDATES = 500
+
+# Retry policy for postings that still hit a locked database after busy_timeout
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05
+
+
+class InventoryError(Exception):
+    pass
+
+
+class InsufficientStockError(InventoryError):
+    def __init__(self, shortages):
+        # shortages: list of (product_id, requested, available)
+        self.shortages = shortages
+        details = ", ".join(f"product {product_id}: requested {format_quantity(requested)}, "
+                            f"available {format_quantity(available)}"
+                            for product_id, requested, available in shortages)
+        super().__init__(f"Insufficient stock ({details})")
+
+
+def search_expression(text):
+    # FTS5 MATCH expression in which every word of `text` must prefix-match a
+    # word in some indexed column; quoting keeps FTS5 operators out of it.
+    # Single characters match whole words only: there is no one-character
+    # prefix index, and expanding one means merging most of the index.
+    return " ".join(f'"{word}"*' if len(word) > 1 else f'"{word}"'
+                    for word in re.findall(r"\w+", text))
+
+
+def password_rounds(password_hash):
+    # The work factor is the second field of a "$2b$12$..." hash
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode("ascii")
+    return int(password_hash.split(b"$")[2])
+
+
+def retry_on_busy(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                message = str(e)
+                if "locked" not in message and "busy" not in message:
+                    raise
+                if attempt == BUSY_RETRIES - 1:
+                    raise
+                # Exponential backoff with jitter so competing terminals spread out
+                time.sleep(BUSY_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+
+class DatabaseManager:
+    def __init__(self, db_name="inventory.db", instrument_queries=True, auto_migrate=True,
+                 password_rounds=PASSWORD_ROUNDS):
+        self.db_name = db_name
+        self.password_rounds = password_rounds
+        # Per-query latency, call and row counts for every connection
+        self.query_stats = QueryStats() if instrument_queries else None
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.product_cache = ProductCache(self._load_product)
+        self._product_listeners = []
+        if auto_migrate:
+            self.bootstrap()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_name, isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE,
+                               factory=InstrumentedConnection if self.query_stats else sqlite3.Connection)
+        if self.query_stats:
+            conn.stats = self.query_stats
+        for pragma, value in CONNECTION_PRAGMAS:
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    @property
+    def connection(self):
+        # One long-lived connection per thread, reused by every caller
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self.connect()
+            self._local.connection = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        # immediate=True takes the write lock up front, so a read-check-write
+        # sequence cannot interleave with another writer
+        conn = self.connection
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield cursor
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def history(self, first_day=None, last_day=None):
+        # Full transaction history on this thread's connection: attaches the
+        # archives of the years in first_day..last_day (inclusive
+        # 'YYYY-MM-DD' strings; default: all of them) and creates TEMP views
+        # such as sales_history, the live table plus the archived ones.
+        # Yields the schemas holding the rows, oldest archive first and
+        # "main" last. Must not be entered inside a transaction.
+        files = archive_files(self.db_name)
+        years = [year for year in files
+                 if (first_day is None or year >= int(first_day[:4]))
+                 and (last_day is None or year <= int(last_day[:4]))]
+        conn = self.connection
+        if len(years) > conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+            raise InventoryError(f"{len(years)} archives cover this range; SQLite attaches at most "
+                                 f"{conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)}, narrow the dates")
+        schemas = []
+        try:
+            for year in years:
+                conn.execute(f"ATTACH DATABASE ? AS archive_{year}", (files[year],))
+                schemas.append(f"archive_{year}")
+            for table, _date_column, _condition in ARCHIVE_TABLES:
+                # Archives made before a table was archived do not have it
+                sources = [schema for schema in schemas
+                           if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                                           (table,)).fetchone()]
+                conn.execute(f"""CREATE TEMP VIEW {table}_history AS
+                                 {" UNION ALL ".join(f"SELECT * FROM {schema}.{table}"
+                                                     for schema in sources + ["main"])}""")
+            yield schemas + ["main"]
+        finally:
+            for table, _date_column, _condition in ARCHIVE_TABLES:
+                conn.execute(f"DROP VIEW IF EXISTS temp.{table}_history")
+            for schema in schemas:
+                conn.execute(f"DETACH DATABASE {schema}")
+
+    def fetchone(self, query, params=()):
+        return self.connection.execute(query, params).fetchone()
+
+    def fetchall(self, query, params=()):
+        return self.connection.execute(query, params).fetchall()
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            # Refresh planner statistics for tables whose shape has changed;
+            # that can wait for another time if other writers hold the lock
+            try:
+                conn.execute("PRAGMA optimize")
+            except sqlite3.OperationalError:
+                pass
+            conn.close()
+        self._local = threading.local()
+
+    def explain_query_plans(self, catalog=QUERY_CATALOG, use_statistics=False):
+        # Returns (name, plan details, full scans, scan allowed) for every
+        # catalog query; a full scan is a SCAN step that does not use an index.
+        # By default the plans come from an empty in-memory copy of the schema,
+        # so that ANALYZE statistics from a small database (where scanning is
+        # genuinely cheaper) do not hide a missing index.
+        if use_statistics:
+            conn = self.connection
+        else:
+            conn = sqlite3.connect(":memory:")
+            for (sql,) in self.fetchall("""SELECT sql FROM sqlite_master
+                                           WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                                           ORDER BY sql LIKE 'CREATE VIRTUAL TABLE%' DESC, rowid"""):
+                try:
+                    conn.execute(sql)
+                except sqlite3.OperationalError as e:
+                    # Shadow tables are created by their virtual table, which
+                    # goes first: VACUUM moves it after them in sqlite_master
+                    if "already exists" not in str(e):
+                        raise
+
+        results = []
+        for name, query, allow_scan in catalog:
+            numbered = [int(number) for number in re.findall(r"\?(\d+)", query)]
+            parameters = max(numbered) if numbered else query.count("?")
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", (None,) * parameters).fetchall()
+            details = [row[3] for row in plan]
+            # Virtual table scans (full-text MATCH) go through the table's own
+            # index, and reading back a materialized subquery or co-routine is
+            # not a table scan
+            materialized = {detail.split()[1] for detail in details
+                            if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+            scans = [detail for detail in details
+                     if detail.startswith("SCAN ") and " USING " not in detail
+                     and " VIRTUAL TABLE " not in detail and detail.split()[1] not in materialized]
+            results.append((name, details, scans, allow_scan))
+        if not use_statistics:
+            conn.close()
+        return results
+
+    def schema_version(self):
+        return self.fetchone("PRAGMA user_version")[0]
+
+    def bootstrap(self):
+        # Once the schema is current startup costs a single PRAGMA read;
+        # otherwise pending migrations are applied. Returns True if any work
+        # was done.
+        if self.schema_version() >= SCHEMA_VERSION:
+            return False
+        self.migrate()
+        return True
+
+    def init_database(self):
+        self.migrate()
+
+    def pending_migrations(self, target=SCHEMA_VERSION):
+        version = self.schema_version()
+        return [migration for migration in MIGRATIONS if version < migration.version <= target]
+
+    def migration_plan(self, target=SCHEMA_VERSION):
+        # Dry run: one line per pending migration and step, without changing anything
+        lines = []
+        cursor = self.connection.cursor()
+        try:
+            for migration in self.pending_migrations(target):
+                lines.append(f"{migration.version}: {migration.description}")
+                for step in migration.steps:
+                    lines.append(f"    {step.describe(cursor)}")
+        finally:
+            cursor.close()
+        return lines
+
+    def migrate(self, target=SCHEMA_VERSION, chunk_size=MIGRATION_CHUNK_SIZE, progress=None):
+        # Applies pending migrations in order. Ordinary steps run in one
+        # transaction together with the user_version bump; table rebuilds
+        # commit chunk by chunk in between. Returns the versions applied.
+        report = progress or (lambda message: None)
+        applied = []
+        for migration in self.pending_migrations(target):
+            report(f"migration {migration.version}: {migration.description}")
+            steps = []
+            for step in migration.steps:
+                if step.chunked:
+                    self._apply_steps(steps)
+                    steps = []
+                    step.run(self, chunk_size, report)
+                else:
+                    steps.append(step)
+            if self._apply_steps(steps, migration.version):
+                applied.append(migration.version)
+        return applied
+
+    def _apply_steps(self, steps, version=None):
+        with self.transaction(immediate=True) as cursor:
+            # Another process may have applied the migration while we waited for the lock
+            if version is not None:
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] >= version:
+                    return False
+            for step in steps:
+                step.apply(cursor)
+            if version is not None:
+                cursor.execute(f"PRAGMA user_version = {version}")
+        return True
+
+    def authenticate(self, username, password):
+        # Returns the user's role, or None. A hash whose work factor differs
+        # from password_rounds is replaced while the password is at hand.
+        row = self.fetchone("SELECT password_hash, role FROM users WHERE username = ?", (username,))
+        if row is None:
+            return None
+        password_hash, role = row
+        if isinstance(password_hash, str):
+            password_hash = password_hash.encode("ascii")
+        if not bcrypt.checkpw(password.encode("utf-8"), password_hash):
+            return None
+        if password_rounds(password_hash) != self.password_rounds:
+            self.set_password(username, password)
+        return role
+
+    @retry_on_busy
+    def set_password(self, username, password):
+        password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(self.password_rounds))
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username))
+
+    def _load_product(self, product_id):
+        row = self.fetchone("""SELECT id, barcode, sku_id, product_name, unit_of_measurement,
+                                      tax_rate, price, stock_quantity
+                               FROM products WHERE id = ?""", (product_id,))
+        return ProductRecord(*row) if row else None
+
+    def get_product(self, product_id):
+        return self.product_cache.get(product_id)
+
+    def find_product_by_code(self, code):
+        # Barcode or SKU lookup; both columns are UNIQUE so each branch is a
+        # single probe of its automatic index
+        generation = self.product_cache.generation
+        row = self.fetchone("""SELECT id, barcode, sku_id, product_name, unit_of_measurement,
+                                      tax_rate, price, stock_quantity
+                               FROM products WHERE barcode = ?
+                               UNION ALL
+                               SELECT id, barcode, sku_id, product_name, unit_of_measurement,
+                                      tax_rate, price, stock_quantity
+                               FROM products WHERE sku_id = ?
+                               LIMIT 1""", (code, code))
+        if row is None:
+            return None
+        product = ProductRecord(*row)
+        self.product_cache.put(product, generation)
+        return product
+
+    def add_products_listener(self, callback):
+        # callback(product_ids) runs after every committed change to product
+        # rows, on the thread that made the change; None means "everything"
+        self._product_listeners.append(callback)
+
+    def remove_products_listener(self, callback):
+        self._product_listeners.remove(callback)
+
+    def invalidate_products(self, product_ids=None):
+        # Must be called after anything that changes product rows;
+        # None drops the whole cache
+        if product_ids is not None:
+            product_ids = list(product_ids)
+        self.product_cache.invalidate(product_ids)
+        for callback in list(self._product_listeners):
+            callback(product_ids)
+
+    def _tax_rates(self, cursor, product_ids):
+        placeholders = ", ".join("?" * len(product_ids))
+        cursor.execute(f"SELECT id, tax_rate FROM products WHERE id IN ({placeholders})",
+                       list(product_ids))
+        tax_rates = dict(cursor.fetchall())
+        missing = set(product_ids) - tax_rates.keys()
+        if missing:
+            raise InventoryError(f"Unknown product id(s): {sorted(missing)}")
+        return tax_rates
+
+    @retry_on_busy
+    def post_goods_receipt(self, supplier_id, lines, received_by):
+        # lines: iterable of (product_id, quantity, rate_per_unit). The whole
+        # document is written in one transaction: one header insert, one
+        # executemany for the lines and one stock update per distinct product.
+        lines = list(lines)
+        if not lines:
+            raise InventoryError("A goods receipt needs at least one line")
+
+        stock_deltas = {}
+        for product_id, quantity, _rate in lines:
+            stock_deltas[product_id] = stock_deltas.get(product_id, 0) + quantity
+
+        with self.transaction(immediate=True) as cursor:
+            tax_rates = self._tax_rates(cursor, stock_deltas.keys())
+
+            line_rows = []
+            document_total = 0
+            for product_id, quantity, rate in lines:
+                _subtotal, tax_amount, total = line_totals(quantity, rate, tax_rates[product_id])
+                document_total += total
+                line_rows.append((product_id, supplier_id, quantity, rate, tax_amount, total, received_by))
+
+            cursor.execute("""INSERT INTO goods_receipts (supplier_id, line_count, total_amount, received_by)
+                              VALUES (?, ?, ?, ?)""",
+                           (supplier_id, len(line_rows), document_total, received_by))
+            receipt_id = cursor.lastrowid
+
+            cursor.executemany("""INSERT INTO goods_receiving
+                                  (product_id, supplier_id, quantity, rate_per_unit, tax_amount,
+                                   total_amount, received_by, receipt_id)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                               [row + (receipt_id,) for row in line_rows])
+
+            cursor.executemany("""INSERT INTO stock_movements (product_id, kind, quantity, reference_id, created_by)
+                                  VALUES (?, 'receipt', ?, ?, ?)""",
+                               [(product_id, quantity, receipt_id, received_by)
+                                for product_id, quantity, _rate in lines])
+
+            cursor.executemany("UPDATE products SET stock_quantity = stock_quantity + ? WHERE id = ?",
+                               [(delta, product_id) for product_id, delta in stock_deltas.items()])
+
+            add_cost_layers(cursor, [(product_id, "receipt", receipt_id, quantity, rate)
+                                     for product_id, quantity, rate in lines])
+
+        self.invalidate_products(stock_deltas.keys())
+        return receipt_id
+
+    @retry_on_busy
+    def post_sales_invoice(self, customer_id, lines, sold_by):
+        # lines: iterable of (product_id, quantity). Stock for every line is
+        # checked and decremented and the lines inserted in one transaction
+        # holding the write lock; nothing is written if any product is short.
+        lines = list(lines)
+        if not lines:
+            raise InventoryError("A sales invoice needs at least one line")
+
+        requested = {}
+        for product_id, quantity in lines:
+            requested[product_id] = requested.get(product_id, 0) + quantity
+
+        with self.transaction(immediate=True) as cursor:
+            placeholders = ", ".join("?" * len(requested))
+            cursor.execute(f"""SELECT id, price, tax_rate, stock_quantity FROM products
+                               WHERE id IN ({placeholders})""", list(requested))
+            products = {row[0]: row[1:] for row in cursor.fetchall()}
+            missing = requested.keys() - products.keys()
+            if missing:
+                raise InventoryError(f"Unknown product id(s): {sorted(missing)}")
+
+            # Conditional decrement: a row is only touched if it still holds
+            # enough stock, so concurrent terminals can never oversell it
+            shortages = []
+            for product_id, quantity in requested.items():
+                cursor.execute("""UPDATE products SET stock_quantity = stock_quantity - ?
+                                  WHERE id = ? AND stock_quantity >= ?""",
+                               (quantity, product_id, quantity))
+                if cursor.rowcount != 1:
+                    shortages.append((product_id, quantity, products[product_id][2]))
+            if shortages:
+                raise InsufficientStockError(shortages)
+
+            line_results, (subtotal, tax_amount, total) = invoice_totals(
+                (quantity, products[product_id][0], products[product_id][1])
+                for product_id, quantity in lines)
+
+            cursor.execute("""INSERT INTO sales_invoices
+                              (customer_id, line_count, subtotal, tax_amount, total_amount, sold_by)
+                              VALUES (?, ?, ?, ?, ?, ?)""",
+                           (customer_id, len(lines), subtotal, tax_amount, total, sold_by))
+            invoice_id = cursor.lastrowid
+
+            cursor.executemany("""INSERT INTO sales
+                                  (product_id, customer_id, quantity, rate_per_unit, tax_amount,
+                                   total_amount, sold_by, invoice_id)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                               [(product_id, customer_id, quantity, products[product_id][0],
+                                 line_tax, line_total, sold_by, invoice_id)
+                                for (product_id, quantity), (_sub, line_tax, line_total)
+                                in zip(lines, line_results)])
+
+            cursor.executemany("""INSERT INTO stock_movements (product_id, kind, quantity, reference_id, created_by)
+                                  VALUES (?, 'sale', ?, ?, ?)""",
+                               [(product_id, -quantity, invoice_id, sold_by) for product_id, quantity in lines])
+
+            record_sales(cursor, [(product_id, quantity, line_subtotal)
+                                  for (product_id, quantity), (line_subtotal, _tax, _total)
+                                  in zip(lines, line_results)])
+
+        self.invalidate_products(requested.keys())
+        return invoice_id
+
+    @retry_on_busy
+    def post_stock_movement(self, kind, product_id, quantity, created_by, reference_id=None, note=None):
+        # Records an adjustment (signed quantity: a stock count correction,
+        # breakage, ...) or a customer return (positive quantity, with the
+        # sales invoice as reference_id) and applies it to the stock level in
+        # the same transaction. Stock is never taken below zero.
+        if kind not in MANUAL_MOVEMENTS:
+            raise InventoryError(f"Unknown stock movement: {kind}")
+        if quantity == 0 or (kind == "return" and quantity < 0):
+            raise InventoryError(f"Invalid quantity for a stock {kind}: {quantity}")
+
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute("""UPDATE products SET stock_quantity = stock_quantity + ?
+                              WHERE id = ? AND stock_quantity + ? >= 0""",
+                           (quantity, product_id, quantity))
+            if cursor.rowcount != 1:
+                cursor.execute("SELECT stock_quantity FROM products WHERE id = ?", (product_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    raise InventoryError(f"Unknown product id(s): [{product_id}]")
+                raise InsufficientStockError([(product_id, -quantity, row[0])])
+            cursor.execute("""INSERT INTO stock_movements
+                              (product_id, kind, quantity, reference_id, note, created_by)
+                              VALUES (?, ?, ?, ?, ?, ?)""",
+                           (product_id, kind, quantity, reference_id, note, created_by))
+            movement_id = cursor.lastrowid
+            # Stock coming back is valued at the current average cost
+            if quantity < 0:
+                issue_stock(cursor, product_id, -quantity)
+            else:
+                add_cost_layers(cursor, [(product_id, kind, reference_id, quantity,
+                                          current_unit_cost(cursor, product_id))])
+
+        self.invalidate_products([product_id])
+        return movement_id
+
+    @retry_on_busy
+    def take_stock_snapshot(self):
+        # Checkpoints the products that moved since the last snapshot; run it
+        # periodically (e.g. nightly) so history queries and the stock check
+        # only replay recent movements. Returns the number of products.
+        with self.transaction(immediate=True) as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements")
+            last_movement = cursor.fetchone()[0]
+            cursor.execute("SELECT COALESCE(MAX(movement_id), 0) FROM stock_snapshots")
+            previous = cursor.fetchone()[0]
+            if last_movement == previous:
+                return 0
+            cursor.execute(STOCK_SNAPSHOT_SQL, (last_movement, previous))
+            return cursor.rowcount
+
+    def stock_at(self, product_id, moment):
+        # Stock of a product just before `moment` (UTC 'YYYY-MM-DD HH:MM:SS',
+        # or 'YYYY-MM-DD' for the start of that day): the latest snapshot
+        # taken before then plus the movements recorded after it, archived
+        # ones included
+        movement_id, taken_at, quantity = self.fetchone(
+            """SELECT movement_id, taken_at, quantity FROM stock_snapshots
+               WHERE product_id = ? AND taken_at < ?
+               ORDER BY movement_id DESC LIMIT 1""", (product_id, moment)) or (0, None, 0)
+        with self.history(taken_at, moment):
+            return quantity + self.fetchone("""SELECT COALESCE(SUM(quantity), 0) FROM stock_movements_history
+                                               WHERE product_id = ? AND id > ? AND moved_at < ?""",
+                                            (product_id, movement_id, moment))[0]
+
+    def stock_discrepancies(self, full=False):
+        # Yields (product_id, sku_id, stock_quantity, ledger quantity) for
+        # every product whose stock level disagrees with the ledger, streaming
+        # one pass over the catalog. By default each product's movements are
+        # replayed from its latest snapshot; full=True replays the whole
+        # ledger, archives included, which also vouches for the snapshots.
+        with self.history() if full else nullcontext():
+            cursor = self.connection.execute(FULL_STOCK_CHECK_SQL.format(movements="stock_movements_history")
+                                             if full else STOCK_CHECK_SQL)
+            try:
+                for product_id, sku_id, stock, ledger in cursor:
+                    if stock != ledger:
+                        yield product_id, sku_id, stock, ledger
+            finally:
+                cursor.close()
+
+    def valuation_totals(self):
+        # (quantity, average value, FIFO value) of all stock on hand
+        return self.fetchone("""SELECT COALESCE(SUM(quantity), 0), COALESCE(SUM(average_value), 0),
+                                       COALESCE(SUM(fifo_value), 0)
+                                FROM product_costs""")
+
+    def export_rows(self, table, first_day=None, last_day=None, product_id=None):
+        # Yields the column names, then batches of rows read with fetchmany
+        # from one cursor, so memory stays constant for any table size. It
+        # is a single read transaction: in WAL mode postings carry on while
+        # it runs and the export is a consistent snapshot. Archived years in
+        # range are read from their archives first, one schema at a time.
+        archived = any(table == archived_table for archived_table, _date_column, _condition in ARCHIVE_TABLES)
+        with self.history(first_day, last_day) if archived else nullcontext(["main"]) as schemas:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute("BEGIN")
+                for index, schema in enumerate(schemas):
+                    cursor.execute(*export_query(table, first_day, last_day, product_id, schema))
+                    if index == 0:
+                        yield [column[0] for column in cursor.description]
+                    while True:
+                        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                        if not rows:
+                            break
+                        yield rows
+            finally:
+                cursor.close()
+                self.connection.rollback()
+
+    def product_page(self, after_id=None, limit=500):
+        return self.fetchall("""SELECT id, barcode, sku_id, category, subcategory, product_name,
+                                       description, tax_rate, price, unit_of_measurement, stock_quantity
+                                FROM products
+                                WHERE id > ?
+                                ORDER BY id
+                                LIMIT ?""", (after_id or 0, limit))
+
+    def search_products(self, text, limit=50):
+        # Best matches first, in the same row layout as product_page
+        expression = search_expression(text)
+        if not expression:
+            return []
+        return self.fetchall("""SELECT p.id, p.barcode, p.sku_id, p.category, p.subcategory, p.product_name,
+                                       p.description, p.tax_rate, p.price, p.unit_of_measurement,
+                                       p.stock_quantity
+                                FROM (SELECT rowid, rank FROM products_fts
+                                      WHERE products_fts MATCH ? LIMIT ?) AS hits
+                                JOIN products p ON p.id = hits.rowid
+                                ORDER BY hits.rank
+                                LIMIT ?""", (expression, SEARCH_CANDIDATES, limit))
+
+    def product_rows(self, product_ids):
+        placeholders = ", ".join("?" * len(product_ids))
+        return self.fetchall(f"""SELECT id, barcode, sku_id, category, subcategory, product_name,
+                                        description, tax_rate, price, unit_of_measurement, stock_quantity
+                                 FROM products
+                                 WHERE id IN ({placeholders})""", list(product_ids))
+
+    def inventory_rows(self, product_ids):
+        placeholders = ", ".join("?" * len(product_ids))
+        return self.fetchall(f"""SELECT id, sku_id, product_name, category, subcategory,
+                                        stock_quantity, unit_of_measurement, price
+                                 FROM products
+                                 WHERE id IN ({placeholders})""", list(product_ids))
+
+    def inventory_page(self, after=None, limit=500):
+        # `after` is the (product_name, id) key of the last row already shown
+        if after is None:
+            return self.fetchall("""SELECT id, sku_id, product_name, category, subcategory,
+                                           stock_quantity, unit_of_measurement, price
+                                    FROM products
+                                    ORDER BY product_name, id
+                                    LIMIT ?""", (limit,))
+        return self.fetchall("""SELECT id, sku_id, product_name, category, subcategory,
+                                       stock_quantity, unit_of_measurement, price
+                                FROM products
+                                WHERE (product_name, id) > (?, ?)
+                                ORDER BY product_name, id
+                                LIMIT ?""", (after[0], after[1], limit))
+
+    def report(self, name, first_day, last_day, limit=-1):
+        # first_day and last_day are inclusive 'YYYY-MM-DD' strings
+        for report_name, _columns, sql in REPORTS:
+            if report_name == name:
+                return self.fetchall(sql, (first_day, last_day, limit))
+        raise InventoryError(f"Unknown report: {name}")
+
+    def rebuild_summaries(self, first_day=None, last_day=None, progress=None):
+        # Recomputes the daily summary tables for first_day..last_day
+        # (inclusive 'YYYY-MM-DD' strings; default: the whole history) from
+        # the line tables, one calendar month per transaction so postings
+        # are only held up briefly. Archived months are read from their
+        # archives. Days are local dates; the lines of a day are picked by
+        # the UTC range of their timestamps. Returns the number of months
+        # rebuilt.
+        report = progress or (lambda message: None)
+        if first_day is None or last_day is None:
+            with self.transaction() as cursor:
+                earliest, latest = history_days(cursor, local=True)
+            years = list(archive_files(self.db_name))
+            if years:
+                earliest = min(earliest or "9999", f"{years[0]}-01-01")
+                latest = max(latest or "0000", f"{years[-1]}-12-31")
+            if earliest is None:
+                return 0
+            first_day = first_day or earliest
+            last_day = last_day or latest
+
+        months = 0
+        # A local day can start in the previous UTC year or end in the next
+        around = ((date.fromisoformat(first_day) - timedelta(days=1)).isoformat(),
+                  (date.fromisoformat(last_day) + timedelta(days=1)).isoformat())
+        with self.history(*around):
+            for month_first, month_last, day_after in month_ranges(first_day, last_day):
+                with self.transaction(immediate=True) as cursor:
+                    for table, key, source, source_key in SUMMARY_TABLES:
+                        date_column = SUMMARY_DATE_COLUMNS[source]
+                        key_column = f"{key}, " if key else ""
+                        key_value = f"COALESCE({source_key}, 0), " if key else ""
+                        cursor.execute(f"DELETE FROM {table} WHERE day BETWEEN ? AND ?", (month_first, month_last))
+                        # Source rows are selected by timestamp range so the date index is used
+                        cursor.execute(f"""INSERT INTO {table} (day, {key_column}line_count, quantity, subtotal,
+                                                                tax_amount, total_amount)
+                                           SELECT date({date_column}, 'localtime'), {key_value}COUNT(*),
+                                                  SUM(quantity), SUM(total_amount - COALESCE(tax_amount, 0)),
+                                                  SUM(COALESCE(tax_amount, 0)), SUM(total_amount)
+                                           FROM {source}_history
+                                           WHERE {date_column} >= datetime(?, 'utc')
+                                             AND {date_column} < datetime(?, 'utc')
+                                           GROUP BY 1{", 2" if key else ""}""", (month_first, day_after))
+                months += 1
+                report(f"summaries: {month_first} to {month_last} rebuilt")
+        return months
+
+    def create_sample_data(self):
+        with self.transaction() as cursor:
+            insert_sample_data(cursor, price_scale=PAISE_PER_RUPEE)
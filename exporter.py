@@ -0,0 +1,84 @@
+import csv
+import gzip
+import json
+import os
+
+# Output buffer; rows are written in batches, the disk sees large writes
+WRITE_BUFFER_SIZE = 1 << 20
+# zlib level for .gz exports: close to the smallest output at a fraction
+# of the CPU time of level 9
+GZIP_LEVEL = 6
+
+FORMATS = ("csv", "jsonl")
+
+
+def export_format(path):
+    # "csv" or "jsonl" from the file name, ignoring a trailing .gz
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lstrip(".").lower()
+    return extension if extension in FORMATS else None
+
+
+def open_output(path, compress):
+    if compress:
+        return gzip.open(path, "wt", compresslevel=GZIP_LEVEL, encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE)
+
+
+class CsvWriter:
+    def __init__(self, output, columns):
+        self._writer = csv.writer(output)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+
+# One JSON object per line, keyed by column name
+class JsonLinesWriter:
+    def __init__(self, output, columns):
+        self._output = output
+        self._columns = columns
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, rows):
+        columns, encode = self._columns, self._encode
+        self._output.write("".join(encode(dict(zip(columns, row))) + "\n" for row in rows))
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonLinesWriter}
+
+
+def export_table(db_manager, table, path, fmt=None, compress=None, first_day=None, last_day=None,
+                 product_id=None, progress=None, cancelled=None):
+    # Streams an export into path and returns the number of rows written.
+    # The format and compression default to what the file name says
+    # (sales.csv, sales.jsonl.gz, ...). The rows go to a temporary file that
+    # replaces path only once the export is complete; progress(rows) is
+    # called after every batch, and a true cancelled() stops the export
+    # and returns None.
+    fmt = fmt or export_format(path)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format for {path}; use one of {', '.join(FORMATS)}")
+    if compress is None:
+        compress = path.endswith(".gz")
+
+    partial = path + ".part"
+    written = 0
+    batches = db_manager.export_rows(table, first_day, last_day, product_id)
+    try:
+        with open_output(partial, compress) as output:
+            writer = WRITERS[fmt](output, next(batches))
+            for rows in batches:
+                if cancelled and cancelled():
+                    return None
+                writer.write(rows)
+                written += len(rows)
+                if progress:
+                    progress(written)
+        os.replace(partial, path)
+        return written
+    finally:
+        batches.close()
+        if os.path.exists(partial):
+            os.remove(partial)
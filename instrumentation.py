@@ -0,0 +1,190 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+HISTOGRAM_BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SLOW_QUERY_MS = 50.0
+
+slow_query_log = logging.getLogger("inventory.slow_queries")
+slow_query_log.addHandler(logging.NullHandler())
+
+_whitespace = re.compile(r"\s+")
+_placeholder_list = re.compile(r"\(\?(?:, \?)+\)")
+
+
+def normalize_query(query):
+    # Collapse formatting and variable-length IN (?, ?, ...) lists so the
+    # same statement is always counted under one key
+    return _placeholder_list.sub("(?, ...)", _whitespace.sub(" ", query).strip())
+
+
+def configure_slow_query_log(path="slow_queries.log"):
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s %(message)s"))
+    slow_query_log.addHandler(handler)
+    slow_query_log.setLevel(logging.WARNING)
+    # Slow queries go to their own file only, whatever the root logger does
+    slow_query_log.propagate = False
+    return handler
+
+
+class QueryStat:
+    __slots__ = ("calls", "rows", "total_ms", "max_ms", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the requested fraction of calls
+        target = self.calls * fraction
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS + (self.max_ms,), self.histogram):
+            seen += count
+            if seen >= target and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.calls if self.calls else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "histogram": dict(zip([f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + ["inf"],
+                                  self.histogram)),
+        }
+
+
+class QueryStats:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, query, params, elapsed_ms, rows):
+        key = normalize_query(query)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = QueryStat()
+            stat.calls += 1
+            stat.rows += rows
+            stat.total_ms += elapsed_ms
+            stat.max_ms = max(stat.max_ms, elapsed_ms)
+            stat.histogram[bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+
+        if elapsed_ms >= self.slow_query_ms:
+            slow_query_log.warning("%.1f ms, %d rows: %s params=%r", elapsed_ms, rows, key,
+                                   params if not isinstance(params, list) else f"<{len(params)} rows>")
+
+    def snapshot(self):
+        with self._lock:
+            return {query: stat.to_dict() for query, stat in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"slow_query_ms": self.slow_query_ms, "queries": self.snapshot()}, f, indent=2)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Times each statement from execute() until its results are exhausted,
+    # the cursor is reused or closed, and reports it to connection.stats
+
+    _pending = None
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            self.connection.stats.record(*pending)
+
+    def _start(self, query, params, method):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return method(query, params)
+        finally:
+            self._pending = [query, params, (time.perf_counter() - start) * 1000.0, 0]
+
+    def _fetched(self, start, rows, exhausted):
+        pending = self._pending
+        if pending is not None:
+            pending[2] += (time.perf_counter() - start) * 1000.0
+            pending[3] += rows
+            if exhausted:
+                self._finish()
+
+    def execute(self, query, params=()):
+        self._start(query, params, super().execute)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        params = list(seq_of_params)
+        self._start(query, params, super().executemany)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, query, params=()):
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, seq_of_params):
+        return self.cursor().executemany(query, seq_of_params)
@@ -1,186 +1,58 @@
 
 import sys
-import sqlite3
-import bcrypt
+import time
+import logging
+import argparse
+import threading
 from datetime import datetime
-from decimal import Decimal
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                               QHBoxLayout, QTabWidget, QLabel, QLineEdit, 
                               QPushButton, QComboBox, QSpinBox, QDoubleSpinBox,
-                              QTableWidget, QTableWidgetItem, QMessageBox,
-                              QDialog, QFormLayout, QTextEdit, QHeaderView)
-from PySide6.QtCore import Qt
+                              QTableView, QTableWidget, QTableWidgetItem,
+                              QAbstractItemView, QMessageBox,
+                              QDialog, QFormLayout, QTextEdit, QHeaderView,
+                              QFileDialog, QProgressBar, QDateEdit, QCheckBox)
+from PySide6.QtCore import QDate, Qt, QTimer, Signal
 from PySide6.QtGui import QFont
 
-class DatabaseManager:
-    def __init__(self, db_name="inventory.db"):
-        self.db_name = db_name
-        self.init_database()
-        self.create_sample_data()
-
-    def init_database(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        # Users table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL
-            )
-        """)
-
-        # Products table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                barcode TEXT UNIQUE,
-                sku_id TEXT UNIQUE NOT NULL,
-                category TEXT NOT NULL,
-                subcategory TEXT NOT NULL,
-                product_name TEXT NOT NULL,
-                description TEXT,
-                tax_rate REAL DEFAULT 0.0,
-                price REAL NOT NULL,
-                unit_of_measurement TEXT NOT NULL,
-                stock_quantity REAL DEFAULT 0.0,
-                product_image_path TEXT
-            )
-        """)
-
-        # Suppliers table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS suppliers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                contact_person TEXT,
-                phone TEXT,
-                email TEXT,
-                address TEXT
-            )
-        """)
-
-        # Customers table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT,
-                email TEXT,
-                address TEXT
-            )
-        """)
-
-        # Goods receiving table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS goods_receiving (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER,
-                supplier_id INTEGER,
-                quantity REAL NOT NULL,
-                rate_per_unit REAL NOT NULL,
-                tax_amount REAL,
-                total_amount REAL NOT NULL,
-                date_received TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                received_by TEXT,
-                FOREIGN KEY (product_id) REFERENCES products (id),
-                FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
-            )
-        """)
-
-        # Sales table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER,
-                customer_id INTEGER,
-                quantity REAL NOT NULL,
-                rate_per_unit REAL NOT NULL,
-                tax_amount REAL,
-                total_amount REAL NOT NULL,
-                date_sold TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sold_by TEXT,
-                FOREIGN KEY (product_id) REFERENCES products (id),
-                FOREIGN KEY (customer_id) REFERENCES customers (id)
-            )
-        """)
-
-        conn.commit()
-        conn.close()
-
-    def create_sample_data(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        # Check if users already exist
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            # Create users
-            goods_password = bcrypt.hashpw("password123".encode('utf-8'), bcrypt.gensalt())
-            sales_password = bcrypt.hashpw("password123".encode('utf-8'), bcrypt.gensalt())
-
-            cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                          ("goods_operator", goods_password, "goods_receiving"))
-            cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                          ("sales_operator", sales_password, "sales"))
-
-        # Check if products already exist
-        cursor.execute("SELECT COUNT(*) FROM products")
-        if cursor.fetchone()[0] == 0:
-            # Sample products
-            products = [
-                ("ELC001", "SKU001", "Electronics", "Laptops", "Dell Laptop", "High-performance laptop", 18.0, 50000.0, "piece"),
-                ("ELC002", "SKU002", "Electronics", "Accessories", "Wireless Mouse", "Optical wireless mouse", 12.0, 1500.0, "piece"),
-                ("ELC003", "SKU003", "Electronics", "Monitors", "LED Monitor", "24-inch LED monitor", 18.0, 15000.0, "piece"),
-                ("ELC004", "SKU004", "Electronics", "Accessories", "Keyboard", "Mechanical keyboard", 12.0, 3000.0, "piece"),
-                ("ELC005", "SKU005", "Electronics", "Storage", "External HDD", "1TB external hard drive", 18.0, 5000.0, "piece")
-            ]
-
-            for barcode, sku, cat, subcat, name, desc, tax, price, unit in products:
-                cursor.execute("""INSERT INTO products 
-                                 (barcode, sku_id, category, subcategory, product_name, 
-                                  description, tax_rate, price, unit_of_measurement) 
-                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                              (barcode, sku, cat, subcat, name, desc, tax, price, unit))
-
-        # Check if suppliers already exist
-        cursor.execute("SELECT COUNT(*) FROM suppliers")
-        if cursor.fetchone()[0] == 0:
-            suppliers = [
-                ("Tech Suppliers Ltd", "John Doe", "9876543210", "john@techsuppliers.com", "123 Tech Street"),
-                ("Electronics Wholesale", "Jane Smith", "9876543211", "jane@ewholesale.com", "456 Electronics Ave"),
-                ("Global Components", "Mike Johnson", "9876543212", "mike@globalcomp.com", "789 Component Road")
-            ]
-
-            for name, contact, phone, email, address in suppliers:
-                cursor.execute("INSERT INTO suppliers (name, contact_person, phone, email, address) VALUES (?, ?, ?, ?, ?)",
-                              (name, contact, phone, email, address))
-
-        # Check if customers already exist
-        cursor.execute("SELECT COUNT(*) FROM customers")
-        if cursor.fetchone()[0] == 0:
-            customers = [
-                ("ABC Corporation", "9876543220", "contact@abc.com", "123 Business Street"),
-                ("XYZ Enterprises", "9876543221", "info@xyz.com", "456 Corporate Ave"),
-                ("Individual Customer", "9876543222", "customer@email.com", "789 Customer Road")
-            ]
-
-            for name, phone, email, address in customers:
-                cursor.execute("INSERT INTO customers (name, phone, email, address) VALUES (?, ?, ?, ?)",
-                              (name, phone, email, address))
-
-        conn.commit()
-        conn.close()
+from database import PASSWORD_ROUNDS, REPORTS, DatabaseManager, InventoryError
+from exporter import export_table
+from instrumentation import configure_slow_query_log
+from models import PagedTableModel, ProductChangeNotifier
+from pricing import MILLI_PER_UNIT, format_money, format_quantity, line_totals, to_milli, to_paise
+from remote import RemoteDatabase, RemoteService
+from service import InventoryService
+from session import LOCK_AFTER_SECONDS, LocalSession
+from widgets import IdleWatcher, ProductPicker, SearchBox
+from workers import DbExecutor
+
+# Matches shown in the product table while searching
+SEARCH_TABLE_RESULTS = 200
+
+# Startup milestones are measured from the moment this module is imported
+PROCESS_START = time.perf_counter()
+startup_log = logging.getLogger("inventory.startup")
+
+
+def log_startup(milestone):
+    startup_log.info("%s: %.1f ms", milestone, (time.perf_counter() - PROCESS_START) * 1000)
 
 class LoginDialog(QDialog):
-    def __init__(self):
-        super().__init__()
-        self.setWindowTitle("Inventory Management System - Login")
-        self.setFixedSize(300, 150)
-        self.user_role = None
-        self.username = None
+    # With a session the dialog unlocks that session's idle terminal instead:
+    # the username is fixed and a password matching the session is accepted
+    # without another bcrypt check
+    def __init__(self, db_manager, session=None, executor=None, parent=None):
+        super().__init__(parent)
+        self.db = db_manager
+        self.session = session
+        self.executor = executor or DbExecutor(read_threads=1, parent=self)
+        if session:
+            self.setWindowTitle("Inventory Management System - Locked")
+        else:
+            self.setWindowTitle("Inventory Management System - Login")
+        self.setFixedSize(300, 170)
+        self.user_role = session.role if session else None
+        self.username = session.username if session else None
         self.setup_ui()
 
     def setup_ui(self):
@@ -189,16 +61,42 @@ class LoginDialog(QDialog):
         self.username_edit = QLineEdit()
         self.password_edit = QLineEdit()
         self.password_edit.setEchoMode(QLineEdit.Password)
-
-        login_button = QPushButton("Login")
-        login_button.clicked.connect(self.authenticate)
+        if self.session:
+            self.username_edit.setText(self.session.username)
+            self.username_edit.setReadOnly(True)
+            self.password_edit.setFocus()
+
+        self.login_button = QPushButton("Unlock" if self.session else "Login")
+        self.login_button.clicked.connect(self.authenticate)
+        self.password_edit.returnPressed.connect(self.authenticate)
+
+        # Shown while the password is being checked
+        self.busy_bar = QProgressBar()
+        self.busy_bar.setRange(0, 0)
+        self.busy_bar.setTextVisible(False)
+        self.busy_bar.setMaximumHeight(8)
+        self.busy_bar.hide()
 
         layout.addRow("Username:", self.username_edit)
         layout.addRow("Password:", self.password_edit)
-        layout.addRow("", login_button)
+        layout.addRow("", self.login_button)
+        if self.session:
+            sign_out_button = QPushButton("Sign Out")
+            sign_out_button.clicked.connect(self.reject)
+            layout.addRow("", sign_out_button)
+        layout.addRow(self.busy_bar)
 
         self.setLayout(layout)
 
+    def set_busy(self, busy):
+        self.login_button.setEnabled(not busy)
+        self.password_edit.setEnabled(not busy)
+        self.busy_bar.setVisible(busy)
+        if busy:
+            self.setCursor(Qt.BusyCursor)
+        else:
+            self.unsetCursor()
+
     def authenticate(self):
         username = self.username_edit.text()
         password = self.password_edit.text()
@@ -207,32 +105,288 @@ class LoginDialog(QDialog):
             QMessageBox.warning(self, "Error", "Please enter both username and password")
             return
 
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash, role FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        conn.close()
+        if not self.login_button.isEnabled():
+            return
+
+        # A quick unlock does not extend the session: only a full login
+        # renews it, so the bcrypt check comes back once it expires
+        if self.session and self.session.verify(password):
+            self.accept_login(username, self.session.role)
+            return
 
-        if result and bcrypt.checkpw(password.encode('utf-8'), result[0]):
-            self.user_role = result[1]
-            self.username = username
-            self.accept()
+        # The lookup and bcrypt check run on a worker thread
+        self.set_busy(True)
+        self.executor.submit(self.db.authenticate, username, password,
+                             on_result=lambda role: self.login_finished(username, password, role),
+                             on_error=self.login_failed)
+
+    def login_finished(self, username, password, role):
+        self.set_busy(False)
+        if role:
+            if self.session:
+                self.session.renew(password)
+            else:
+                self.session = LocalSession(username, role, password)
+            self.accept_login(username, role)
         else:
+            self.password_edit.clear()
+            self.password_edit.setFocus()
             QMessageBox.warning(self, "Error", "Invalid username or password")
 
+    def login_failed(self, error):
+        # The check itself failed (database locked, server unreachable...),
+        # which says nothing about the password
+        self.set_busy(False)
+        QMessageBox.critical(self, "Error", f"Login failed: {error}")
+
+    def accept_login(self, username, role):
+        self.user_role = role
+        self.username = username
+        self.accept()
+
+class QueryDiagnosticsDialog(QDialog):
+    def __init__(self, query_stats, parent=None):
+        super().__init__(parent)
+        self.query_stats = query_stats
+        self.setWindowTitle("Query Diagnostics")
+        self.resize(900, 500)
+        self.setup_ui()
+        self.refresh()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.stats_table = QTableWidget(0, 7)
+        self.stats_table.setHorizontalHeaderLabels([
+            "Query", "Calls", "Rows", "Mean (ms)", "p95 (ms)", "Max (ms)", "Total (ms)"
+        ])
+        self.stats_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.stats_table.setWordWrap(False)
+        self.stats_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.stats_table)
+
+        refresh_button = QPushButton("Refresh")
+        refresh_button.clicked.connect(self.refresh)
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset)
+        export_button = QPushButton("Export JSON...")
+        export_button.clicked.connect(self.export_json)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(refresh_button)
+        buttons_layout.addWidget(reset_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(export_button)
+        layout.addLayout(buttons_layout)
+
+    def refresh(self):
+        # Heaviest queries first
+        stats = sorted(self.query_stats.snapshot().items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        self.summary_label.setText(
+            f"{len(stats)} distinct queries, {sum(stat['calls'] for _query, stat in stats)} calls; "
+            f"queries over {self.query_stats.slow_query_ms:.0f} ms go to the slow-query log")
+
+        self.stats_table.setRowCount(len(stats))
+        for row, (query, stat) in enumerate(stats):
+            values = [query, str(stat["calls"]), str(stat["rows"]), f"{stat['mean_ms']:.3f}",
+                      f"{stat['p95_ms']:.3f}", f"{stat['max_ms']:.3f}", f"{stat['total_ms']:.1f}"]
+            for col, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if col:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.stats_table.setItem(row, col, item)
+
+    def reset(self):
+        self.query_stats.reset()
+        self.refresh()
+
+    def export_json(self):
+        path, _filter = QFileDialog.getSaveFileName(self, "Export Query Statistics",
+                                                    "query_stats.json", "JSON files (*.json)")
+        if path:
+            self.query_stats.export_json(path)
+
+# Exports a table to CSV or JSON Lines through the executor, with live row
+# counts; the file only appears once the export has completed
+class ExportDialog(QDialog):
+    TABLES = (("Products", "products"), ("Sales", "sales"), ("Goods Receiving", "goods_receiving"))
+    FORMATS = (("CSV", "csv"), ("JSON Lines", "jsonl"))
+    rows_exported = Signal(int)
+
+    def __init__(self, db_manager, executor, parent=None):
+        super().__init__(parent)
+        self.db = db_manager
+        self.executor = executor
+        self.cancel_event = None
+        self.setWindowTitle("Export Data")
+        self.setup_ui()
+        # Emitted from the export thread; delivered on the GUI thread
+        self.rows_exported.connect(lambda rows: self.status_label.setText(f"{rows:,} rows exported..."))
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+
+        self.table_combo = QComboBox()
+        for text, table in self.TABLES:
+            self.table_combo.addItem(text, table)
+        self.table_combo.currentIndexChanged.connect(self.update_filters)
+        form.addRow("Data:", self.table_combo)
+
+        self.format_combo = QComboBox()
+        for text, fmt in self.FORMATS:
+            self.format_combo.addItem(text, fmt)
+        form.addRow("Format:", self.format_combo)
+        self.gzip_check = QCheckBox("Compress (gzip)")
+        form.addRow("", self.gzip_check)
+
+        # Transactions can be limited to a date range and to one product
+        self.dates_check = QCheckBox("Only transactions from")
+        today = QDate.currentDate()
+        self.from_date = QDateEdit(today.addDays(1 - today.day()))
+        self.to_date = QDateEdit(today)
+        dates_layout = QHBoxLayout()
+        dates_layout.addWidget(self.dates_check)
+        for label, date_edit in ((None, self.from_date), ("to", self.to_date)):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+            date_edit.setEnabled(False)
+            self.dates_check.toggled.connect(date_edit.setEnabled)
+            if label:
+                dates_layout.addWidget(QLabel(label))
+            dates_layout.addWidget(date_edit)
+        form.addRow("Dates:", dates_layout)
+
+        self.product_picker = ProductPicker(self.db, self.executor)
+        self.product_picker.setPlaceholderText("All products")
+        form.addRow("Product:", self.product_picker)
+        layout.addLayout(form)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.hide()
+        layout.addWidget(self.progress_bar)
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addStretch()
+        self.export_button = QPushButton("Export...")
+        self.export_button.clicked.connect(self.export)
+        buttons_layout.addWidget(self.export_button)
+        self.close_button = QPushButton("Close")
+        self.close_button.clicked.connect(self.reject)
+        buttons_layout.addWidget(self.close_button)
+        layout.addLayout(buttons_layout)
+
+        self.update_filters()
+
+    def update_filters(self):
+        # The product catalog has no dates
+        self.dates_check.setEnabled(self.table_combo.currentData() != "products")
+
+    def export(self):
+        table = self.table_combo.currentData()
+        fmt = self.format_combo.currentData()
+        compress = self.gzip_check.isChecked()
+        suffix = f".{fmt}.gz" if compress else f".{fmt}"
+        path, _filter = QFileDialog.getSaveFileName(self, "Export Data", table + suffix,
+                                                    f"{self.format_combo.currentText()} (*{suffix})")
+        if not path:
+            return
+        if not path.endswith(suffix):
+            path += suffix
+
+        first_day = last_day = None
+        if self.dates_check.isEnabled() and self.dates_check.isChecked():
+            first_day = self.from_date.date().toString("yyyy-MM-dd")
+            last_day = self.to_date.date().toString("yyyy-MM-dd")
+
+        self.cancel_event = threading.Event()
+        self.set_running(True)
+        self.executor.submit(export_table, self.db, table, path, fmt=fmt, compress=compress,
+                             first_day=first_day, last_day=last_day,
+                             product_id=self.product_picker.product_id(),
+                             progress=self.rows_exported.emit, cancelled=self.cancel_event.is_set,
+                             on_result=lambda rows: self.export_finished(path, rows),
+                             on_error=self.export_failed)
+
+    def set_running(self, running):
+        self.export_button.setEnabled(not running)
+        self.close_button.setText("Cancel" if running else "Close")
+        self.progress_bar.setVisible(running)
+        if running:
+            self.status_label.setText("Exporting...")
+
+    def export_finished(self, path, rows):
+        self.cancel_event = None
+        self.set_running(False)
+        if rows is None:
+            self.status_label.setText("Export cancelled")
+        else:
+            self.status_label.setText(f"{rows:,} rows exported to {path}")
+
+    def export_failed(self, error):
+        self.cancel_event = None
+        self.set_running(False)
+        self.status_label.setText("Export failed")
+        QMessageBox.critical(self, "Error", f"Export failed: {error}")
+
+    def reject(self):
+        # While an export runs, Cancel/Escape stops it instead of closing
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        else:
+            super().reject()
+
+
+# db_manager is a DatabaseManager, or a RemoteDatabase with its
+# RemoteService as `service` when the app runs against server.py
 class InventoryMainWindow(QMainWindow):
-    def __init__(self, user_role, username):
+    logged_out = Signal()
+
+    def __init__(self, db_manager, user_role, username, session=None, service=None):
         super().__init__()
+        self.db = db_manager
+        self.service = service or InventoryService(db_manager)
+        self.executor = DbExecutor(parent=self)
         self.user_role = user_role
         self.username = username
+        self.session = session
         self.setWindowTitle(f"Inventory Management System - {username}")
         self.setGeometry(100, 100, 1000, 700)
         self.setup_ui()
 
+        # An idle terminal locks itself; unlocking goes through the session
+        self.idle_watcher = None
+        self.locked = False
+        if session:
+            self.idle_watcher = IdleWatcher(LOCK_AFTER_SECONDS, self)
+            self.idle_watcher.idle.connect(self.lock)
+
+        # Once the server's session runs out, only a full login gets a new
+        # token. Emitted from worker threads; delivered on the GUI thread.
+        self.logged_out.connect(self.log_in_again)
+        if isinstance(self.db, RemoteDatabase):
+            self.db.add_logout_listener(self.logged_out.emit)
+
     def setup_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
 
+        # Tools menu
+        tools_menu = self.menuBar().addMenu("Tools")
+        if self.session:
+            tools_menu.addAction("Lock Terminal", self.lock, "Ctrl+L")
+        # Exports read the database file itself
+        if not isinstance(self.db, RemoteDatabase):
+            tools_menu.addAction("Export Data...", self.show_export_dialog)
+        if self.db.query_stats:
+            tools_menu.addAction("Query Diagnostics...", self.show_query_diagnostics)
+
         layout = QVBoxLayout(central_widget)
 
         # User info
@@ -240,8 +394,9 @@ class InventoryMainWindow(QMainWindow):
         user_label.setFont(QFont("Arial", 10, QFont.Bold))
         layout.addWidget(user_label)
 
-        # Tab widget
+        # Tab widget; each tab loads its data the first time it is shown
         self.tab_widget = QTabWidget()
+        self.tab_loaders = {}
         layout.addWidget(self.tab_widget)
 
         # Add tabs based on user role
@@ -253,6 +408,70 @@ class InventoryMainWindow(QMainWindow):
         # Common tabs
         self.add_product_master_tab()
         self.add_inventory_tab()
+        self.add_reports_tab()
+
+        # Posted transactions update only the affected rows of the views
+        self.product_notifier = ProductChangeNotifier(self.db, self)
+        self.product_notifier.products_changed.connect(self.on_products_changed)
+
+        # Load the first tab once the window is on screen
+        self.tab_widget.currentChanged.connect(self.load_tab)
+        QTimer.singleShot(0, self.load_current_tab)
+
+    def add_lazy_tab(self, tab, title, loader):
+        self.tab_loaders[tab] = loader
+        self.tab_widget.addTab(tab, title)
+
+    def load_current_tab(self):
+        self.load_tab(self.tab_widget.currentIndex())
+
+    def load_tab(self, index):
+        loader = self.tab_loaders.pop(self.tab_widget.widget(index), None)
+        if loader:
+            loader()
+
+    def show_export_dialog(self):
+        dialog = ExportDialog(self.db, self.executor, self)
+        dialog.exec()
+        dialog.deleteLater()
+
+    def show_query_diagnostics(self):
+        QueryDiagnosticsDialog(self.db.query_stats, self).exec()
+
+    def on_products_changed(self, product_ids):
+        self.product_model.update_rows(product_ids)
+        self.product_search_model.update_rows(product_ids)
+        self.inventory_model.update_rows(product_ids)
+
+    def log_in_again(self):
+        # An open lock screen then needs the full check too
+        if self.session:
+            self.session.expire()
+            if not self.locked:
+                self.lock()
+
+    def lock(self):
+        self.locked = True
+        self.idle_watcher.stop()
+        self.centralWidget().hide()
+        dialog = LoginDialog(self.db, self.session, self.executor, self)
+        unlocked = dialog.exec() == QDialog.Accepted
+        dialog.deleteLater()
+        self.locked = False
+        if unlocked:
+            self.centralWidget().show()
+            self.idle_watcher.start()
+        else:
+            self.close()
+
+    def closeEvent(self, event):
+        if self.idle_watcher:
+            self.idle_watcher.detach()
+        self.product_notifier.detach()
+        if isinstance(self.db, RemoteDatabase):
+            self.db.remove_logout_listener(self.logged_out.emit)
+        self.executor.wait()
+        super().closeEvent(event)
 
     def add_goods_receiving_tab(self):
         tab = QWidget()
@@ -261,16 +480,20 @@ class InventoryMainWindow(QMainWindow):
         # Form
         form_layout = QFormLayout()
 
-        # Product selection
-        self.product_combo = QComboBox()
-        self.load_products(self.product_combo)
-        form_layout.addRow("Product:", self.product_combo)
-
-        # Supplier selection
+        # Supplier selection (applies to the whole receipt)
         self.supplier_combo = QComboBox()
-        self.load_suppliers()
         form_layout.addRow("Supplier:", self.supplier_combo)
 
+        # Barcode / SKU scanner input
+        self.receiving_scan_edit = QLineEdit()
+        self.receiving_scan_edit.setPlaceholderText("Scan barcode or type SKU, then Enter")
+        self.receiving_scan_edit.returnPressed.connect(self.scan_receiving_code)
+        form_layout.addRow("Scan:", self.receiving_scan_edit)
+
+        # Product selection
+        self.product_picker = ProductPicker(self.db, self.executor)
+        form_layout.addRow("Product:", self.product_picker)
+
         # Quantity
         self.quantity_spin = QDoubleSpinBox()
         self.quantity_spin.setMaximum(9999.99)
@@ -298,16 +521,44 @@ class InventoryMainWindow(QMainWindow):
         # Connect signals for calculation
         self.quantity_spin.valueChanged.connect(self.calculate_goods_total)
         self.rate_spin.valueChanged.connect(self.calculate_goods_total)
-        self.product_combo.currentTextChanged.connect(self.update_product_info)
+        self.product_picker.product_changed.connect(self.update_product_info)
+
+        # Add line button
+        add_line_button = QPushButton("Add Line")
+        add_line_button.clicked.connect(self.add_receipt_line)
+
+        # Staged receipt lines
+        self.receipt_lines = []
+        self.receipt_table = QTableWidget(0, 6)
+        self.receipt_table.setHorizontalHeaderLabels([
+            "Product", "Quantity", "Unit", "Rate (₹)", "Tax (₹)", "Total (₹)"
+        ])
+        self.receipt_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.receipt_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.receipt_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.receipt_total_label = QLabel()
+
+        remove_line_button = QPushButton("Remove Selected Lines")
+        remove_line_button.clicked.connect(self.remove_receipt_lines)
+
+        # Post button
+        self.post_receipt_button = QPushButton("Post Goods Receipt")
+        self.post_receipt_button.clicked.connect(self.add_goods_receiving)
 
-        # Add button
-        add_button = QPushButton("Add Goods Receiving Entry")
-        add_button.clicked.connect(self.add_goods_receiving)
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(remove_line_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.receipt_total_label)
+        buttons_layout.addWidget(self.post_receipt_button)
 
         layout.addLayout(form_layout)
-        layout.addWidget(add_button)
+        layout.addWidget(add_line_button)
+        layout.addWidget(self.receipt_table)
+        layout.addLayout(buttons_layout)
 
-        self.tab_widget.addTab(tab, "Goods Receiving")
+        self.add_lazy_tab(tab, "Goods Receiving",
+                          self.load_suppliers)
+        self.refresh_receipt()
 
         # Update initial product info
         self.update_product_info()
@@ -319,16 +570,20 @@ class InventoryMainWindow(QMainWindow):
         # Form
         form_layout = QFormLayout()
 
-        # Product selection
-        self.sales_product_combo = QComboBox()
-        self.load_products(self.sales_product_combo)
-        form_layout.addRow("Product:", self.sales_product_combo)
-
-        # Customer selection
+        # Customer selection (applies to the whole invoice)
         self.customer_combo = QComboBox()
-        self.load_customers()
         form_layout.addRow("Customer:", self.customer_combo)
 
+        # Barcode / SKU scanner input
+        self.sales_scan_edit = QLineEdit()
+        self.sales_scan_edit.setPlaceholderText("Scan barcode or type SKU, then Enter")
+        self.sales_scan_edit.returnPressed.connect(self.scan_sales_code)
+        form_layout.addRow("Scan:", self.sales_scan_edit)
+
+        # Product selection
+        self.sales_product_picker = ProductPicker(self.db, self.executor)
+        form_layout.addRow("Product:", self.sales_product_picker)
+
         # Quantity
         self.sales_quantity_spin = QDoubleSpinBox()
         self.sales_quantity_spin.setMaximum(9999.99)
@@ -357,16 +612,44 @@ class InventoryMainWindow(QMainWindow):
 
         # Connect signals for calculation
         self.sales_quantity_spin.valueChanged.connect(self.calculate_sales_total)
-        self.sales_product_combo.currentTextChanged.connect(self.update_sales_product_info)
+        self.sales_product_picker.product_changed.connect(self.update_sales_product_info)
+
+        # Add to cart button
+        add_line_button = QPushButton("Add to Cart")
+        add_line_button.clicked.connect(self.add_cart_line)
 
-        # Add button
-        add_button = QPushButton("Process Sale")
-        add_button.clicked.connect(self.add_sale)
+        # Cart lines
+        self.cart_lines = []
+        self.cart_table = QTableWidget(0, 6)
+        self.cart_table.setHorizontalHeaderLabels([
+            "Product", "Quantity", "Unit", "Rate (₹)", "Tax (₹)", "Total (₹)"
+        ])
+        self.cart_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.cart_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.cart_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.invoice_total_label = QLabel()
+
+        remove_line_button = QPushButton("Remove Selected Lines")
+        remove_line_button.clicked.connect(self.remove_cart_lines)
+
+        # Post button
+        self.process_sale_button = QPushButton("Process Sale")
+        self.process_sale_button.clicked.connect(self.add_sale)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(remove_line_button)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(self.invoice_total_label)
+        buttons_layout.addWidget(self.process_sale_button)
 
         layout.addLayout(form_layout)
-        layout.addWidget(add_button)
+        layout.addWidget(add_line_button)
+        layout.addWidget(self.cart_table)
+        layout.addLayout(buttons_layout)
 
-        self.tab_widget.addTab(tab, "Sales Processing")
+        self.add_lazy_tab(tab, "Sales Processing",
+                          self.load_customers)
+        self.refresh_cart()
 
         # Update initial product info
         self.update_sales_product_info()
@@ -375,92 +658,168 @@ class InventoryMainWindow(QMainWindow):
         tab = QWidget()
         layout = QVBoxLayout(tab)
 
-        # Product table
-        self.product_table = QTableWidget()
-        self.load_product_table()
+        # Product table, paged in from the database as it scrolls; while the
+        # search box has text it shows the best matches instead
+        headers = ["Barcode", "SKU ID", "Category", "Subcategory", "Product Name",
+                   "Description", "Tax Rate (%)", "Price (₹)", "Unit", "Stock"]
+        formatters = {7: format_money, 9: format_quantity}
+        self.product_model = PagedTableModel(headers, self.db.product_page, self.db.product_rows,
+                                             executor=self.executor, formatters=formatters, parent=self)
+        self.product_search_text = ""
+        self.product_search_model = PagedTableModel(headers, self.product_search_page, self.db.product_rows,
+                                                    executor=self.executor, formatters=formatters, parent=self)
+        self.product_search = SearchBox("Search by name, SKU, barcode or category")
+        self.product_search.search_requested.connect(self.search_product_table)
+        layout.addWidget(self.product_search)
+
+        self.product_table = QTableView()
+        self.product_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.product_model.rowsInserted.connect(
+            lambda parent, first, last: self.resize_columns_on_first_page(self.product_table, first))
+        self.product_search_model.rowsInserted.connect(
+            lambda parent, first, last: self.resize_columns_on_first_page(self.product_table, first))
         layout.addWidget(self.product_table)
 
-        self.tab_widget.addTab(tab, "Product Master List")
+        # The model is attached on first display so a hidden view never pages
+        self.add_lazy_tab(tab, "Product Master List", lambda: self.product_table.setModel(self.product_model))
 
     def add_inventory_tab(self):
         tab = QWidget()
         layout = QVBoxLayout(tab)
 
-        # Inventory table
-        self.inventory_table = QTableWidget()
-        self.load_inventory_table()
+        # Inventory table, paged in by product name as it scrolls
+        self.inventory_model = PagedTableModel([
+            "SKU ID", "Product Name", "Category", "Subcategory",
+            "Stock Quantity", "Unit", "Price (₹)"
+        ], self.db.inventory_page, self.db.inventory_rows,
+            row_key=lambda row: (row[2], row[0]), executor=self.executor,
+            formatters={4: format_quantity, 6: format_money}, parent=self)
+        self.inventory_table = QTableView()
+        self.inventory_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.inventory_model.rowsInserted.connect(
+            lambda parent, first, last: self.resize_columns_on_first_page(self.inventory_table, first))
         layout.addWidget(self.inventory_table)
 
-        self.tab_widget.addTab(tab, "Current Inventory")
+        self.add_lazy_tab(tab, "Current Inventory", lambda: self.inventory_table.setModel(self.inventory_model))
 
-    def load_products(self, combo):
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, product_name, sku_id FROM products")
-        products = cursor.fetchall()
-        conn.close()
+    def add_reports_tab(self):
+        tab = QWidget()
+        layout = QVBoxLayout(tab)
 
-        combo.clear()
-        for product_id, name, sku in products:
-            combo.addItem(f"{name} ({sku})", product_id)
+        # Report selection; reports read only the daily summary tables
+        controls = QHBoxLayout()
+        self.report_combo = QComboBox()
+        for name, columns, _sql in REPORTS:
+            self.report_combo.addItem(name, columns)
+        controls.addWidget(self.report_combo)
+
+        today = QDate.currentDate()
+        self.report_from = QDateEdit(today.addDays(1 - today.day()))
+        self.report_to = QDateEdit(today)
+        for label, date_edit in (("From:", self.report_from), ("To:", self.report_to)):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+            controls.addWidget(QLabel(label))
+            controls.addWidget(date_edit)
+
+        controls.addWidget(QLabel("Top:"))
+        self.report_limit = QSpinBox()
+        self.report_limit.setRange(1, 1000)
+        self.report_limit.setValue(10)
+        controls.addWidget(self.report_limit)
+
+        self.report_button = QPushButton("Run Report")
+        self.report_button.clicked.connect(self.run_report)
+        controls.addWidget(self.report_button)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.report_table = QTableWidget()
+        self.report_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.report_table)
+
+        self.add_lazy_tab(tab, "Reports", self.run_report)
+
+    def run_report(self):
+        name = self.report_combo.currentText()
+        columns = self.report_combo.currentData()
+        first_day = self.report_from.date().toString("yyyy-MM-dd")
+        last_day = self.report_to.date().toString("yyyy-MM-dd")
+        # The row limit only applies to the top-N reports
+        limit = self.report_limit.value() if name.startswith("Top ") else -1
+        self.report_button.setEnabled(False)
+        self.executor.submit(self.db.report, name, first_day, last_day, limit,
+                             on_result=lambda rows: self.show_report(columns, rows),
+                             on_error=self.report_failed)
+
+    def show_report(self, columns, rows):
+        self.report_button.setEnabled(True)
+        self.report_table.clear()
+        self.report_table.setColumnCount(len(columns))
+        self.report_table.setHorizontalHeaderLabels([header for header, _formatter in columns])
+        self.report_table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for col, ((_header, formatter), value) in enumerate(zip(columns, values)):
+                item = QTableWidgetItem(formatter(value))
+                if isinstance(value, int):
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.report_table.setItem(row, col, item)
+        self.report_table.resizeColumnsToContents()
+
+    def report_failed(self, error):
+        self.report_button.setEnabled(True)
+        QMessageBox.critical(self, "Error", f"Report failed: {error}")
 
     def load_suppliers(self):
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM suppliers")
-        suppliers = cursor.fetchall()
-        conn.close()
-
-        self.supplier_combo.clear()
-        for supplier_id, name in suppliers:
-            self.supplier_combo.addItem(name, supplier_id)
+        self.executor.submit(self.service.suppliers,
+                             on_result=lambda suppliers: self.fill_combo(
+                                 self.supplier_combo, [(supplier["name"], supplier["id"]) for supplier in suppliers]))
 
     def load_customers(self):
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM customers")
-        customers = cursor.fetchall()
-        conn.close()
+        self.executor.submit(self.service.customers,
+                             on_result=lambda customers: self.fill_combo(
+                                 self.customer_combo, [(customer["name"], customer["id"]) for customer in customers]))
 
-        self.customer_combo.clear()
-        for customer_id, name in customers:
-            self.customer_combo.addItem(name, customer_id)
+    def fill_combo(self, combo, items):
+        combo.clear()
+        for text, data in items:
+            combo.addItem(text, data)
 
     def update_product_info(self):
-        if not hasattr(self, 'product_combo'):
+        if not hasattr(self, 'product_picker'):
             return
 
-        product_id = self.product_combo.currentData()
+        product_id = self.product_picker.product_id()
         if product_id:
-            conn = sqlite3.connect("inventory.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT unit_of_measurement, tax_rate FROM products WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            conn.close()
+            product = self.db.get_product(product_id)
 
-            if result:
-                self.unit_label.setText(result[0])
-                self.tax_rate_label.setText(f"{result[1]}%")
+            if product:
+                self.unit_label.setText(product.unit_of_measurement)
+                self.tax_rate_label.setText(f"{product.tax_rate}%")
+        else:
+            self.unit_label.clear()
+            self.tax_rate_label.clear()
 
         self.calculate_goods_total()
 
     def update_sales_product_info(self):
-        if not hasattr(self, 'sales_product_combo'):
+        if not hasattr(self, 'sales_product_picker'):
             return
 
-        product_id = self.sales_product_combo.currentData()
+        product_id = self.sales_product_picker.product_id()
         if product_id:
-            conn = sqlite3.connect("inventory.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT unit_of_measurement, tax_rate, price, stock_quantity FROM products WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                self.sales_unit_label.setText(result[0])
-                self.sales_tax_rate_label.setText(f"{result[1]}%")
-                self.sales_rate_label.setText(f"₹{result[2]:.2f}")
-                self.stock_label.setText(f"{result[3]:.2f} {result[0]}")
+            product = self.db.get_product(product_id)
+
+            if product:
+                self.sales_unit_label.setText(product.unit_of_measurement)
+                self.sales_tax_rate_label.setText(f"{product.tax_rate}%")
+                self.sales_rate_label.setText(f"₹{format_money(product.price)}")
+                self.stock_label.setText(f"{format_quantity(product.stock_quantity)} {product.unit_of_measurement}")
+        else:
+            for label in (self.sales_unit_label, self.sales_tax_rate_label,
+                          self.sales_rate_label, self.stock_label):
+                label.clear()
+            self.sales_total_label.setText("0.00")
 
         self.calculate_sales_total()
 
@@ -468,208 +827,293 @@ class InventoryMainWindow(QMainWindow):
         if not hasattr(self, 'quantity_spin'):
             return
 
-        quantity = self.quantity_spin.value()
-        rate = self.rate_spin.value()
+        quantity = to_milli(self.quantity_spin.value())
+        rate = to_paise(self.rate_spin.value())
 
-        product_id = self.product_combo.currentData()
+        product_id = self.product_picker.product_id()
         tax_rate = 0.0
 
         if product_id:
-            conn = sqlite3.connect("inventory.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT tax_rate FROM products WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                tax_rate = result[0] / 100.0
+            product = self.db.get_product(product_id)
 
-        subtotal = quantity * rate
-        tax_amount = subtotal * tax_rate
-        total = subtotal + tax_amount
+            if product:
+                tax_rate = product.tax_rate
 
-        self.total_label.setText(f"₹{total:.2f}")
+        _subtotal, _tax_amount, total = line_totals(quantity, rate, tax_rate)
+        self.total_label.setText(f"₹{format_money(total)}")
 
     def calculate_sales_total(self):
         if not hasattr(self, 'sales_quantity_spin'):
             return
 
-        quantity = self.sales_quantity_spin.value()
+        quantity = to_milli(self.sales_quantity_spin.value())
 
-        product_id = self.sales_product_combo.currentData()
+        product_id = self.sales_product_picker.product_id()
         if product_id:
-            conn = sqlite3.connect("inventory.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT price, tax_rate FROM products WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                rate = result[0]
-                tax_rate = result[1] / 100.0
+            product = self.db.get_product(product_id)
 
-                subtotal = quantity * rate
-                tax_amount = subtotal * tax_rate
-                total = subtotal + tax_amount
+            if product:
+                _subtotal, _tax_amount, total = line_totals(quantity, product.price, product.tax_rate)
+                self.sales_total_label.setText(f"₹{format_money(total)}")
 
-                self.sales_total_label.setText(f"₹{total:.2f}")
-
-    def add_goods_receiving(self):
-        product_id = self.product_combo.currentData()
-        supplier_id = self.supplier_combo.currentData()
-        quantity = self.quantity_spin.value()
-        rate = self.rate_spin.value()
+    def add_receipt_line(self):
+        product_id = self.product_picker.product_id()
+        quantity = to_milli(self.quantity_spin.value())
+        rate = to_paise(self.rate_spin.value())
 
-        if not all([product_id, supplier_id, quantity, rate]):
+        if not all([product_id, quantity, rate]):
             QMessageBox.warning(self, "Error", "Please fill all fields")
             return
 
-        # Calculate totals
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT tax_rate FROM products WHERE id = ?", (product_id,))
-        tax_rate = cursor.fetchone()[0] / 100.0
+        self.stage_receipt_line(product_id, quantity, rate)
 
-        subtotal = quantity * rate
-        tax_amount = subtotal * tax_rate
-        total = subtotal + tax_amount
-
-        # Insert goods receiving record
-        cursor.execute("""INSERT INTO goods_receiving 
-                         (product_id, supplier_id, quantity, rate_per_unit, tax_amount, total_amount, received_by)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                      (product_id, supplier_id, quantity, rate, tax_amount, total, self.username))
+        # Reset line entry
+        self.quantity_spin.setValue(0)
+        self.rate_spin.setValue(0)
 
-        # Update product stock
-        cursor.execute("UPDATE products SET stock_quantity = stock_quantity + ? WHERE id = ?",
-                      (quantity, product_id))
+    def stage_receipt_line(self, product_id, quantity, rate):
+        # Same product at the same rate is merged into one line
+        for line in self.receipt_lines:
+            if line[0] == product_id and line[2] == rate:
+                line[1] += quantity
+                break
+        else:
+            self.receipt_lines.append([product_id, quantity, rate])
+        self.refresh_receipt()
+
+    def scan_receiving_code(self):
+        code = self.receiving_scan_edit.text().strip()
+        self.receiving_scan_edit.clear()
+        if code:
+            self.lookup_code(code, self.receiving_code_scanned)
+
+    def lookup_code(self, code, on_product):
+        # The lookup runs on a worker thread; on_product(product) gets the
+        # ProductRecord once it is found
+        self.executor.submit(self.db.find_product_by_code, code,
+                             on_result=lambda product: self.code_looked_up(code, product, on_product),
+                             on_error=lambda e: QMessageBox.critical(self, "Error", f"Lookup failed: {e}"))
+
+    def code_looked_up(self, code, product, on_product):
+        if product:
+            on_product(product)
+        else:
+            QMessageBox.warning(self, "Error", f"No product with barcode or SKU '{code}'")
+
+    def receiving_code_scanned(self, product):
+        # Repeated scans bump the staged line; a first scan picks the product
+        # in the form so the operator can enter the rate
+        for line in reversed(self.receipt_lines):
+            if line[0] == product.id:
+                line[1] += MILLI_PER_UNIT
+                self.refresh_receipt()
+                return
+
+        if self.product_picker.product_id() == product.id:
+            self.quantity_spin.setValue(self.quantity_spin.value() + 1)
+        else:
+            self.product_picker.set_product(product)
+            self.quantity_spin.setValue(1)
 
-        conn.commit()
-        conn.close()
+    def remove_receipt_lines(self):
+        rows = sorted({index.row() for index in self.receipt_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            del self.receipt_lines[row]
+        self.refresh_receipt()
 
-        QMessageBox.information(self, "Success", "Goods receiving entry added successfully")
+    def refresh_receipt(self):
+        quote = self.service.quote_receipt(self.receipt_lines)
 
-        # Reset form
-        self.quantity_spin.setValue(0)
-        self.rate_spin.setValue(0)
+        self.receipt_table.setRowCount(len(quote["lines"]))
+        for row, line in enumerate(quote["lines"]):
+            product = self.db.get_product(line["product_id"])
+            values = [f"{product.product_name} ({product.sku_id})", format_quantity(line["quantity"]),
+                      product.unit_of_measurement, format_money(line["rate"]),
+                      format_money(line["tax_amount"]), format_money(line["total"])]
+            for col, value in enumerate(values):
+                self.receipt_table.setItem(row, col, QTableWidgetItem(value))
 
-        # Refresh inventory table if visible
-        if hasattr(self, 'inventory_table'):
-            self.load_inventory_table()
+        self.receipt_total_label.setText(f"Receipt Total: ₹{format_money(quote['total'])}")
 
-    def add_sale(self):
-        product_id = self.sales_product_combo.currentData()
-        customer_id = self.customer_combo.currentData()
-        quantity = self.sales_quantity_spin.value()
+    def add_goods_receiving(self):
+        supplier_id = self.supplier_combo.currentData()
 
-        if not all([product_id, customer_id, quantity]):
-            QMessageBox.warning(self, "Error", "Please fill all fields")
+        if not supplier_id or not self.receipt_lines:
+            QMessageBox.warning(self, "Error", "Please select a supplier and add at least one line")
             return
 
-        # Check stock availability
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT stock_quantity, price, tax_rate FROM products WHERE id = ?", (product_id,))
-        result = cursor.fetchone()
+        lines = [tuple(line) for line in self.receipt_lines]
+        self.post_receipt_button.setEnabled(False)
+        self.executor.submit(self.service.post_receipt, supplier_id, lines, self.username,
+                             write=True,
+                             on_result=lambda posted: self.goods_receiving_posted(posted["receipt_id"], len(lines)),
+                             on_error=lambda e: self.posting_failed(self.post_receipt_button, e))
+
+    def goods_receiving_posted(self, receipt_id, line_count):
+        self.post_receipt_button.setEnabled(True)
+        QMessageBox.information(self, "Success",
+                                f"Goods receipt #{receipt_id} posted with {line_count} line(s)")
+
+        # Reset document
+        self.receipt_lines = []
+        self.refresh_receipt()
+
+    def posting_failed(self, button, error):
+        button.setEnabled(True)
+        if isinstance(error, InventoryError):
+            QMessageBox.warning(self, "Error", str(error))
+        else:
+            QMessageBox.critical(self, "Error", f"Posting failed: {error}")
 
-        if not result:
-            QMessageBox.warning(self, "Error", "Product not found")
-            return
 
-        current_stock, price, tax_rate = result
+    def add_cart_line(self):
+        product_id = self.sales_product_picker.product_id()
+        quantity = to_milli(self.sales_quantity_spin.value())
 
-        if quantity > current_stock:
-            QMessageBox.warning(self, "Error", f"Insufficient stock. Available: {current_stock}")
+        if not all([product_id, quantity]):
+            QMessageBox.warning(self, "Error", "Please fill all fields")
             return
 
-        # Calculate totals
-        tax_rate = tax_rate / 100.0
-        subtotal = quantity * price
-        tax_amount = subtotal * tax_rate
-        total = subtotal + tax_amount
+        if self.stage_cart_line(product_id, quantity):
+            # Reset line entry
+            self.sales_quantity_spin.setValue(0)
 
-        # Insert sales record
-        cursor.execute("""INSERT INTO sales 
-                         (product_id, customer_id, quantity, rate_per_unit, tax_amount, total_amount, sold_by)
-                         VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                      (product_id, customer_id, quantity, price, tax_amount, total, self.username))
+    def stage_cart_line(self, product_id, quantity):
+        for line in self.cart_lines:
+            if line[0] == product_id:
+                in_cart = line
+                break
+        else:
+            in_cart = [product_id, 0]
+            self.cart_lines.append(in_cart)
+
+        in_cart[1] += quantity
+        shortages = self.service.quote_sale(self.cart_lines)["shortages"]
+        if shortages:
+            in_cart[1] -= quantity
+            if not in_cart[1]:
+                self.cart_lines.remove(in_cart)
+            QMessageBox.warning(self, "Error",
+                                f"Insufficient stock. Available: {format_quantity(shortages[0]['available'])}")
+            return False
+
+        self.refresh_cart()
+        return True
+
+    def scan_sales_code(self):
+        code = self.sales_scan_edit.text().strip()
+        self.sales_scan_edit.clear()
+        # Every scan adds one unit straight to the cart
+        if code:
+            self.lookup_code(code, lambda product: self.stage_cart_line(product.id, MILLI_PER_UNIT))
+
+    def remove_cart_lines(self):
+        rows = sorted({index.row() for index in self.cart_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            del self.cart_lines[row]
+        self.refresh_cart()
+
+    def refresh_cart(self):
+        quote = self.service.quote_sale(self.cart_lines)
+
+        self.cart_table.setRowCount(len(quote["lines"]))
+        for row, line in enumerate(quote["lines"]):
+            product = self.db.get_product(line["product_id"])
+            values = [f"{product.product_name} ({product.sku_id})", format_quantity(line["quantity"]),
+                      product.unit_of_measurement, format_money(line["rate"]),
+                      format_money(line["tax_amount"]), format_money(line["total"])]
+            for col, value in enumerate(values):
+                self.cart_table.setItem(row, col, QTableWidgetItem(value))
+
+        self.invoice_total_label.setText(
+            f"Subtotal: ₹{format_money(quote['subtotal'])}   Tax: ₹{format_money(quote['tax_amount'])}   "
+            f"Total: ₹{format_money(quote['total'])}")
 
-        # Update product stock
-        cursor.execute("UPDATE products SET stock_quantity = stock_quantity - ? WHERE id = ?",
-                      (quantity, product_id))
+    def add_sale(self):
+        customer_id = self.customer_combo.currentData()
 
-        conn.commit()
-        conn.close()
+        if not customer_id or not self.cart_lines:
+            QMessageBox.warning(self, "Error", "Please select a customer and add at least one product")
+            return
 
-        QMessageBox.information(self, "Success", "Sale processed successfully")
+        lines = [tuple(line) for line in self.cart_lines]
+        self.process_sale_button.setEnabled(False)
+        self.executor.submit(self.service.post_sale, customer_id, lines, self.username,
+                             write=True,
+                             on_result=lambda posted: self.sale_posted(posted["invoice_id"]),
+                             on_error=lambda e: self.posting_failed(self.process_sale_button, e))
 
-        # Reset form
-        self.sales_quantity_spin.setValue(0)
+    def sale_posted(self, invoice_id):
+        self.process_sale_button.setEnabled(True)
+        QMessageBox.information(self, "Success",
+                                f"Sale processed successfully (invoice #{invoice_id})")
 
-        # Refresh inventory table and sales product info
-        if hasattr(self, 'inventory_table'):
-            self.load_inventory_table()
-        self.update_sales_product_info()
+        # Reset cart
+        self.cart_lines = []
+        self.refresh_cart()
 
-    def load_product_table(self):
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("""SELECT barcode, sku_id, category, subcategory, product_name, 
-                         description, tax_rate, price, unit_of_measurement, stock_quantity
-                         FROM products""")
-        products = cursor.fetchall()
-        conn.close()
-
-        self.product_table.setRowCount(len(products))
-        self.product_table.setColumnCount(10)
-        self.product_table.setHorizontalHeaderLabels([
-            "Barcode", "SKU ID", "Category", "Subcategory", "Product Name",
-            "Description", "Tax Rate (%)", "Price (₹)", "Unit", "Stock"
-        ])
+        # Refresh sales product info
+        self.update_sales_product_info()
 
-        for row, product in enumerate(products):
-            for col, value in enumerate(product):
-                item = QTableWidgetItem(str(value))
-                self.product_table.setItem(row, col, item)
+    def product_search_page(self, after, limit):
+        # The matches come as a single page
+        if after is not None:
+            return []
+        return self.db.search_products(self.product_search_text, SEARCH_TABLE_RESULTS)
+
+    def search_product_table(self, text):
+        if text:
+            self.product_search_text = text
+            self.product_search_model.reload()
+            self.product_table.setModel(self.product_search_model)
+        else:
+            self.product_table.setModel(self.product_model)
 
-        self.product_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+    def load_product_table(self):
+        self.product_model.reload()
 
     def load_inventory_table(self):
-        conn = sqlite3.connect("inventory.db")
-        cursor = conn.cursor()
-        cursor.execute("""SELECT p.sku_id, p.product_name, p.category, p.subcategory,
-                         p.stock_quantity, p.unit_of_measurement, p.price
-                         FROM products p
-                         ORDER BY p.product_name""")
-        inventory = cursor.fetchall()
-        conn.close()
-
-        self.inventory_table.setRowCount(len(inventory))
-        self.inventory_table.setColumnCount(7)
-        self.inventory_table.setHorizontalHeaderLabels([
-            "SKU ID", "Product Name", "Category", "Subcategory",
-            "Stock Quantity", "Unit", "Price (₹)"
-        ])
-
-        for row, item in enumerate(inventory):
-            for col, value in enumerate(item):
-                table_item = QTableWidgetItem(str(value))
-                self.inventory_table.setItem(row, col, table_item)
+        self.inventory_model.reload()
 
-        self.inventory_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+    def resize_columns_on_first_page(self, table, first):
+        # Pages arrive asynchronously; size the columns once the first one lands
+        if first == 0:
+            table.resizeColumnsToContents()
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Inventory Management System")
+    parser.add_argument("--startup-metrics", action="store_true",
+                        help="log how long startup milestones take")
+    parser.add_argument("--bcrypt-rounds", type=int, default=PASSWORD_ROUNDS,
+                        help=f"password hashing work factor; existing hashes are upgraded "
+                             f"at their next login (default: {PASSWORD_ROUNDS})")
+    parser.add_argument("--server", metavar="URL",
+                        help="work through server.py at this address instead of the local inventory.db")
+    args, qt_args = parser.parse_known_args()
+    if args.startup_metrics:
+        logging.basicConfig(level=logging.INFO, format="%(name)s %(message)s")
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    configure_slow_query_log()
 
     # Initialize database
-    db_manager = DatabaseManager()
+    service = None
+    if args.server:
+        db_manager = RemoteDatabase(args.server)
+        service = RemoteService(db_manager)
+    else:
+        db_manager = DatabaseManager(password_rounds=args.bcrypt_rounds)
+    log_startup("database ready")
 
     # Show login dialog
-    login_dialog = LoginDialog()
+    login_dialog = LoginDialog(db_manager)
+    QTimer.singleShot(0, lambda: log_startup("login dialog shown"))
     if login_dialog.exec() == QDialog.Accepted:
         # Show main window
-        main_window = InventoryMainWindow(login_dialog.user_role, login_dialog.username)
+        main_window = InventoryMainWindow(db_manager, login_dialog.user_role,
+                                          login_dialog.username, login_dialog.session, service)
         main_window.show()
+        QTimer.singleShot(0, lambda: log_startup("main window shown"))
 
         sys.exit(app.exec())
     else:
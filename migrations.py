@@ -0,0 +1,897 @@
+import re
+import sqlite3
+from datetime import date, timedelta
+
+import bcrypt
+
+from valuation import rebuild_valuation
+
+# Rows moved per transaction when a table is rebuilt
+MIGRATION_CHUNK_SIZE = 50000
+
+# Secondary indexes: (name, table, columns). An index added here also needs
+# a migration that creates it on existing databases.
+INDEXES = (
+    # Keyset pagination of the inventory view walks products by name
+    ("idx_products_name", "products", "product_name, id"),
+    ("idx_products_category", "products", "category, subcategory"),
+    ("idx_goods_receiving_product", "goods_receiving", "product_id, date_received"),
+    ("idx_goods_receiving_supplier", "goods_receiving", "supplier_id, date_received"),
+    ("idx_goods_receiving_date", "goods_receiving", "date_received"),
+    ("idx_goods_receiving_user", "goods_receiving", "received_by, date_received"),
+    ("idx_goods_receiving_receipt", "goods_receiving", "receipt_id"),
+    ("idx_goods_receipts_date", "goods_receipts", "date_received"),
+    ("idx_sales_product", "sales", "product_id, date_sold"),
+    ("idx_sales_customer", "sales", "customer_id, date_sold"),
+    ("idx_sales_date", "sales", "date_sold"),
+    ("idx_sales_user", "sales", "sold_by, date_sold"),
+    ("idx_sales_invoice", "sales", "invoice_id"),
+    ("idx_sales_invoices_date", "sales_invoices", "date_sold"),
+)
+
+STOCK_LEDGER_INDEXES = (
+    # Point-in-time stock replays a product's movements after a snapshot id
+    ("idx_stock_movements_product", "stock_movements", "product_id"),
+    ("idx_stock_movements_time", "stock_movements", "moved_at"),
+    ("idx_stock_snapshots_movement", "stock_snapshots", "movement_id"),
+)
+
+
+def create_indexes(cursor, indexes=INDEXES):
+    for name, table, columns in indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def month_ranges(first_day, last_day):
+    # Yields (first day, last day, day after) of every calendar month that
+    # overlaps first_day..last_day, clipped to that range; 'YYYY-MM-DD'
+    month_first = date.fromisoformat(first_day)
+    last = date.fromisoformat(last_day)
+    while month_first <= last:
+        next_month = (month_first.replace(day=1) + timedelta(days=32)).replace(day=1)
+        month_last = min(last, next_month - timedelta(days=1))
+        yield month_first.isoformat(), month_last.isoformat(), (month_last + timedelta(days=1)).isoformat()
+        month_first = next_month
+
+
+def history_days(cursor, local=False):
+    # (first, last) day with any receiving or sales line, or (None, None);
+    # UTC dates like the stored timestamps, or local dates with local=True
+    day = "date({}, 'localtime')" if local else "date({})"
+    cursor.execute(f"""SELECT MIN(day), MAX(day) FROM (
+                           SELECT {day.format("MIN(date_sold)")} AS day FROM sales
+                           UNION ALL SELECT {day.format("MAX(date_sold)")} FROM sales
+                           UNION ALL SELECT {day.format("MIN(date_received)")} FROM goods_receiving
+                           UNION ALL SELECT {day.format("MAX(date_received)")} FROM goods_receiving)""")
+    return cursor.fetchone()
+
+
+def table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?)",
+                   (table,))
+    return bool(cursor.fetchone()[0])
+
+
+# Migration steps. Every step must be safe to run again: a migration that
+# was interrupted is simply re-applied from its first step on the next run.
+
+class Sql:
+    chunked = False
+
+    def __init__(self, description, *statements):
+        self.description = description
+        self.statements = statements
+
+    def describe(self, cursor):
+        return self.description
+
+    def apply(self, cursor):
+        for statement in self.statements:
+            cursor.execute(statement)
+
+
+class AddColumn:
+    chunked = False
+
+    def __init__(self, table, column, definition):
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def describe(self, cursor):
+        return f"add column {self.table}.{self.column}"
+
+    def apply(self, cursor):
+        if self.column not in table_columns(cursor, self.table):
+            cursor.execute(f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}")
+
+
+class CreateIndexes:
+    chunked = False
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def describe(self, cursor):
+        return "create indexes " + ", ".join(name for name, _table, _columns in self.indexes)
+
+    def apply(self, cursor):
+        create_indexes(cursor, self.indexes)
+
+
+class RebuildTable:
+    # Replaces a table with a new definition, for changes ALTER TABLE cannot
+    # make (column types, constraints). `create_sql` is the new CREATE TABLE
+    # statement with "{name}" in place of the table name; `columns` maps new
+    # column names to SQL expressions over the old row, and any other column
+    # present in both tables is copied as is.
+    #
+    # Rows are moved into a shadow table one chunk per transaction, in rowid
+    # order, and deleted from the old table in the same transaction. Then
+    # the table's indexes move to the shadow one index per transaction: each
+    # is dropped from the (now empty) old table and built on the shadow. The
+    # final swap copies any rows written meanwhile, renames the shadow and
+    # recreates the triggers. Other connections are locked out for one chunk
+    # or one index build at a time, the file grows by about one chunk
+    # because freed pages are reused, and an interrupted rebuild carries on
+    # where it stopped. A table that already has the new column definitions
+    # is left alone, so converting expressions are never applied twice.
+    chunked = True
+
+    def __init__(self, table, create_sql, columns=None):
+        self.table = table
+        self.create_sql = create_sql
+        self.columns = columns or {}
+        self.shadow = f"_rebuild_{table}"
+
+    def describe(self, cursor):
+        if not table_exists(cursor, self.table):
+            return f"rebuild {self.table}: table created by an earlier pending migration"
+        if self.rebuilt(cursor):
+            return f"rebuild {self.table}: already done"
+        cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+        remaining = cursor.fetchone()[0]
+        resumed = " (resuming)" if table_exists(cursor, self.shadow) else ""
+        return f"rebuild {self.table}: {remaining} rows to copy{resumed}"
+
+    def rebuilt(self, cursor):
+        # True if the table already matches create_sql (name, type, NOT NULL,
+        # default and primary key of every column)
+        if table_exists(cursor, self.shadow):
+            return False
+        target = sqlite3.connect(":memory:")
+        try:
+            target.execute(self.create_sql.format(name="target"))
+            wanted = [row[1:] for row in target.execute("PRAGMA table_info(target)")]
+        finally:
+            target.close()
+        cursor.execute(f"PRAGMA table_info({self.table})")
+        return [row[1:] for row in cursor.fetchall()] == wanted
+
+    def run(self, db, chunk_size, progress):
+        with db.transaction(immediate=True) as cursor:
+            if not table_exists(cursor, self.table) or self.rebuilt(cursor):
+                return
+            if not table_exists(cursor, self.shadow):
+                cursor.execute(self.create_sql.format(name=self.shadow))
+            old_columns = set(table_columns(cursor, self.table))
+            targets = [column for column in table_columns(cursor, self.shadow)
+                       if column in self.columns or column in old_columns]
+            cursor.execute(f"SELECT COUNT(*) FROM {self.shadow}")
+            copied = cursor.fetchone()[0]
+            cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+            total = copied + cursor.fetchone()[0]
+
+        copy_sql = (f"INSERT INTO {self.shadow} ({', '.join(targets)}) "
+                    f"SELECT {', '.join(self.columns.get(column, column) for column in targets)} "
+                    f"FROM {self.table} WHERE rowid <= ? ORDER BY rowid")
+        last_chunk_sql = f"SELECT MAX(rowid) FROM (SELECT rowid FROM {self.table} ORDER BY rowid LIMIT ?)"
+        while True:
+            with db.transaction(immediate=True) as cursor:
+                # Another process may have finished the rebuild meanwhile
+                if not table_exists(cursor, self.shadow):
+                    return
+                cursor.execute(last_chunk_sql, (chunk_size,))
+                last_rowid = cursor.fetchone()[0]
+                if last_rowid is None:
+                    break
+                cursor.execute(copy_sql, (last_rowid,))
+                copied += cursor.rowcount
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid <= ?", (last_rowid,))
+            progress(f"rebuild {self.table}: {copied}/{total} rows")
+
+        while True:
+            with db.transaction(immediate=True) as cursor:
+                if not table_exists(cursor, self.shadow):
+                    return
+                cursor.execute("""SELECT name, sql FROM sqlite_master
+                                  WHERE tbl_name = ? AND type = 'index' AND sql IS NOT NULL
+                                  ORDER BY rowid LIMIT 1""", (self.table,))
+                row = cursor.fetchone()
+                if row is None:
+                    # Rows written while the indexes were built, then the swap
+                    cursor.execute(last_chunk_sql, (-1,))
+                    last_rowid = cursor.fetchone()[0]
+                    if last_rowid is not None:
+                        cursor.execute(copy_sql, (last_rowid,))
+                        cursor.execute(f"DELETE FROM {self.table}")
+                    self._swap(cursor)
+                    break
+                name, sql = row
+                cursor.execute(f"DROP INDEX {name}")
+                cursor.execute(re.sub(rf'\bON\s+"?{re.escape(self.table)}"?\s*\(', f"ON {self.shadow} (",
+                                      sql, count=1, flags=re.IGNORECASE))
+            progress(f"rebuild {self.table}: index {name} built")
+        # Keep the WAL from holding on to a copy of the whole table
+        db.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _swap(self, cursor):
+        # The indexes are on the shadow already and follow it through the rename
+        cursor.execute("""SELECT sql FROM sqlite_master
+                          WHERE tbl_name = ? AND type = 'trigger' AND sql IS NOT NULL
+                          ORDER BY rowid""", (self.table,))
+        triggers = [sql for (sql,) in cursor.fetchall()]
+        sequence = None
+        if table_exists(cursor, "sqlite_sequence"):
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (self.table,))
+            row = cursor.fetchone()
+            sequence = row[0] if row else None
+
+        cursor.execute(f"DROP TABLE {self.table}")
+        # Legacy rename leaves views and triggers on other tables alone; they
+        # still refer to the table by its (unchanged) name
+        cursor.execute("PRAGMA legacy_alter_table = ON")
+        try:
+            cursor.execute(f"ALTER TABLE {self.shadow} RENAME TO {self.table}")
+        finally:
+            cursor.execute("PRAGMA legacy_alter_table = OFF")
+        for sql in triggers:
+            cursor.execute(sql)
+        # AUTOINCREMENT must not hand out ids of rows deleted before the rebuild
+        if sequence is not None:
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                           (sequence, self.table))
+
+
+class Call:
+    chunked = False
+
+    def __init__(self, description, func):
+        self.description = description
+        self.func = func
+
+    def describe(self, cursor):
+        return self.description
+
+    def apply(self, cursor):
+        self.func(cursor)
+
+
+class Backfill:
+    # Long-running data step that manages its own transactions:
+    # func(db_manager, progress) must be safe to repeat
+    chunked = True
+
+    def __init__(self, description, func):
+        self.description = description
+        self.func = func
+
+    def describe(self, cursor):
+        return self.description
+
+    def run(self, db, chunk_size, progress):
+        self.func(db, progress)
+
+
+# Daily summary tables: (table, key column or None, source table, source key).
+# Each row holds line_count, quantity, subtotal, tax_amount and total_amount
+# of the source lines posted that day (and for that key). Timestamps are
+# stored in UTC; days are local dates, as the Reports tab picks them.
+SUMMARY_TABLES = (
+    ("sales_by_day", None, "sales", None),
+    ("sales_by_day_product", "product_id", "sales", "product_id"),
+    ("sales_by_day_customer", "customer_id", "sales", "customer_id"),
+    ("receipts_by_day", None, "goods_receiving", None),
+    ("receipts_by_day_product", "product_id", "goods_receiving", "product_id"),
+    ("receipts_by_day_supplier", "supplier_id", "goods_receiving", "supplier_id"),
+)
+SUMMARY_DATE_COLUMNS = {"sales": "date_sold", "goods_receiving": "date_received"}
+
+
+def summary_table_sql(table, key, value_type):
+    # value_type: column type of the quantity and amount columns
+    key_column = f"{key} INTEGER NOT NULL, " if key else ""
+    primary_key = f"day, {key}" if key else "day"
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+                   day TEXT NOT NULL, {key_column}
+                   line_count INTEGER NOT NULL, quantity {value_type} NOT NULL, subtotal {value_type} NOT NULL,
+                   tax_amount {value_type} NOT NULL, total_amount {value_type} NOT NULL,
+                   PRIMARY KEY ({primary_key})
+               ) WITHOUT ROWID"""
+
+
+def summary_trigger_sql(source):
+    # One upsert per summary table for every inserted line. Lines are never
+    # updated, and deleting them (archiving) deliberately leaves the
+    # summaries alone; rebuild_summaries recomputes a date range.
+    date_column = SUMMARY_DATE_COLUMNS[source]
+    upserts = []
+    for table, key, table_source, source_key in SUMMARY_TABLES:
+        if table_source != source:
+            continue
+        key_column = f"{key}, " if key else ""
+        key_value = f"COALESCE(new.{source_key}, 0), " if key else ""
+        conflict = f"day, {key}" if key else "day"
+        upserts.append(f"""
+            INSERT INTO {table} (day, {key_column}line_count, quantity, subtotal, tax_amount, total_amount)
+            VALUES (date(new.{date_column}, 'localtime'), {key_value}1, new.quantity,
+                    new.total_amount - COALESCE(new.tax_amount, 0), COALESCE(new.tax_amount, 0),
+                    new.total_amount)
+            ON CONFLICT ({conflict}) DO UPDATE SET
+                line_count = line_count + 1,
+                quantity = quantity + excluded.quantity,
+                subtotal = subtotal + excluded.subtotal,
+                tax_amount = tax_amount + excluded.tax_amount,
+                total_amount = total_amount + excluded.total_amount;""")
+    return (f"CREATE TRIGGER IF NOT EXISTS {source}_summaries AFTER INSERT ON {source} BEGIN"
+            + "".join(upserts) + "\nEND")
+
+
+def create_summary_triggers(cursor):
+    for source in SUMMARY_DATE_COLUMNS:
+        cursor.execute(summary_trigger_sql(source))
+
+
+def drop_summary_triggers(cursor):
+    for source in SUMMARY_DATE_COLUMNS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {source}_summaries")
+
+
+def recreate_summary_triggers(cursor):
+    drop_summary_triggers(cursor)
+    create_summary_triggers(cursor)
+
+
+def backfill_stock_movements(db, progress):
+    # Replays the receiving and sales lines into the stock ledger one month
+    # per transaction, then books whatever stock they do not explain as an
+    # opening balance dated before the history. Every month (and the opening
+    # balances) is deleted and inserted again, so a rerun is harmless.
+    with db.transaction() as cursor:
+        first_day, last_day = history_days(cursor)
+    if first_day is not None:
+        for month_first, month_last, day_after in month_ranges(first_day, last_day):
+            with db.transaction(immediate=True) as cursor:
+                cursor.execute("""DELETE FROM stock_movements
+                                  WHERE kind IN ('receipt', 'sale') AND moved_at >= ? AND moved_at < ?""",
+                               (month_first, day_after))
+                cursor.execute("""INSERT INTO stock_movements
+                                  (product_id, kind, quantity, moved_at, reference_id, created_by)
+                                  SELECT product_id, kind, quantity, moved_at, reference_id, created_by FROM (
+                                      SELECT id, product_id, 'receipt' AS kind, quantity,
+                                             date_received AS moved_at, receipt_id AS reference_id,
+                                             received_by AS created_by
+                                      FROM goods_receiving
+                                      WHERE date_received >= ?1 AND date_received < ?2
+                                      UNION ALL
+                                      SELECT id, product_id, 'sale', -quantity, date_sold, invoice_id, sold_by
+                                      FROM sales
+                                      WHERE date_sold >= ?1 AND date_sold < ?2)
+                                  WHERE product_id IS NOT NULL
+                                  ORDER BY moved_at, kind, id""", (month_first, day_after))
+            progress(f"stock ledger: {month_first} to {month_last} replayed")
+
+    with db.transaction(immediate=True) as cursor:
+        cursor.execute("DELETE FROM stock_movements WHERE kind = 'opening'")
+        cursor.execute("""INSERT INTO stock_movements (product_id, kind, quantity, moved_at)
+                          SELECT p.id, 'opening', p.stock_quantity - COALESCE(m.quantity, 0),
+                                 (SELECT COALESCE(MIN(moved_at), CURRENT_TIMESTAMP) FROM stock_movements)
+                          FROM products p
+                          LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity
+                                     FROM stock_movements GROUP BY product_id) AS m ON m.product_id = p.id
+                          WHERE p.stock_quantity - COALESCE(m.quantity, 0) != 0""")
+        progress(f"stock ledger: {cursor.rowcount} opening balance(s) booked")
+
+
+def insert_sample_data(cursor, price_scale=1):
+    # price_scale converts the rupee prices below to the unit of
+    # products.price: 1 for the base schema, 100 once prices are in paise
+    # Check if users already exist
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM users)")
+    if not cursor.fetchone()[0]:
+        # Create users
+        goods_password = bcrypt.hashpw("password123".encode('utf-8'), bcrypt.gensalt())
+        sales_password = bcrypt.hashpw("password123".encode('utf-8'), bcrypt.gensalt())
+
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                      ("goods_operator", goods_password, "goods_receiving"))
+        cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                      ("sales_operator", sales_password, "sales"))
+
+    # Check if products already exist
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM products)")
+    if not cursor.fetchone()[0]:
+        # Sample products
+        products = [
+            ("ELC001", "SKU001", "Electronics", "Laptops", "Dell Laptop", "High-performance laptop", 18.0, 50000.0, "piece"),
+            ("ELC002", "SKU002", "Electronics", "Accessories", "Wireless Mouse", "Optical wireless mouse", 12.0, 1500.0, "piece"),
+            ("ELC003", "SKU003", "Electronics", "Monitors", "LED Monitor", "24-inch LED monitor", 18.0, 15000.0, "piece"),
+            ("ELC004", "SKU004", "Electronics", "Accessories", "Keyboard", "Mechanical keyboard", 12.0, 3000.0, "piece"),
+            ("ELC005", "SKU005", "Electronics", "Storage", "External HDD", "1TB external hard drive", 18.0, 5000.0, "piece")
+        ]
+
+        for barcode, sku, cat, subcat, name, desc, tax, price, unit in products:
+            cursor.execute("""INSERT INTO products 
+                             (barcode, sku_id, category, subcategory, product_name, 
+                              description, tax_rate, price, unit_of_measurement) 
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                          (barcode, sku, cat, subcat, name, desc, tax, price * price_scale, unit))
+
+    # Check if suppliers already exist
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM suppliers)")
+    if not cursor.fetchone()[0]:
+        suppliers = [
+            ("Tech Suppliers Ltd", "John Doe", "9876543210", "john@techsuppliers.com", "123 Tech Street"),
+            ("Electronics Wholesale", "Jane Smith", "9876543211", "jane@ewholesale.com", "456 Electronics Ave"),
+            ("Global Components", "Mike Johnson", "9876543212", "mike@globalcomp.com", "789 Component Road")
+        ]
+
+        for name, contact, phone, email, address in suppliers:
+            cursor.execute("INSERT INTO suppliers (name, contact_person, phone, email, address) VALUES (?, ?, ?, ?, ?)",
+                          (name, contact, phone, email, address))
+
+    # Check if customers already exist
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM customers)")
+    if not cursor.fetchone()[0]:
+        customers = [
+            ("ABC Corporation", "9876543220", "contact@abc.com", "123 Business Street"),
+            ("XYZ Enterprises", "9876543221", "info@xyz.com", "456 Corporate Ave"),
+            ("Individual Customer", "9876543222", "customer@email.com", "789 Customer Road")
+        ]
+
+        for name, phone, email, address in customers:
+            cursor.execute("INSERT INTO customers (name, phone, email, address) VALUES (?, ?, ?, ?)",
+                          (name, phone, email, address))
+
+
+PRODUCTS_FTS_DELETE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, product_name, description, category,
+                                  subcategory, sku_id, barcode)
+        VALUES ('delete', old.id, old.product_name, old.description, old.category,
+                old.subcategory, old.sku_id, old.barcode);
+    END
+    """
+
+
+# Converting expressions for RebuildTable: REAL rupees to integer paise and
+# REAL units to integer thousandths
+def paise(column):
+    return f"CAST(ROUND({column} * 100) AS INTEGER)"
+
+
+def milli(column):
+    return f"CAST(ROUND({column} * 1000) AS INTEGER)"
+
+
+def header_sum(header_table, lines_table, key, expression, fallback):
+    # A document header total recomputed from its (already converted) lines,
+    # so headers and lines agree to the paisa
+    return (f"COALESCE((SELECT SUM({expression}) FROM {lines_table} WHERE {key} = {header_table}.id), "
+            f"{paise(fallback)})")
+
+
+class Migration:
+    def __init__(self, version, description, *steps):
+        self.version = version
+        self.description = description
+        self.steps = steps
+
+
+# Every schema change is a new Migration appended here with the next version
+# number; a migration is never edited once it has shipped. The first ones use
+# IF NOT EXISTS so that databases created before versioning are adopted.
+MIGRATIONS = (
+    Migration(1, "base schema", Sql(
+        "create users, products, suppliers, customers, goods_receiving and sales",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            barcode TEXT UNIQUE,
+            sku_id TEXT UNIQUE NOT NULL,
+            category TEXT NOT NULL,
+            subcategory TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            description TEXT,
+            tax_rate REAL DEFAULT 0.0,
+            price REAL NOT NULL,
+            unit_of_measurement TEXT NOT NULL,
+            stock_quantity REAL DEFAULT 0.0,
+            product_image_path TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS suppliers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            contact_person TEXT,
+            phone TEXT,
+            email TEXT,
+            address TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS customers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            phone TEXT,
+            email TEXT,
+            address TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS goods_receiving (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            supplier_id INTEGER,
+            quantity REAL NOT NULL,
+            rate_per_unit REAL NOT NULL,
+            tax_amount REAL,
+            total_amount REAL NOT NULL,
+            date_received TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            received_by TEXT,
+            FOREIGN KEY (product_id) REFERENCES products (id),
+            FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER,
+            customer_id INTEGER,
+            quantity REAL NOT NULL,
+            rate_per_unit REAL NOT NULL,
+            tax_amount REAL,
+            total_amount REAL NOT NULL,
+            date_sold TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sold_by TEXT,
+            FOREIGN KEY (product_id) REFERENCES products (id),
+            FOREIGN KEY (customer_id) REFERENCES customers (id)
+        )
+        """),
+        Call("insert sample data into empty tables", insert_sample_data)),
+
+    Migration(2, "goods receipt and sales invoice headers",
+              Sql("create goods_receipts and sales_invoices",
+                  """
+                  CREATE TABLE IF NOT EXISTS goods_receipts (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      supplier_id INTEGER,
+                      line_count INTEGER NOT NULL,
+                      total_amount REAL NOT NULL,
+                      date_received TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      received_by TEXT,
+                      FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+                  )
+                  """,
+                  """
+                  CREATE TABLE IF NOT EXISTS sales_invoices (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      customer_id INTEGER,
+                      line_count INTEGER NOT NULL,
+                      subtotal REAL NOT NULL,
+                      tax_amount REAL NOT NULL,
+                      total_amount REAL NOT NULL,
+                      date_sold TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      sold_by TEXT,
+                      FOREIGN KEY (customer_id) REFERENCES customers (id)
+                  )
+                  """),
+              AddColumn("goods_receiving", "receipt_id", "INTEGER REFERENCES goods_receipts (id)"),
+              AddColumn("sales", "invoice_id", "INTEGER REFERENCES sales_invoices (id)")),
+
+    Migration(3, "secondary indexes", CreateIndexes(INDEXES)),
+
+    # External-content FTS5 index over the searchable product columns. The
+    # update trigger only fires for those columns, so stock movements never
+    # touch the index; prefix indexes make "ab*" and "abc*" single lookups.
+    Migration(4, "product full-text search", Sql(
+        "create products_fts, its sync triggers and index the catalog",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            product_name, description, category, subcategory, sku_id, barcode,
+            content = 'products', content_rowid = 'id',
+            prefix = '2 3', tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, product_name, description, category, subcategory, sku_id, barcode)
+            VALUES (new.id, new.product_name, new.description, new.category, new.subcategory,
+                    new.sku_id, new.barcode);
+        END
+        """,
+        PRODUCTS_FTS_DELETE_TRIGGER,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_update
+        AFTER UPDATE OF product_name, description, category, subcategory, sku_id, barcode ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, product_name, description, category,
+                                      subcategory, sku_id, barcode)
+            VALUES ('delete', old.id, old.product_name, old.description, old.category,
+                    old.subcategory, old.sku_id, old.barcode);
+            INSERT INTO products_fts (rowid, product_name, description, category, subcategory, sku_id, barcode)
+            VALUES (new.id, new.product_name, new.description, new.category, new.subcategory,
+                    new.sku_id, new.barcode);
+        END
+        """,
+        # bm25 column weights: name, description, category, subcategory, sku, barcode
+        "INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 2.0, 2.0, 5.0, 5.0)')",
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')")),
+
+    Migration(5, "daily sales and receiving summaries",
+              Sql("create the daily summary tables",
+                  *(summary_table_sql(table, key, "REAL") for table, key, _source, _source_key in SUMMARY_TABLES)),
+              Call("create the summary triggers on sales and goods_receiving", create_summary_triggers),
+              Backfill("summarize existing sales and receipts, one month per transaction",
+                       lambda db, progress: db.rebuild_summaries(progress=progress))),
+
+    # Every change to products.stock_quantity is also written to the ledger
+    # as a signed quantity; snapshots record each product's stock as of a
+    # ledger id so history queries only replay the movements after one.
+    # Products created with stock get an opening movement from a trigger.
+    Migration(6, "stock movement ledger and snapshots",
+              Sql("create stock_movements, stock_snapshots and the opening stock trigger",
+                  """
+                  CREATE TABLE IF NOT EXISTS stock_movements (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      product_id INTEGER NOT NULL,
+                      kind TEXT NOT NULL CHECK (kind IN ('opening', 'receipt', 'sale', 'adjustment', 'return')),
+                      quantity REAL NOT NULL,
+                      moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      reference_id INTEGER,
+                      note TEXT,
+                      created_by TEXT,
+                      FOREIGN KEY (product_id) REFERENCES products (id)
+                  )
+                  """,
+                  """
+                  CREATE TABLE IF NOT EXISTS stock_snapshots (
+                      product_id INTEGER NOT NULL,
+                      movement_id INTEGER NOT NULL,
+                      taken_at TIMESTAMP NOT NULL,
+                      quantity REAL NOT NULL,
+                      PRIMARY KEY (product_id, movement_id)
+                  ) WITHOUT ROWID
+                  """,
+                  """
+                  CREATE TRIGGER IF NOT EXISTS products_opening_stock
+                  AFTER INSERT ON products WHEN new.stock_quantity != 0 BEGIN
+                      INSERT INTO stock_movements (product_id, kind, quantity)
+                      VALUES (new.id, 'opening', new.stock_quantity);
+                  END
+                  """),
+              CreateIndexes(STOCK_LEDGER_INDEXES),
+              Backfill("replay existing receipts and sales into the ledger, one month per transaction",
+                       backfill_stock_movements)),
+
+    # Money as integer paise and quantities as integer thousandths of a unit
+    # (see pricing.py). Line tables are converted first so document headers
+    # can be recomputed from them; the summaries are rebuilt from the
+    # converted lines. The FTS delete trigger is suspended while products
+    # are copied, as the rows keep their ids and searchable text.
+    Migration(7, "integer paise and milli-unit storage",
+              Sql("suspend the products_fts delete trigger", "DROP TRIGGER IF EXISTS products_fts_delete"),
+              RebuildTable("products", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      barcode TEXT UNIQUE,
+                      sku_id TEXT UNIQUE NOT NULL,
+                      category TEXT NOT NULL,
+                      subcategory TEXT NOT NULL,
+                      product_name TEXT NOT NULL,
+                      description TEXT,
+                      tax_rate REAL DEFAULT 0.0,
+                      price INTEGER NOT NULL,
+                      unit_of_measurement TEXT NOT NULL,
+                      stock_quantity INTEGER DEFAULT 0,
+                      product_image_path TEXT
+                  )
+                  """, {"price": paise("price"), "stock_quantity": milli("stock_quantity")}),
+              Sql("restore the products_fts delete trigger", PRODUCTS_FTS_DELETE_TRIGGER),
+              RebuildTable("goods_receiving", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      product_id INTEGER,
+                      supplier_id INTEGER,
+                      quantity INTEGER NOT NULL,
+                      rate_per_unit INTEGER NOT NULL,
+                      tax_amount INTEGER,
+                      total_amount INTEGER NOT NULL,
+                      date_received TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      received_by TEXT,
+                      receipt_id INTEGER REFERENCES goods_receipts (id),
+                      FOREIGN KEY (product_id) REFERENCES products (id),
+                      FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+                  )
+                  """, {"quantity": milli("quantity"), "rate_per_unit": paise("rate_per_unit"),
+                        "tax_amount": paise("tax_amount"), "total_amount": paise("total_amount")}),
+              RebuildTable("sales", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      product_id INTEGER,
+                      customer_id INTEGER,
+                      quantity INTEGER NOT NULL,
+                      rate_per_unit INTEGER NOT NULL,
+                      tax_amount INTEGER,
+                      total_amount INTEGER NOT NULL,
+                      date_sold TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      sold_by TEXT,
+                      invoice_id INTEGER REFERENCES sales_invoices (id),
+                      FOREIGN KEY (product_id) REFERENCES products (id),
+                      FOREIGN KEY (customer_id) REFERENCES customers (id)
+                  )
+                  """, {"quantity": milli("quantity"), "rate_per_unit": paise("rate_per_unit"),
+                        "tax_amount": paise("tax_amount"), "total_amount": paise("total_amount")}),
+              RebuildTable("goods_receipts", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      supplier_id INTEGER,
+                      line_count INTEGER NOT NULL,
+                      total_amount INTEGER NOT NULL,
+                      date_received TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      received_by TEXT,
+                      FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+                  )
+                  """, {"total_amount": header_sum("goods_receipts", "goods_receiving", "receipt_id",
+                                                   "total_amount", "total_amount")}),
+              RebuildTable("sales_invoices", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      customer_id INTEGER,
+                      line_count INTEGER NOT NULL,
+                      subtotal INTEGER NOT NULL,
+                      tax_amount INTEGER NOT NULL,
+                      total_amount INTEGER NOT NULL,
+                      date_sold TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      sold_by TEXT,
+                      FOREIGN KEY (customer_id) REFERENCES customers (id)
+                  )
+                  """, {"subtotal": header_sum("sales_invoices", "sales", "invoice_id",
+                                               "total_amount - COALESCE(tax_amount, 0)", "subtotal"),
+                        "tax_amount": header_sum("sales_invoices", "sales", "invoice_id",
+                                                 "COALESCE(tax_amount, 0)", "tax_amount"),
+                        "total_amount": header_sum("sales_invoices", "sales", "invoice_id",
+                                                   "total_amount", "total_amount")}),
+              RebuildTable("stock_movements", """
+                  CREATE TABLE {name} (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      product_id INTEGER NOT NULL,
+                      kind TEXT NOT NULL CHECK (kind IN ('opening', 'receipt', 'sale', 'adjustment', 'return')),
+                      quantity INTEGER NOT NULL,
+                      moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      reference_id INTEGER,
+                      note TEXT,
+                      created_by TEXT,
+                      FOREIGN KEY (product_id) REFERENCES products (id)
+                  )
+                  """, {"quantity": milli("quantity")}),
+              Sql("recreate the daily summary tables with integer columns",
+                  *(f"DROP TABLE IF EXISTS {table}" for table, _key, _source, _source_key in SUMMARY_TABLES),
+                  *(summary_table_sql(table, key, "INTEGER")
+                    for table, key, _source, _source_key in SUMMARY_TABLES)),
+              Backfill("summarize the converted sales and receipts, one month per transaction",
+                       lambda db, progress: db.rebuild_summaries(progress=progress)),
+              # Snapshots are WITHOUT ROWID, which RebuildTable cannot page
+              # through; they are converted in the transaction that bumps
+              # the schema version, so this never runs twice
+              Sql("convert stock_snapshots",
+                  """
+                  CREATE TABLE _rebuild_stock_snapshots (
+                      product_id INTEGER NOT NULL,
+                      movement_id INTEGER NOT NULL,
+                      taken_at TIMESTAMP NOT NULL,
+                      quantity INTEGER NOT NULL,
+                      PRIMARY KEY (product_id, movement_id)
+                  ) WITHOUT ROWID
+                  """,
+                  f"""INSERT INTO _rebuild_stock_snapshots
+                      SELECT product_id, movement_id, taken_at, {milli("quantity")} FROM stock_snapshots""",
+                  "DROP TABLE stock_snapshots",
+                  "ALTER TABLE _rebuild_stock_snapshots RENAME TO stock_snapshots",
+                  "CREATE INDEX IF NOT EXISTS idx_stock_snapshots_movement ON stock_snapshots (movement_id)")),
+
+    # Inventory valuation (see valuation.py). Opening balances come in at
+    # no cost through a trigger, as products are created in several places;
+    # receipts, sales and manual movements are valued by their posting paths.
+    Migration(8, "inventory valuation",
+              Sql("create the cost layer, product cost and margin tables",
+                  """
+                  CREATE TABLE IF NOT EXISTS cost_layers (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      product_id INTEGER NOT NULL,
+                      kind TEXT NOT NULL CHECK (kind IN ('opening', 'receipt', 'adjustment', 'return')),
+                      reference_id INTEGER,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      quantity INTEGER NOT NULL,
+                      remaining INTEGER NOT NULL,
+                      unit_cost INTEGER NOT NULL,
+                      FOREIGN KEY (product_id) REFERENCES products (id)
+                  )
+                  """,
+                  # FIFO reads a product's open layers oldest first; used-up
+                  # layers stay for reference but leave the index
+                  """CREATE INDEX IF NOT EXISTS idx_cost_layers_open ON cost_layers (product_id, id)
+                     WHERE remaining > 0""",
+                  """
+                  CREATE TABLE IF NOT EXISTS product_costs (
+                      product_id INTEGER PRIMARY KEY,
+                      quantity INTEGER NOT NULL DEFAULT 0,
+                      average_value INTEGER NOT NULL DEFAULT 0,
+                      fifo_value INTEGER NOT NULL DEFAULT 0,
+                      FOREIGN KEY (product_id) REFERENCES products (id)
+                  )
+                  """,
+                  "CREATE INDEX IF NOT EXISTS idx_product_costs_value ON product_costs (fifo_value)",
+                  # A rebuild finds each line's ledger movement to replay
+                  # postings made in the same second in their real order
+                  """CREATE INDEX IF NOT EXISTS idx_stock_movements_reference
+                     ON stock_movements (reference_id, product_id, kind)""",
+                  """
+                  CREATE TABLE IF NOT EXISTS margins_by_day (
+                      day TEXT PRIMARY KEY,
+                      quantity INTEGER NOT NULL, revenue INTEGER NOT NULL,
+                      fifo_cost INTEGER NOT NULL, average_cost INTEGER NOT NULL
+                  ) WITHOUT ROWID
+                  """,
+                  """
+                  CREATE TABLE IF NOT EXISTS margins_by_day_product (
+                      day TEXT NOT NULL,
+                      product_id INTEGER NOT NULL,
+                      quantity INTEGER NOT NULL, revenue INTEGER NOT NULL,
+                      fifo_cost INTEGER NOT NULL, average_cost INTEGER NOT NULL,
+                      PRIMARY KEY (day, product_id)
+                  ) WITHOUT ROWID
+                  """,
+                  """
+                  CREATE TRIGGER IF NOT EXISTS stock_movements_opening_cost
+                  AFTER INSERT ON stock_movements WHEN new.kind = 'opening' AND new.quantity > 0 BEGIN
+                      INSERT INTO cost_layers (product_id, kind, created_at, quantity, remaining, unit_cost)
+                      VALUES (new.product_id, 'opening', new.moved_at, new.quantity, new.quantity, 0);
+                      INSERT INTO product_costs (product_id, quantity) VALUES (new.product_id, new.quantity)
+                      ON CONFLICT (product_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+                  END
+                  """),
+              Backfill("value the stock by replaying the receipt and sales history", rebuild_valuation)),
+
+    # Archiving a year (archive.py) picks its used-up cost layers by date
+    Migration(9, "used-up cost layers by date",
+              Sql("create index idx_cost_layers_used_up",
+                  """CREATE INDEX IF NOT EXISTS idx_cost_layers_used_up ON cost_layers (created_at)
+                     WHERE remaining = 0""")),
+
+    # Summaries and margins were bucketed by UTC date, so a sale made early
+    # in the morning in India counted on the previous day of the reports
+    Migration(10, "daily summaries and margins by local date",
+              Call("recreate the summary triggers with local dates", recreate_summary_triggers),
+              # Days at either end of the history can lose every line
+              Sql("empty the daily summary tables",
+                  *(f"DELETE FROM {table}" for table, _key, _source, _source_key in SUMMARY_TABLES)),
+              Backfill("summarize the sales and receipts again by local date",
+                       lambda db, progress: db.rebuild_summaries(progress=progress)),
+              Backfill("replay the margins by local date", rebuild_valuation)),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
@@ -0,0 +1,167 @@
+from PySide6.QtCore import QAbstractListModel, QAbstractTableModel, QModelIndex, QObject, Qt, Signal
+
+
+# Re-emits DatabaseManager product change callbacks as a Qt signal, so
+# changes posted from any thread are delivered on the GUI thread
+class ProductChangeNotifier(QObject):
+    products_changed = Signal(object)
+
+    def __init__(self, db_manager, parent=None):
+        super().__init__(parent)
+        self._db = db_manager
+        self._db.add_products_listener(self.products_changed.emit)
+
+    def detach(self):
+        self._db.remove_products_listener(self.products_changed.emit)
+
+
+# Read-only table model that pulls rows from SQLite one page at a time.
+# fetch_page(after, limit) returns rows ordered by the key row_key(row)
+# extracts, starting strictly after `after` (None for the first page).
+# The first element of every row is the product id and is not displayed.
+# fetch_rows(product_ids) returns the current rows for the given ids and is
+# used to refresh changed rows in place. With a DbExecutor both run on a
+# worker thread and rows are added when they arrive. formatters maps a
+# displayed column to the function that turns its stored value into text.
+class PagedTableModel(QAbstractTableModel):
+    PAGE_SIZE = 500
+
+    def __init__(self, headers, fetch_page, fetch_rows=None, row_key=lambda row: row[0],
+                 executor=None, formatters=None, parent=None):
+        super().__init__(parent)
+        self._headers = headers
+        self._formatters = formatters or {}
+        self._fetch_page = fetch_page
+        self._fetch_rows = fetch_rows
+        self._row_key = row_key
+        self._executor = executor
+        self._rows = []
+        self._positions = {}
+        self._exhausted = False
+        self._loading = False
+        # Bumped on reload so results of requests made before it are dropped
+        self._generation = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        column = index.column()
+        return self._formatters.get(column, str)(self._rows[index.row()][column + 1])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self._headers[section]
+        return section + 1
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted and not self._loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted or self._loading:
+            return
+        after = self._row_key(self._rows[-1]) if self._rows else None
+        if self._executor is None:
+            self._append_page(self._generation, self._fetch_page(after, self.PAGE_SIZE))
+            return
+        self._loading = True
+        generation = self._generation
+        self._executor.submit(self._fetch_page, after, self.PAGE_SIZE,
+                              on_result=lambda rows: self._append_page(generation, rows),
+                              on_error=lambda e: self._page_failed(generation))
+
+    def _page_failed(self, generation):
+        if generation == self._generation:
+            self._loading = False
+
+    def _append_page(self, generation, rows):
+        if generation != self._generation:
+            return
+        self._loading = False
+        if len(rows) < self.PAGE_SIZE:
+            self._exhausted = True
+        if not rows:
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._rows.extend(rows)
+        for position, row in enumerate(rows, first):
+            self._positions[row[0]] = position
+        self.endInsertRows()
+
+    def update_rows(self, product_ids):
+        # Refresh only the loaded rows for these products; rows not fetched
+        # yet will be read fresh when the view scrolls to them
+        if product_ids is None or self._fetch_rows is None:
+            self.reload()
+            return
+        loaded = [product_id for product_id in product_ids if product_id in self._positions]
+        if not loaded:
+            return
+        if self._executor is None:
+            self._replace_rows(self._generation, self._fetch_rows(loaded))
+            return
+        generation = self._generation
+        self._executor.submit(self._fetch_rows, loaded,
+                              on_result=lambda rows: self._replace_rows(generation, rows))
+
+    def _replace_rows(self, generation, rows):
+        if generation != self._generation:
+            return
+        last_column = len(self._headers) - 1
+        for row in rows:
+            position = self._positions.get(row[0])
+            if position is None:
+                continue
+            self._rows[position] = row
+            self.dataChanged.emit(self.index(position, 0), self.index(position, last_column))
+
+    def reload(self):
+        # Drop everything fetched so far; the view pulls the first page again
+        self.beginResetModel()
+        self._generation += 1
+        self._rows = []
+        self._positions = {}
+        self._exhausted = False
+        self._loading = False
+        self.endResetModel()
+        self.fetchMore()
+
+
+# Short list of (product id, label) pairs, e.g. the matches offered by a
+# completer. The id is available under Qt.UserRole.
+class ProductListModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._items = []
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        product_id, label = self._items[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return label
+        if role == Qt.UserRole:
+            return product_id
+        return None
+
+    def set_items(self, items):
+        self.beginResetModel()
+        self._items = list(items)
+        self.endResetModel()
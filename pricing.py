@@ -0,0 +1,79 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+# Money is stored and computed as integer paise and quantities as integer
+# thousandths of a unit, so sums are exact and SQLite aggregates them with
+# integer arithmetic. Floats only appear at the edges (spin boxes), and are
+# converted through their decimal string so 0.1 stays 0.1.
+PAISE_PER_RUPEE = 100
+MILLI_PER_UNIT = 1000
+
+
+def _scaled(value, scale):
+    return int((Decimal(str(value)) * scale).to_integral_value(ROUND_HALF_UP))
+
+
+def to_paise(rupees):
+    # rupees: Decimal, int, float or numeric string
+    return _scaled(rupees, PAISE_PER_RUPEE)
+
+
+def to_milli(quantity):
+    return _scaled(quantity, MILLI_PER_UNIT)
+
+
+def rupees(paise):
+    return Decimal(paise).scaleb(-2)
+
+
+def units(milli):
+    return Decimal(milli).scaleb(-3)
+
+
+def format_money(paise):
+    return f"{rupees(paise):.2f}"
+
+
+def format_quantity(milli):
+    # Up to three decimals, without trailing zeros: 12, 2.5, 0.125
+    text = f"{units(milli):.3f}".rstrip("0")
+    return text[:-1] if text.endswith(".") else text
+
+
+def divide_half_up(numerator, denominator):
+    # Integer division rounding halves away from zero; denominator > 0
+    quotient = (abs(numerator) * 2 + denominator) // (2 * denominator)
+    return quotient if numerator >= 0 else -quotient
+
+
+def tax_basis_points(tax_rate):
+    # products.tax_rate is a percentage (18.0); 1800 basis points
+    return _scaled(tax_rate, 100)
+
+
+def line_totals(quantity, rate, tax_rate):
+    # quantity in milli-units, rate in paise per unit, tax_rate a percentage.
+    # Returns (subtotal, tax_amount, total) in paise, each rounded half up
+    # once, so a line always adds up exactly.
+    subtotal = divide_half_up(quantity * rate, MILLI_PER_UNIT)
+    tax_amount = divide_half_up(subtotal * tax_basis_points(tax_rate), 10000)
+    return subtotal, tax_amount, subtotal + tax_amount
+
+
+def invoice_totals(lines):
+    # lines: iterable of (quantity, rate, tax_rate) as for line_totals.
+    # Returns the per-line (subtotal, tax_amount, total) tuples and the
+    # document sums in one pass; the sums are exact integers.
+    line_results = []
+    subtotal_sum = tax_sum = 0
+    basis_points = {}
+    for quantity, rate, tax_rate in lines:
+        # Invoices repeat a handful of tax rates; convert each one once
+        points = basis_points.get(tax_rate)
+        if points is None:
+            points = basis_points[tax_rate] = tax_basis_points(tax_rate)
+        subtotal = divide_half_up(quantity * rate, MILLI_PER_UNIT)
+        tax_amount = divide_half_up(subtotal * points, 10000)
+        line_results.append((subtotal, tax_amount, subtotal + tax_amount))
+        subtotal_sum += subtotal
+        tax_sum += tax_amount
+    return line_results, (subtotal_sum, tax_sum, subtotal_sum + tax_sum)
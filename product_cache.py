@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class ProductRecord:
+    __slots__ = ("id", "barcode", "sku_id", "product_name", "unit_of_measurement",
+                 "tax_rate", "price", "stock_quantity")
+
+    def __init__(self, id, barcode, sku_id, product_name, unit_of_measurement,
+                 tax_rate, price, stock_quantity):
+        self.id = id
+        self.barcode = barcode
+        self.sku_id = sku_id
+        self.product_name = product_name
+        self.unit_of_measurement = unit_of_measurement
+        self.tax_rate = tax_rate
+        self.price = price
+        self.stock_quantity = stock_quantity
+
+
+class ProductCache:
+    # Bounded LRU of ProductRecord keyed by product id. `loader(product_id)`
+    # is called on a miss and returns a ProductRecord or None. Loads run
+    # outside the lock, so every invalidation bumps `generation`; a record
+    # read before an invalidation that raced with it is not cached.
+    def __init__(self, loader, max_size=4096):
+        self._loader = loader
+        self._max_size = max_size
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product_id):
+        with self._lock:
+            record = self._records.get(product_id)
+            if record is not None:
+                self._records.move_to_end(product_id)
+                self.hits += 1
+                return record
+            self.misses += 1
+            generation = self.generation
+
+        record = self._loader(product_id)
+        if record is not None:
+            self.put(record, generation)
+        return record
+
+    def put(self, record, generation=None):
+        # generation: self.generation as read before record was loaded
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._records[record.id] = record
+            self._records.move_to_end(record.id)
+            while len(self._records) > self._max_size:
+                self._records.popitem(last=False)
+
+    def invalidate(self, product_ids=None):
+        with self._lock:
+            self.generation += 1
+            if product_ids is None:
+                self._records.clear()
+                return
+            for product_id in product_ids:
+                self._records.pop(product_id, None)
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,177 @@
+import threading
+
+from client import ApiError, InventoryClient
+from database import InsufficientStockError, InventoryError
+from product_cache import ProductCache, ProductRecord
+from service import InventoryService
+
+
+def product_record(row):
+    # ProductRecord from a row in the product_page layout
+    return ProductRecord(row[0], row[1], row[2], row[5], row[9], row[7], row[8], row[10])
+
+
+# Stands in for DatabaseManager in the Qt app when it runs against
+# server.py: the lookups and table pages the window reads go through
+# client.py, so every posting is made by the server's single writer. Each
+# thread gets its own client, all sharing the login's token. Like a
+# DatabaseManager, products are cached and listeners only hear of changes
+# made through this object. Every product row fetched refreshes the cache,
+# so the window's lookups of products it has listed or picked do not wait
+# on the server. When the server's session runs out, the token is dropped
+# and the logout listeners are told, to have the user log in again.
+class RemoteDatabase:
+    # No per-query statistics: the queries run in the server
+    query_stats = None
+
+    def __init__(self, url):
+        self.url = url
+        self.token = None
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self.product_cache = ProductCache(self._load_product)
+        self._product_listeners = []
+        self._logout_listeners = []
+
+    def client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = InventoryClient(self.url)
+            with self._clients_lock:
+                self._clients.append(client)
+        client.token = self.token
+        return client
+
+    def call(self, name, *args):
+        # The client call, with refusals raised as the InventoryError a
+        # DatabaseManager would have raised
+        try:
+            return getattr(self.client(), name)(*args)
+        except ApiError as e:
+            if e.status == 409:
+                raise InsufficientStockError([(shortage["product_id"], shortage["requested"], shortage["available"])
+                                              for shortage in e.shortages]) from None
+            if e.status == 400:
+                raise InventoryError(str(e)) from None
+            if e.status == 401:
+                self.token = None
+                for callback in list(self._logout_listeners):
+                    callback()
+                raise InventoryError("The server session has expired; log in again") from None
+            raise
+
+    def close(self):
+        with self._clients_lock:
+            for client in self._clients:
+                client.close()
+            self._clients.clear()
+
+    def authenticate(self, username, password):
+        client = self.client()
+        role = client.login(username, password)
+        if role:
+            self.token = client.token
+        return role
+
+    def add_logout_listener(self, callback):
+        # callback() runs on the thread whose call the server refused
+        self._logout_listeners.append(callback)
+
+    def remove_logout_listener(self, callback):
+        self._logout_listeners.remove(callback)
+
+    def add_products_listener(self, callback):
+        self._product_listeners.append(callback)
+
+    def remove_products_listener(self, callback):
+        self._product_listeners.remove(callback)
+
+    def invalidate_products(self, product_ids=None):
+        if product_ids is not None:
+            product_ids = list(product_ids)
+        self.product_cache.invalidate(product_ids)
+        for callback in list(self._product_listeners):
+            callback(product_ids)
+
+    def _cached_rows(self, name, *args):
+        # A call returning rows in the product_page layout
+        generation = self.product_cache.generation
+        rows = self.call(name, *args)
+        for row in rows:
+            self.product_cache.put(product_record(row), generation)
+        return rows
+
+    def _load_product(self, product_id):
+        rows = self.call("product_rows", [product_id])
+        return product_record(rows[0]) if rows else None
+
+    def get_product(self, product_id):
+        return self.product_cache.get(product_id)
+
+    def find_product_by_code(self, code):
+        generation = self.product_cache.generation
+        product = self.call("product", code)
+        if product is None:
+            return None
+        record = ProductRecord(**product)
+        self.product_cache.put(record, generation)
+        return record
+
+    def product_page(self, after_id=None, limit=500):
+        return self._cached_rows("product_page", after_id, limit)
+
+    def product_rows(self, product_ids):
+        return self._cached_rows("product_rows", list(product_ids))
+
+    def search_products(self, text, limit=50):
+        return self._cached_rows("product_search_rows", text, limit)
+
+    def inventory_page(self, after=None, limit=500):
+        return self.call("inventory_page", after, limit)
+
+    def inventory_rows(self, product_ids):
+        return self.call("inventory_rows", list(product_ids))
+
+    def report(self, name, first_day, last_day, limit=-1):
+        return self.call("report", name, first_day, last_day, limit)
+
+
+# The InventoryService calls the Qt app makes, over a RemoteDatabase.
+# Quotes are computed here from the cached products, exactly as the server
+# would, so editing a cart never waits on it; posting checks the stock
+# again. Postings are made as the user logged in to the server; the
+# username argument is only there to match InventoryService.
+class RemoteService:
+    def __init__(self, remote_db):
+        self.db = remote_db
+        self._quotes = InventoryService(remote_db)
+
+    def customers(self):
+        return self.db.call("customers")
+
+    def suppliers(self):
+        return self.db.call("suppliers")
+
+    def quote_sale(self, lines):
+        return self._quotes.quote_sale(lines)
+
+    def quote_receipt(self, lines):
+        return self._quotes.quote_receipt(lines)
+
+    def _posted(self, lines):
+        # Refetches the products posted, still on the posting thread, so
+        # the window finds their new stock in the cache
+        product_ids = {line[0] for line in lines}
+        self.db.invalidate_products(product_ids)
+        self.db.product_rows(product_ids)
+
+    def post_sale(self, customer_id, lines, username):
+        posted = self.db.call("post_sale", customer_id, lines)
+        self._posted(lines)
+        return posted
+
+    def post_receipt(self, supplier_id, lines, username):
+        posted = self.db.call("post_receipt", supplier_id, lines)
+        self._posted(lines)
+        return posted
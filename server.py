@@ -0,0 +1,373 @@
+"""Local HTTP/JSON API over the inventory, for terminals and scripts.
+
+    python server.py [--db inventory.db] [--host 127.0.0.1] [--port 8765] [--read-threads 4]
+
+    POST /login                  {"username", "password"} -> {"token", "role"}
+    GET  /products?q=TEXT        search; GET /products/CODE by barcode or SKU
+    GET  /customers, /suppliers
+    POST /sales/quote            {"lines": [[product_id, quantity], ...]}
+    POST /sales                  {"customer_id", "lines": [[product_id, quantity], ...]}
+    POST /receipts/quote         {"lines": [[product_id, quantity, rate_per_unit], ...]}
+    POST /receipts               {"supplier_id", "lines": [[product_id, quantity, rate_per_unit], ...]}
+    POST /stock-movements        {"kind", "product_id", "quantity", "reference_id", "note"}
+    GET  /reports                names and columns; GET /reports/NAME?from=DAY&to=DAY&limit=N
+    GET  /product-rows           ?after=ID&limit=N, ?q=TEXT&limit=N or ?ids=ID,ID,...: product table rows
+    GET  /inventory-rows         ?after_name=NAME&after_id=ID&limit=N or ?ids=ID,ID,...: inventory table rows
+
+Every request but /login carries "Authorization: Bearer TOKEN". Money is in
+paise and quantities in milli-units, as stored.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from database import DatabaseManager, InsufficientStockError, InventoryError
+from instrumentation import configure_slow_query_log
+from service import InventoryService, shortage_dicts
+from session import SESSION_TTL
+
+DEFAULT_PORT = 8765
+READ_THREADS = 4
+# Postings waiting for the writer; beyond that, requests wait for room
+WRITE_QUEUE_SIZE = 1000
+MAX_BODY_SIZE = 1 << 20
+MAX_HEADER_LINES = 100
+# Product ids one table row request may ask for
+MAX_ROW_IDS = 1000
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+# (method, path) -> handler; "*" stands for one path segment passed to it
+ROUTES = {
+    ("POST", "login"): "login",
+    ("GET", "products"): "search_products",
+    ("GET", "products/*"): "product",
+    ("GET", "customers"): "customers",
+    ("GET", "suppliers"): "suppliers",
+    ("POST", "sales/quote"): "quote_sale",
+    ("POST", "sales"): "post_sale",
+    ("POST", "receipts/quote"): "quote_receipt",
+    ("POST", "receipts"): "post_receipt",
+    ("POST", "stock-movements"): "post_stock_movement",
+    ("GET", "reports"): "reports",
+    ("GET", "reports/*"): "report",
+    ("GET", "product-rows"): "product_rows",
+    ("GET", "inventory-rows"): "inventory_rows",
+}
+# Postings are limited to the role whose tab offers them in the Qt app
+POSTING_ROLES = {
+    "post_sale": "sales",
+    "post_receipt": "goods_receiving",
+    "post_stock_movement": "goods_receiving",
+}
+
+log = logging.getLogger("inventory.server")
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def integer_field(data, name, required=True):
+    value = data.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise HttpError(400, f"{name} must be an integer")
+    return value
+
+
+def integer_query(query, name, default=None):
+    if name not in query:
+        return default
+    try:
+        return int(query[name])
+    except ValueError:
+        raise HttpError(400, f"{name} must be an integer")
+
+
+def ids_query(query):
+    try:
+        product_ids = [int(product_id) for product_id in query["ids"].split(",") if product_id]
+    except ValueError:
+        raise HttpError(400, "ids must be comma-separated integers")
+    if len(product_ids) > MAX_ROW_IDS:
+        raise HttpError(400, f"at most {MAX_ROW_IDS} ids at a time")
+    return product_ids
+
+
+def lines_field(data, width):
+    lines = data.get("lines")
+    if not isinstance(lines, list) or not all(
+            isinstance(line, list) and len(line) == width
+            and all(isinstance(value, int) and not isinstance(value, bool) for value in line)
+            for line in lines):
+        raise HttpError(400, f"lines must be a list of lists of {width} integers")
+    return lines
+
+
+def run_postings(batch):
+    # (error, result) of every (func, args, future) in turn
+    outcomes = []
+    for func, args, _future in batch:
+        try:
+            outcomes.append((None, func(*args)))
+        except Exception as e:
+            outcomes.append((e, None))
+    return outcomes
+
+
+# Serves the JSON API on one asyncio loop. Reads run on a small thread pool,
+# one DatabaseManager connection per thread, so they proceed side by side.
+# Postings are queued for a single writer task that runs them one at a time
+# on its own thread: writers from this server never contend for SQLite's
+# write lock, and a burst of postings waits in the queue, not in busy retries.
+class InventoryServer:
+    def __init__(self, service, read_threads=READ_THREADS, session_ttl=SESSION_TTL):
+        self.service = service
+        self.session_ttl = session_ttl
+        self.read_pool = ThreadPoolExecutor(read_threads, thread_name_prefix="read")
+        self.write_pool = ThreadPoolExecutor(1, thread_name_prefix="write")
+        self.writes = None
+        self.tokens = {}
+
+    async def serve(self, host, port):
+        self.writes = asyncio.Queue(WRITE_QUEUE_SIZE)
+        writer_task = asyncio.ensure_future(self.run_writer())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        log.info("listening on %s", ", ".join(str(sock.getsockname()) for sock in server.sockets))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.read_pool.shutdown()
+            self.write_pool.shutdown()
+
+    async def read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, func, *args)
+
+    async def write(self, func, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((func, args, future))
+        return await future
+
+    async def run_writer(self):
+        # Whatever is queued goes to the writer thread in one hand-off, so a
+        # burst costs one thread switch rather than one per posting. Each
+        # posting is still its own transaction.
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            outcomes = await loop.run_in_executor(self.write_pool, run_postings, batch)
+            for (_func, _args, future), (error, result) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive: one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    headers = await self.read_headers(reader)
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY_SIZE:
+                        raise HttpError(413, f"request body over {MAX_BODY_SIZE} bytes")
+                except (ValueError, HttpError) as e:
+                    await self.respond(writer, getattr(e, "status", 400), {"error": str(e)}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.dispatch(method, target, headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_headers(self, reader):
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        raise HttpError(400, "too many header lines")
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n")
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            name = ROUTES.get((method, "/".join(parts)))
+            argument = None
+            if name is None and len(parts) == 2:
+                name = ROUTES.get((method, f"{parts[0]}/*"))
+                argument = parts[1]
+            if name is None:
+                raise HttpError(404, f"no route for {method} {url.path}")
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                raise HttpError(400, "request body is not valid JSON")
+            if not isinstance(data, dict):
+                raise HttpError(400, "request body must be a JSON object")
+            user = None if name == "login" else self.authorize(headers, name)
+            return 200, await getattr(self, f"handle_{name}")(user, argument, query, data)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except InsufficientStockError as e:
+            return 409, {"error": str(e), "shortages": shortage_dicts(e.shortages)}
+        except InventoryError as e:
+            return 400, {"error": str(e)}
+        except Exception:
+            log.exception("%s %s failed", method, target)
+            return 500, {"error": "internal error"}
+
+    def authorize(self, headers, name):
+        # (username, role) of the request's token
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        session = self.tokens.get(token) if scheme.lower() == "bearer" else None
+        if session is None or session[2] <= time.monotonic():
+            self.tokens.pop(token, None)
+            raise HttpError(401, "log in first")
+        role = POSTING_ROLES.get(name)
+        if role and session[1] != role:
+            raise HttpError(403, f"only the {role} role may do this")
+        return session[:2]
+
+    async def handle_login(self, _user, _argument, _query, data):
+        username, password = data.get("username"), data.get("password")
+        if not isinstance(username, str) or not isinstance(password, str):
+            raise HttpError(400, "username and password are required")
+        # bcrypt, and possibly a rehash: kept off the writer so postings do not wait on it
+        role = await self.read(self.service.login, username, password)
+        if role is None:
+            raise HttpError(401, "invalid username or password")
+        now = time.monotonic()
+        self.tokens = {token: session for token, session in self.tokens.items() if session[2] > now}
+        token = secrets.token_urlsafe(32)
+        self.tokens[token] = (username, role, now + self.session_ttl)
+        return {"token": token, "role": role}
+
+    async def handle_search_products(self, _user, _argument, query, _data):
+        return await self.read(self.service.search_products, query.get("q", ""), integer_query(query, "limit", 50))
+
+    async def handle_product(self, _user, code, _query, _data):
+        product = await self.read(self.service.product, code)
+        if product is None:
+            raise HttpError(404, f"no product with barcode or SKU {code!r}")
+        return product
+
+    async def handle_customers(self, _user, _argument, _query, _data):
+        return await self.read(self.service.customers)
+
+    async def handle_suppliers(self, _user, _argument, _query, _data):
+        return await self.read(self.service.suppliers)
+
+    async def handle_quote_sale(self, _user, _argument, _query, data):
+        return await self.read(self.service.quote_sale, lines_field(data, 2))
+
+    async def handle_post_sale(self, user, _argument, _query, data):
+        return await self.write(self.service.post_sale, integer_field(data, "customer_id"),
+                                lines_field(data, 2), user[0])
+
+    async def handle_quote_receipt(self, _user, _argument, _query, data):
+        return await self.read(self.service.quote_receipt, lines_field(data, 3))
+
+    async def handle_post_receipt(self, user, _argument, _query, data):
+        return await self.write(self.service.post_receipt, integer_field(data, "supplier_id"),
+                                lines_field(data, 3), user[0])
+
+    async def handle_post_stock_movement(self, user, _argument, _query, data):
+        note = data.get("note")
+        if note is not None and not isinstance(note, str):
+            raise HttpError(400, "note must be a string")
+        return await self.write(self.service.post_stock_movement, data.get("kind"),
+                                integer_field(data, "product_id"), integer_field(data, "quantity"), user[0],
+                                integer_field(data, "reference_id", required=False), note)
+
+    async def handle_reports(self, _user, _argument, _query, _data):
+        return self.service.reports()
+
+    async def handle_report(self, _user, name, query, _data):
+        if "from" not in query or "to" not in query:
+            raise HttpError(400, "from and to days are required")
+        return await self.read(self.service.report, name, query["from"], query["to"],
+                               integer_query(query, "limit", -1))
+
+    async def handle_product_rows(self, _user, _argument, query, _data):
+        if "ids" in query:
+            return await self.read(self.service.product_rows, ids_query(query))
+        limit = integer_query(query, "limit", 500)
+        if "q" in query:
+            return await self.read(self.service.product_search_rows, query["q"], limit)
+        return await self.read(self.service.product_page, integer_query(query, "after"), limit)
+
+    async def handle_inventory_rows(self, _user, _argument, query, _data):
+        if "ids" in query:
+            return await self.read(self.service.inventory_rows, ids_query(query))
+        after = None
+        if "after_name" in query:
+            after = (query["after_name"], integer_query(query, "after_id", 0))
+        return await self.read(self.service.inventory_page, after, integer_query(query, "limit", 500))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="inventory.db", help="database file (default: inventory.db)")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1, this machine only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"default: {DEFAULT_PORT}")
+    parser.add_argument("--read-threads", type=int, default=READ_THREADS,
+                        help=f"threads serving reads side by side (default: {READ_THREADS})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    configure_slow_query_log()
+    db_manager = DatabaseManager(args.db)
+    server = InventoryServer(InventoryService(db_manager), args.read_threads)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+from database import REPORTS, InventoryError
+from pricing import invoice_totals
+
+
+def product_dict(product):
+    return {name: getattr(product, name) for name in product.__slots__}
+
+
+def checked_lines(lines, document):
+    # Lines as tuples, refusing quantities that are not positive and
+    # negative rates, which posting would apply as given
+    lines = [tuple(line) for line in lines]
+    for line in lines:
+        if line[1] <= 0:
+            raise InventoryError(f"Invalid quantity on a {document} line: {line[1]}")
+        if len(line) > 2 and line[2] < 0:
+            raise InventoryError(f"Invalid rate on a {document} line: {line[2]}")
+    return lines
+
+
+def shortage_dicts(shortages):
+    return [{"product_id": product_id, "requested": requested, "available": available}
+            for product_id, requested, available in shortages]
+
+
+# The inventory operations without any GUI: cart and receipt quotes, posting
+# and lookups, for the Qt app and the HTTP server (server.py) alike.
+# Arguments and results are plain ints, strings, lists and dicts, so they
+# map one to one onto the JSON API; money is in paise and quantities in
+# milli-units. Posting errors are InventoryError (InsufficientStockError
+# when stock is short), raised before anything is written.
+class InventoryService:
+    def __init__(self, db_manager):
+        self.db = db_manager
+
+    def login(self, username, password):
+        # The user's role, or None
+        return self.db.authenticate(username, password)
+
+    def product(self, code):
+        # By barcode or SKU; None if there is no such product
+        product = self.db.find_product_by_code(code)
+        return product_dict(product) if product else None
+
+    def search_products(self, text, limit=50):
+        return [{"id": row[0], "barcode": row[1], "sku_id": row[2], "product_name": row[5],
+                 "tax_rate": row[7], "price": row[8], "unit_of_measurement": row[9], "stock_quantity": row[10]}
+                for row in self.db.search_products(text, limit)]
+
+    # Rows for the Qt app's paged tables, as lists in the row layouts of
+    # DatabaseManager.product_page and inventory_page
+    def product_page(self, after_id=None, limit=500):
+        return [list(row) for row in self.db.product_page(after_id, limit)]
+
+    def product_rows(self, product_ids):
+        return [list(row) for row in self.db.product_rows(product_ids)]
+
+    def product_search_rows(self, text, limit=50):
+        return [list(row) for row in self.db.search_products(text, limit)]
+
+    def inventory_page(self, after=None, limit=500):
+        # after: the (product_name, id) of the last row already shown
+        return [list(row) for row in self.db.inventory_page(after, limit)]
+
+    def inventory_rows(self, product_ids):
+        return [list(row) for row in self.db.inventory_rows(product_ids)]
+
+    def customers(self):
+        return [{"id": customer_id, "name": name}
+                for customer_id, name in self.db.fetchall("SELECT id, name FROM customers")]
+
+    def suppliers(self):
+        return [{"id": supplier_id, "name": name}
+                for supplier_id, name in self.db.fetchall("SELECT id, name FROM suppliers")]
+
+    def _products(self, product_ids):
+        products = {product_id: self.db.get_product(product_id) for product_id in set(product_ids)}
+        missing = [product_id for product_id, product in products.items() if product is None]
+        if missing:
+            raise InventoryError(f"Unknown product id(s): {sorted(missing)}")
+        return products
+
+    def _quote(self, lines, products):
+        # lines: (product_id, quantity, rate)
+        line_results, (subtotal, tax_amount, total) = invoice_totals(
+            (quantity, rate, products[product_id].tax_rate) for product_id, quantity, rate in lines)
+        return {
+            "lines": [{"product_id": product_id, "quantity": quantity, "rate": rate, "subtotal": line_subtotal,
+                       "tax_amount": line_tax, "total": line_total}
+                      for (product_id, quantity, rate), (line_subtotal, line_tax, line_total)
+                      in zip(lines, line_results)],
+            "subtotal": subtotal,
+            "tax_amount": tax_amount,
+            "total": total,
+        }
+
+    def quote_sale(self, lines):
+        # lines: (product_id, quantity). Prices, tax and totals as posting
+        # would compute them, plus the products the stock on hand does not
+        # cover. A quote reserves nothing: posting checks the stock again.
+        lines = checked_lines(lines, "sale")
+        products = self._products(product_id for product_id, _quantity in lines)
+        quote = self._quote([(product_id, quantity, products[product_id].price) for product_id, quantity in lines],
+                            products)
+        requested = {}
+        for product_id, quantity in lines:
+            requested[product_id] = requested.get(product_id, 0) + quantity
+        quote["shortages"] = shortage_dicts(
+            (product_id, quantity, products[product_id].stock_quantity)
+            for product_id, quantity in requested.items() if quantity > products[product_id].stock_quantity)
+        return quote
+
+    def quote_receipt(self, lines):
+        # lines: (product_id, quantity, rate_per_unit)
+        lines = checked_lines(lines, "receipt")
+        return self._quote(lines, self._products(product_id for product_id, _quantity, _rate in lines))
+
+    def post_sale(self, customer_id, lines, username):
+        return {"invoice_id": self.db.post_sales_invoice(customer_id, checked_lines(lines, "sale"), username)}
+
+    def post_receipt(self, supplier_id, lines, username):
+        return {"receipt_id": self.db.post_goods_receipt(supplier_id, checked_lines(lines, "receipt"), username)}
+
+    def post_stock_movement(self, kind, product_id, quantity, username, reference_id=None, note=None):
+        return {"movement_id": self.db.post_stock_movement(kind, product_id, quantity, username,
+                                                           reference_id=reference_id, note=note)}
+
+    def reports(self):
+        return [{"name": name, "columns": [header for header, _formatter in columns]}
+                for name, columns, _sql in REPORTS]
+
+    def report(self, name, first_day, last_day, limit=-1):
+        return [list(row) for row in self.db.report(name, first_day, last_day, limit)]
+
@@ -0,0 +1,41 @@
+import hashlib
+import hmac
+import os
+import time
+
+# How long a full login lets the operator unlock the terminal cheaply
+SESSION_TTL = 8 * 60 * 60
+# Idle time after which the main window locks
+LOCK_AFTER_SECONDS = 5 * 60
+
+
+# Local session created after a full bcrypt login. The password is kept as
+# a SHA-256 HMAC under a random key that only exists in this process, so
+# unlocking an idle terminal is a microsecond check instead of another
+# bcrypt round. Once the session expires, unlocking needs the full check
+# again and renew() starts a new session.
+class LocalSession:
+    def __init__(self, username, role, password, ttl=SESSION_TTL):
+        self.username = username
+        self.role = role
+        self._ttl = ttl
+        self.renew(password)
+
+    def renew(self, password):
+        self._key = os.urandom(32)
+        self._digest = self._mac(password)
+        self.expires_at = time.monotonic() + self._ttl
+
+    def expire(self):
+        # The next unlock needs the full check
+        self.expires_at = time.monotonic()
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def verify(self, password):
+        # False once expired, whatever the password
+        return not self.expired() and hmac.compare_digest(self._digest, self._mac(password))
+
+    def _mac(self, password):
+        return hmac.new(self._key, password.encode("utf-8"), hashlib.sha256).digest()
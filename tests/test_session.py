@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication, QDialog
+
+from main import LoginDialog
+from session import LocalSession
+
+
+class QuickUnlockTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def test_quick_unlock_does_not_extend_session(self):
+        session = LocalSession("sales_operator", "sales", "password123")
+        expires_at = session.expires_at
+        # The quick path never reaches the database
+        dialog = LoginDialog(None, session)
+        dialog.password_edit.setText("password123")
+        dialog.authenticate()
+        self.assertEqual(dialog.result(), QDialog.Accepted)
+        self.assertEqual(session.expires_at, expires_at)
+
+    def test_expired_session_needs_full_login(self):
+        session = LocalSession("sales_operator", "sales", "password123", ttl=0)
+        self.assertFalse(session.verify("password123"))
+
+
+if __name__ == "__main__":
+    unittest.main()
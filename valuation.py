@@ -0,0 +1,322 @@
+import heapq
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from itertools import chain
+
+from pricing import MILLI_PER_UNIT, divide_half_up
+
+# Inventory valuation, kept current by the posting paths. Every receipt,
+# opening balance, return and positive adjustment adds a cost layer; sales
+# and negative adjustments take stock out of the oldest open layers first
+# (FIFO) and, side by side, at the weighted-average cost of the stock on
+# hand. product_costs holds each product's quantity and its value under
+# both methods, margins_by_day(_product) the revenue and cost of sales.
+# Amounts are paise and quantities milli-units, as everywhere else. Margin
+# days are local dates, like the daily summaries'.
+
+def layer_value(quantity, unit_cost):
+    return divide_half_up(quantity * unit_cost, MILLI_PER_UNIT)
+
+
+def take_from_layers(layers, quantity):
+    # layers: lists starting [layer_id, remaining, unit_cost], oldest first,
+    # updated in place. Returns the FIFO cost of quantity and the
+    # (remaining, layer_id) of every layer touched. Each take costs the drop
+    # in the layer's value, so a layer used up in pieces costs exactly its
+    # value; stock beyond the layers costs nothing.
+    cost = 0
+    touched = []
+    for layer in layers:
+        if quantity <= 0:
+            break
+        layer_id, remaining, unit_cost = layer[:3]
+        taken = min(remaining, quantity)
+        cost += layer_value(remaining, unit_cost) - layer_value(remaining - taken, unit_cost)
+        layer[1] = remaining - taken
+        quantity -= taken
+        touched.append((remaining - taken, layer_id))
+    return cost, touched
+
+
+def average_cost(quantity, stock_quantity, stock_value):
+    # What quantity carries of the stock's value at weighted-average cost;
+    # taking all of the stock takes all of its value
+    if stock_quantity <= 0:
+        return 0
+    return divide_half_up(min(quantity, stock_quantity) * stock_value, stock_quantity)
+
+
+def average_unit_cost(stock_quantity, stock_value):
+    # Paise per unit, or 0 without stock
+    return divide_half_up(stock_value * MILLI_PER_UNIT, stock_quantity) if stock_quantity > 0 else 0
+
+
+def add_cost_layers(cursor, layers):
+    # layers: (product_id, kind, reference_id, quantity, unit_cost) for
+    # stock coming in, dated now. Each adds its value to both methods.
+    cursor.executemany("""INSERT INTO cost_layers (product_id, kind, reference_id, quantity, remaining, unit_cost)
+                          VALUES (?, ?, ?, ?, ?, ?)""",
+                       [(product_id, kind, reference_id, quantity, quantity, unit_cost)
+                        for product_id, kind, reference_id, quantity, unit_cost in layers])
+    cursor.executemany("""INSERT INTO product_costs (product_id, quantity, average_value, fifo_value)
+                          VALUES (?1, ?2, ?3, ?3)
+                          ON CONFLICT (product_id) DO UPDATE SET
+                              quantity = quantity + excluded.quantity,
+                              average_value = average_value + excluded.average_value,
+                              fifo_value = fifo_value + excluded.fifo_value""",
+                       [(product_id, quantity, layer_value(quantity, unit_cost))
+                        for product_id, _kind, _reference_id, quantity, unit_cost in layers])
+
+
+def current_unit_cost(cursor, product_id):
+    # Weighted-average cost per unit, at which returns and positive
+    # adjustments come back into stock
+    cursor.execute("SELECT quantity, average_value FROM product_costs WHERE product_id = ?", (product_id,))
+    return average_unit_cost(*(cursor.fetchone() or (0, 0)))
+
+
+def issue_stock(cursor, product_id, quantity):
+    # Takes quantity out of a product's valuation; returns its (FIFO cost,
+    # average cost). Only as many open layers are read as the quantity needs.
+    cursor.execute("""SELECT id, remaining, unit_cost FROM cost_layers
+                      WHERE product_id = ? AND remaining > 0 ORDER BY id""", (product_id,))
+    layers, covered = [], 0
+    for row in cursor:
+        layers.append(list(row))
+        covered += row[1]
+        if covered >= quantity:
+            break
+    fifo_cost, touched = take_from_layers(layers, quantity)
+    cursor.executemany("UPDATE cost_layers SET remaining = ? WHERE id = ?", touched)
+
+    cursor.execute("SELECT quantity, average_value FROM product_costs WHERE product_id = ?", (product_id,))
+    stock_quantity, stock_value = cursor.fetchone() or (0, 0)
+    cost = average_cost(quantity, stock_quantity, stock_value)
+    cursor.execute("""INSERT INTO product_costs (product_id, quantity, average_value, fifo_value)
+                      VALUES (?, ?, ?, ?)
+                      ON CONFLICT (product_id) DO UPDATE SET
+                          quantity = quantity + excluded.quantity,
+                          average_value = average_value + excluded.average_value,
+                          fifo_value = fifo_value + excluded.fifo_value""",
+                   (product_id, -quantity, -cost, -fifo_cost))
+    return fifo_cost, cost
+
+
+def record_sales(cursor, lines):
+    # lines: (product_id, quantity, subtotal) of one invoice posted now.
+    # Costs every line and adds revenue and costs to today's margins.
+    margins = {}
+    for product_id, quantity, subtotal in lines:
+        fifo_cost, cost = issue_stock(cursor, product_id, quantity)
+        margin = margins.setdefault(product_id, [0, 0, 0, 0])
+        margin[0] += quantity
+        margin[1] += subtotal
+        margin[2] += fifo_cost
+        margin[3] += cost
+    totals = [sum(margin[i] for margin in margins.values()) for i in range(4)]
+    cursor.executemany("""INSERT INTO margins_by_day_product
+                          (day, product_id, quantity, revenue, fifo_cost, average_cost)
+                          VALUES (date('now', 'localtime'), ?, ?, ?, ?, ?)
+                          ON CONFLICT (day, product_id) DO UPDATE SET
+                              quantity = quantity + excluded.quantity,
+                              revenue = revenue + excluded.revenue,
+                              fifo_cost = fifo_cost + excluded.fifo_cost,
+                              average_cost = average_cost + excluded.average_cost""",
+                       [(product_id, *margin) for product_id, margin in margins.items()])
+    cursor.execute("""INSERT INTO margins_by_day (day, quantity, revenue, fifo_cost, average_cost)
+                      VALUES (date('now', 'localtime'), ?, ?, ?, ?)
+                      ON CONFLICT (day) DO UPDATE SET
+                          quantity = quantity + excluded.quantity,
+                          revenue = revenue + excluded.revenue,
+                          fifo_cost = fifo_cost + excluded.fifo_cost,
+                          average_cost = average_cost + excluded.average_cost""", totals)
+
+
+def local_day(moment):
+    # The local date of a stored UTC timestamp, as date(moment, 'localtime')
+    return datetime.fromisoformat(moment).replace(tzinfo=timezone.utc).astimezone().date().isoformat()
+
+
+def utc_moment(day):
+    # The stored UTC timestamp at which local day 'YYYY-MM-DD' starts
+    return datetime.fromisoformat(day).astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _has_table(db_manager, schema, table):
+    # Archives made before a table was archived do not have it
+    return db_manager.connection.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                                         (table,)).fetchone() is not None
+
+
+def _history_events(db_manager, schemas, first_moment, moment_after):
+    # Every stock event from first_moment up to (not including)
+    # moment_after, in posting order, merged from three streams that each
+    # come sorted off a date index: (moment, movement id, line id, kind,
+    # product_id, quantity, amount, reference_id). Within a second the stock
+    # ledger's ids give the order the postings were made in. amount is the
+    # unit cost of a receipt and the revenue of a sale. Archives hold the
+    # closed years, so lines are read oldest first, then the live tables. A
+    # line's movement is in its year's archive, or still in the live ledger
+    # if no snapshot covered it when the year was archived.
+    ledgers = {schema: schema if _has_table(db_manager, schema, "stock_movements") else "main"
+               for schema in schemas}
+
+    def stream(sql, schema_list):
+        return chain.from_iterable(db_manager.connection.execute(sql.format(schema=schema, ledger=ledgers[schema]),
+                                                                 (first_moment, moment_after))
+                                   for schema in schema_list)
+
+    def movement_id(line, kind, reference):
+        lookup = f"""(SELECT MIN(m.id) FROM {{ledger}}.stock_movements m
+                      WHERE m.product_id = {line}.product_id AND m.kind = '{kind}'
+                        AND m.reference_id = {line}.{reference})"""
+        return f"COALESCE({lookup}, {lookup.replace('{ledger}', 'main')}, 0)"
+
+    receipts = stream(f"""SELECT g.date_received, {movement_id("g", "receipt", "receipt_id")}, g.id, 'receipt',
+                                 g.product_id, g.quantity, g.rate_per_unit, g.receipt_id
+                          FROM {{schema}}.goods_receiving g
+                          WHERE g.date_received >= ? AND g.date_received < ? AND g.product_id IS NOT NULL
+                          ORDER BY g.date_received, g.id""", schemas)
+    sales = stream(f"""SELECT s.date_sold, {movement_id("s", "sale", "invoice_id")}, s.id, 'sale',
+                              s.product_id, s.quantity, s.total_amount - COALESCE(s.tax_amount, 0), s.invoice_id
+                       FROM {{schema}}.sales s
+                       WHERE s.date_sold >= ? AND s.date_sold < ? AND s.product_id IS NOT NULL
+                       ORDER BY s.date_sold, s.id""", schemas)
+    movements = db_manager.connection.execute("""SELECT moved_at, id, id, kind, product_id, quantity, 0, reference_id
+                                                 FROM stock_movements_history
+                                                 WHERE moved_at >= ? AND moved_at < ?
+                                                   AND kind IN ('opening', 'adjustment', 'return')
+                                                 ORDER BY moved_at, id""", (first_moment, moment_after))
+    return heapq.merge(receipts, sales, movements, key=lambda event: event[:3])
+
+
+def _history_months(db_manager, schemas):
+    # (first day, day after) of every local calendar month from the first
+    # stock event to today, 'YYYY-MM-DD'; the last month's day after is None
+    firsts = []
+    for schema in schemas:
+        firsts += [f"SELECT MIN(date_received) AS moment FROM {schema}.goods_receiving",
+                   f"SELECT MIN(date_sold) FROM {schema}.sales"]
+        if _has_table(db_manager, schema, "stock_movements"):
+            firsts.append(f"SELECT MIN(moved_at) FROM {schema}.stock_movements")
+    first, today = db_manager.connection.execute(f"""
+        SELECT date(MIN(moment), 'localtime'), date('now', 'localtime') FROM ({" UNION ALL ".join(firsts)})""").fetchone()
+    if first is None:
+        return
+    month_first = date.fromisoformat(first).replace(day=1)
+    last = date.fromisoformat(max(first, today)).replace(day=1)
+    while month_first < last:
+        next_month = (month_first + timedelta(days=32)).replace(day=1)
+        yield month_first.isoformat(), next_month.isoformat()
+        month_first = next_month
+    yield month_first.isoformat(), None
+
+
+def rebuild_valuation(db_manager, progress=None):
+    # Recomputes the cost layers, product costs and margins from the whole
+    # history (archives included) in one streaming pass over the receipts,
+    # sales and stock movements in time order, one calendar month per
+    # transaction so postings are only held up briefly. Only the open cost
+    # layers and each product's costs are kept in memory; used-up layers
+    # and a month's margins are written as the pass moves on. Until the
+    # last month, which runs up to the present and writes the open layers
+    # and product costs, the tables hold a partial valuation, and postings
+    # made meanwhile are replayed from their lines rather than kept. Returns
+    # the number of events replayed.
+    report = progress or (lambda message: None)
+    with db_manager.history() as schemas:
+        with db_manager.transaction(immediate=True) as cursor:
+            for table in ("cost_layers", "product_costs", "margins_by_day", "margins_by_day_product"):
+                cursor.execute(f"DELETE FROM {table}")
+            # Used-up layers archived earlier are written again, with new ids,
+            # to the live table; archiving the year moves them back
+            for schema in schemas[:-1]:
+                if _has_table(db_manager, schema, "cost_layers"):
+                    cursor.execute(f"DELETE FROM {schema}.cost_layers")
+
+        # layer: [id, remaining, unit_cost, product_id, kind, reference, moment, quantity]
+        open_layers = {}     # product_id -> its layers not yet written, oldest first
+        costs = {}           # product_id -> [quantity, average value, fifo value]
+        layer_count = written_layers = events = 0
+
+        for month_first, month_after in list(_history_months(db_manager, schemas)):
+            with db_manager.transaction(immediate=True) as cursor:
+                # Drop what postings made since the last month added; their
+                # lines and movements are replayed below
+                cursor.execute("DELETE FROM cost_layers WHERE id > ?", (written_layers,))
+                for table in ("margins_by_day", "margins_by_day_product"):
+                    cursor.execute(f"DELETE FROM {table} WHERE day >= ?", (month_first,))
+                finished = []    # layers to write: used up, or all of them at the end
+                day, day_margins = None, {}
+                minute = None
+
+                def flush_day():
+                    if not day_margins:
+                        return
+                    cursor.executemany("""INSERT INTO margins_by_day_product
+                                          (day, product_id, quantity, revenue, fifo_cost, average_cost)
+                                          VALUES (?, ?, ?, ?, ?, ?)""",
+                                       [(day, product_id, *margin) for product_id, margin in day_margins.items()])
+                    cursor.execute("""INSERT INTO margins_by_day (day, quantity, revenue, fifo_cost, average_cost)
+                                      VALUES (?, ?, ?, ?, ?)""",
+                                   [day] + [sum(margin[i] for margin in day_margins.values()) for i in range(4)])
+                    day_margins.clear()
+
+                for moment, _movement_id, _line_id, kind, product_id, quantity, amount, reference_id in \
+                        _history_events(db_manager, schemas, utc_moment(month_first),
+                                        utc_moment(month_after) if month_after else "9999-12-31"):
+                    state = costs.setdefault(product_id, [0, 0, 0])
+                    if kind == "sale" or quantity < 0:
+                        quantity = abs(quantity)
+                        product_layers = open_layers.get(product_id, ())
+                        fifo_cost, _touched = take_from_layers(product_layers, quantity)
+                        while product_layers and product_layers[0][1] == 0:
+                            finished.append(product_layers.popleft())
+                        cost = average_cost(quantity, state[0], state[1])
+                        state[0] -= quantity
+                        state[1] -= cost
+                        state[2] -= fifo_cost
+                        if kind == "sale":
+                            # Time zones are offset by whole quarter hours
+                            if moment[:16] != minute:
+                                minute = moment[:16]
+                                if local_day(moment) != day:
+                                    flush_day()
+                                    day = local_day(moment)
+                            margin = day_margins.setdefault(product_id, [0, 0, 0, 0])
+                            margin[0] += quantity
+                            margin[1] += amount
+                            margin[2] += fifo_cost
+                            margin[3] += cost
+                    else:
+                        if kind == "receipt":
+                            unit_cost = amount
+                        elif kind == "opening":
+                            unit_cost = 0
+                        else:
+                            unit_cost = average_unit_cost(state[0], state[1])
+                        layer_count += 1
+                        open_layers.setdefault(product_id, deque()).append(
+                            [layer_count, quantity, unit_cost, product_id, kind, reference_id, moment, quantity])
+                        value = layer_value(quantity, unit_cost)
+                        state[0] += quantity
+                        state[1] += value
+                        state[2] += value
+                    events += 1
+                flush_day()
+
+                if month_after is None:
+                    # The present: the open layers and the product costs,
+                    # replacing whatever postings made of them
+                    finished.extend(chain.from_iterable(open_layers.values()))
+                    cursor.execute("DELETE FROM product_costs")
+                    cursor.executemany("""INSERT INTO product_costs (product_id, quantity, average_value, fifo_value)
+                                          VALUES (?, ?, ?, ?)""",
+                                       [(product_id, *state) for product_id, state in costs.items()])
+                cursor.executemany("""INSERT INTO cost_layers
+                                      (id, remaining, unit_cost, product_id, kind, reference_id, created_at, quantity)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", finished)
+                written_layers = max([written_layers] + [layer[0] for layer in finished])
+            report(f"valuation: {month_first[:7]} replayed, {events} events so far")
+        report(f"valuation: {events} events replayed, {layer_count} cost layers")
+        return events
@@ -0,0 +1,141 @@
+from PySide6.QtCore import QEvent, QModelIndex, QObject, Qt, QTimer, Signal
+from PySide6.QtWidgets import QApplication, QCompleter, QLineEdit
+
+from models import ProductListModel
+
+
+def product_label(product):
+    return f"{product.product_name} ({product.sku_id})"
+
+
+# Line edit that emits search_requested(text) once typing has paused for
+# DEBOUNCE_MS, instead of on every keystroke
+class SearchBox(QLineEdit):
+    DEBOUNCE_MS = 200
+    search_requested = Signal(str)
+
+    def __init__(self, placeholder="", parent=None):
+        super().__init__(parent)
+        self.setPlaceholderText(placeholder)
+        self.setClearButtonEnabled(True)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(self._emit_search)
+        self.textChanged.connect(self._timer.start)
+
+    def _emit_search(self):
+        self.search_requested.emit(self.text().strip())
+
+
+# Product selector that scales to any catalog size: nothing is loaded up
+# front. Typing searches the catalog through the executor and offers the
+# best matches in a completer popup; with an empty box the popup offers the
+# products picked most recently. product_changed(product_id) fires when the
+# selection changes, with None once the operator types over it.
+class ProductPicker(SearchBox):
+    MATCHES = 20
+    RECENT_SIZE = 10
+    product_changed = Signal(object)
+
+    def __init__(self, db_manager, executor, parent=None):
+        super().__init__("Type a product name, SKU or barcode", parent)
+        self._db = db_manager
+        self._executor = executor
+        self._product_id = None
+        self._recent = []
+        self._matches = ProductListModel(self)
+        self._completer = QCompleter(self._matches, self)
+        self._completer.setWidget(self)
+        self._completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self._completer.setMaxVisibleItems(self.MATCHES)
+        self._completer.activated[QModelIndex].connect(self._activated)
+        self.textEdited.connect(self._edited)
+        self.search_requested.connect(self._search)
+
+    def product_id(self):
+        return self._product_id
+
+    def set_product(self, product):
+        # product: a ProductRecord, or None to clear the picker
+        self._select(product.id if product else None)
+        self.setText(product_label(product) if product else "")
+        if product:
+            if product.id in self._recent:
+                self._recent.remove(product.id)
+            self._recent.insert(0, product.id)
+            del self._recent[self.RECENT_SIZE:]
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        if not self.text():
+            self._show_recent()
+
+    def _select(self, product_id):
+        if product_id != self._product_id:
+            self._product_id = product_id
+            self.product_changed.emit(product_id)
+
+    def _edited(self, text):
+        self._select(None)
+
+    def _search(self, text):
+        # While a product is picked the text is its label, not a query
+        if self._product_id is not None:
+            return
+        if not text:
+            self._show_recent()
+            return
+        self._executor.submit(self._db.search_products, text, self.MATCHES,
+                              on_result=lambda rows: self._show_matches(text, rows))
+
+    def _show_matches(self, text, rows):
+        # Results for text the operator has since changed are dropped
+        if self._product_id is not None or text != self.text().strip():
+            return
+        self._show([(row[0], f"{row[5]} ({row[2]})") for row in rows])
+
+    def _show_recent(self):
+        products = [self._db.get_product(product_id) for product_id in self._recent]
+        self._show([(product.id, product_label(product)) for product in products if product])
+
+    def _show(self, items):
+        self._matches.set_items(items)
+        if items and self.hasFocus():
+            self._completer.complete()
+        else:
+            self._completer.popup().hide()
+
+    def _activated(self, index):
+        self.set_product(self._db.get_product(index.data(Qt.UserRole)))
+
+
+# Emits idle() once there has been no keyboard or mouse input anywhere in
+# the application for `seconds`
+class IdleWatcher(QObject):
+    INPUT_EVENTS = (QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.MouseMove, QEvent.Wheel)
+    idle = Signal()
+
+    def __init__(self, seconds, parent=None):
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(int(seconds * 1000))
+        self._timer.timeout.connect(self.idle)
+        QApplication.instance().installEventFilter(self)
+        self._timer.start()
+
+    def eventFilter(self, watched, event):
+        if event.type() in self.INPUT_EVENTS and self._timer.isActive():
+            self._timer.start()
+        return False
+
+    def start(self):
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def detach(self):
+        self._timer.stop()
+        QApplication.instance().removeEventFilter(self)
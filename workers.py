@@ -0,0 +1,66 @@
+import traceback
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+class TaskSignals(QObject):
+    result = Signal(object)
+    error = Signal(object)
+    done = Signal()
+
+
+class DbTask(QRunnable):
+    def __init__(self, func, args, kwargs, signals):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = signals
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            e.traceback = traceback.format_exc()
+            self.signals.error.emit(e)
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.done.emit()
+
+
+# Runs database work off the GUI thread. Reads go to a small pool; writes go
+# to a single-thread pool so postings from one terminal are serialized.
+# Callbacks are delivered on the thread that owns the executor (the GUI).
+# Pool threads never expire because DatabaseManager keeps one connection
+# per thread.
+class DbExecutor(QObject):
+    def __init__(self, read_threads=2, parent=None):
+        super().__init__(parent)
+        self.read_pool = QThreadPool(self)
+        self.read_pool.setMaxThreadCount(read_threads)
+        self.read_pool.setExpiryTimeout(-1)
+        self.write_pool = QThreadPool(self)
+        self.write_pool.setMaxThreadCount(1)
+        self.write_pool.setExpiryTimeout(-1)
+        self._pending = set()
+
+    def submit(self, func, *args, on_result=None, on_error=None, write=False, **kwargs):
+        signals = TaskSignals(self)
+        if on_result is not None:
+            signals.result.connect(on_result)
+        if on_error is not None:
+            signals.error.connect(on_error)
+        self._pending.add(signals)
+        signals.done.connect(lambda: self._finish(signals))
+
+        pool = self.write_pool if write else self.read_pool
+        pool.start(DbTask(func, args, kwargs, signals))
+
+    def _finish(self, signals):
+        self._pending.discard(signals)
+        signals.deleteLater()
+
+    def wait(self, msecs=-1):
+        self.read_pool.waitForDone(msecs)
+        self.write_pool.waitForDone(msecs)